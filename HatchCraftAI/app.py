@@ -1,18 +1,96 @@
 import streamlit as st
 import numpy as np
-from core_logic import DXFtoPatConverter, ImageToPatConverter, render_pat_preview
+from concurrent.futures import ThreadPoolExecutor
+from core_logic import DXFtoPatConverter, ImageToPatConverter, PatCache
+from disk_cache import DiskCache
+from fidelity import check_fidelity
+from jobs import JobSlot, job_key
+from pat_export import export_png, export_svg
+from pat_library import PatLibrary
+import io
 import tempfile
 import os
 
 st.set_page_config(page_title="HatchCraft - Pattern Generator", layout="wide")
 
+
+@st.cache_resource
+def get_pat_cache():
+    """Cache de patrones/previews compartido entre reruns y sesiones"""
+    return PatCache()
+
+
+@st.cache_resource
+def get_disk_cache():
+    """Cache de conversiones en disco, compartido también entre procesos"""
+    directory = os.environ.get("HATCHCRAFT_CACHE_DIR",
+                               os.path.join(os.path.expanduser("~"), ".cache", "hatchcraft"))
+    return DiskCache(directory)
+
+
+@st.cache_resource
+def get_executor():
+    """Hilos compartidos por todas las sesiones para convertir en segundo plano"""
+    return ThreadPoolExecutor(max_workers=os.cpu_count() or 1,
+                              thread_name_prefix="hatchcraft")
+
+
+def get_job_slot(name):
+    """Slot de conversión de la sesión para una entrada (un trabajo en curso por slot)"""
+    if "jobs" not in st.session_state:
+        st.session_state.jobs = {}
+    if name not in st.session_state.jobs:
+        st.session_state.jobs[name] = JobSlot(get_executor())
+    return st.session_state.jobs[name]
+
+
+def watch_job(slot):
+    """Mientras el slot trabaja, lo revisa cada medio segundo y al terminar recarga la app"""
+    @st.fragment(run_every=0.5)
+    def poll():
+        if not slot.busy:
+            st.rerun()
+        st.caption("⏳ Convirtiendo... se muestra el último resultado")
+    
+    if slot.busy:
+        poll()
+
+
+def show_job_result(slot, success=st.caption):
+    """Estado del último resultado terminado; lo deja como resultado de la sesión"""
+    result = slot.result
+    if result is None:
+        return
+    if "error" in result:
+        st.error(result["error"])
+    else:
+        st.session_state.result = result
+        success(result["stats"])
+
+
+def convert_dxf(dxf_bytes, cancelled=None, **params):
+    """Convierte un DXF recibido como bytes (se ejecuta en un hilo del executor)"""
+    tmp_path = None
+    try:
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.dxf', mode='wb') as tmp:
+            tmp.write(dxf_bytes)
+            tmp_path = tmp.name
+        return DXFtoPatConverter().convert(tmp_path, preview=False, cancelled=cancelled,
+                                           **params)
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
 st.title("HatchCraft 📐✨")
 st.markdown("### Convierte dibujos y imágenes a patrones para Revit")
 
 # Selector de modo
 mode = st.radio("Selecciona el modo:", 
-                ["📁 DXF (AutoCAD)", "🖼️ Imagen (Canny/Skeleton)"], 
+                ["📁 DXF (AutoCAD)", "🖼️ Imagen (Canny/Skeleton)", "📚 Biblioteca .pat"], 
                 horizontal=True)
+show_metrics = st.toggle("Métricas por etapa", value=False, key="show_metrics",
+                         help="Mide tiempo, memoria y cantidades de cada etapa de la conversión")
 
 col1, col2 = st.columns([1, 1])
 
@@ -27,31 +105,32 @@ with col1:
             key="dxf_uploader"
         )
         
+        chord_tolerance = st.number_input(
+            "Tolerancia de curvas", min_value=0.0, value=0.0, step=0.01, format="%.4f",
+            help="Flecha máxima al aproximar arcos, círculos, elipses y splines (unidades del dibujo). 0 = automática"
+        )
+        detect_lattice = st.checkbox(
+            "Detectar copias repetidas", value=True,
+            help="Si el dibujo es una grilla de copias, emite solo una celda con los deltas de la retícula"
+        )
+        
         if uploaded_file:
             st.success(f"✅ {uploaded_file.name}")
             
-            tmp_path = None
-            try:
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.dxf', mode='wb') as tmp:
-                    tmp.write(uploaded_file.getvalue())
-                    tmp_path = tmp.name
-                
-                with st.spinner("🔄 Convirtiendo DXF a PAT..."):
-                    converter = DXFtoPatConverter()
-                    result = converter.convert(tmp_path)
-                
-                if "error" in result:
-                    st.error(result["error"])
-                else:
-                    st.session_state.result = result
-                    st.success(result["stats"])
-            except Exception as e:
-                st.error(f"Error: {str(e)}")
-            finally:
-                if tmp_path and os.path.exists(tmp_path):
-                    os.unlink(tmp_path)
+            # La conversión corre en segundo plano; cambiar un parámetro
+            # descarta el pedido anterior si todavía no empezó
+            slot = get_job_slot("dxf")
+            dxf_bytes = uploaded_file.getvalue()
+            params = dict(chord_tolerance=chord_tolerance or None, metrics=show_metrics,
+                          lattice=detect_lattice)
+            slot.submit(job_key(dxf_bytes, **params),
+                        lambda cancelled: get_disk_cache().convert(
+                            "dxf", dxf_bytes, params,
+                            lambda: convert_dxf(dxf_bytes, cancelled, **params)))
+            watch_job(slot)
+            show_job_result(slot, success=st.success)
     
-    else:  # Modo Imagen
+    elif mode == "🖼️ Imagen (Canny/Skeleton)":
         st.subheader("🖼️ Subir Imagen")
         st.caption("Para patrones orgánicos (piedra, texturas naturales)")
         
@@ -69,18 +148,94 @@ with col1:
             blur_size = st.slider("Blur", 1, 11, 3, 2, key="blur")
             min_contour = st.slider("Longitud mín. contorno", 5, 100, 20, key="min_cont")
             epsilon = st.slider("Suavizado", 0.001, 0.05, 0.01, key="epsilon")
+            engine = st.selectbox(
+                "Motor", ["contours", "hough"], key="engine",
+                help="contours: skeleton + contornos (texturas orgánicas). "
+                     "hough: líneas rectas enteras (ladrillo, baldosa, tablas)"
+            )
+            if engine == "hough":
+                hough_threshold = st.slider("Votos Hough", 10, 200, 40, key="hough_threshold")
+                hough_max_gap = st.slider("Hueco máx. (px)", 0, 50, 5, key="hough_max_gap")
+                thinning_method = "morphological"
+            else:
+                hough_threshold, hough_max_gap = 40, 5
+                thinning_method = st.selectbox("Skeleton",
+                                               ["morphological", "zhang_suen", "guo_hall"],
+                                               key="thinning")
+            max_memory = st.number_input(
+                "Memoria máx. (MB)", min_value=0, value=0, step=64, key="max_memory",
+                help="Procesa por teselas sin superar este límite (escaneos muy grandes). 0 = imagen completa"
+            )
+            max_lines = st.number_input(
+                "Máx. líneas", min_value=0, value=0, step=50, key="max_lines",
+                help="Une tramos colineales y descarta los más cortos hasta este límite. 0 = sin límite"
+            )
+            max_error = st.number_input(
+                "Desvío máx. (px)", min_value=0.0, value=0.0, step=0.5, key="max_error",
+                help="Desvío permitido al simplificar, en píxeles de la imagen; con máx. líneas manda el desvío. 0 = sin simplificar"
+            )
             
-            # Procesar automáticamente al cambiar cualquier slider
-            converter = ImageToPatConverter()
+            # Procesar automáticamente al cambiar cualquier slider, en segundo
+            # plano: mientras se arrastra un slider solo corre el último pedido
+            # y se sigue mostrando el resultado anterior. El conversor vive en
+            # la sesión para reutilizar las etapas memoizadas. El preview lo
+            # dibuja la pestaña Preview con su propio cache
+            if "img_converter" not in st.session_state:
+                st.session_state.img_converter = ImageToPatConverter()
+            converter = st.session_state.img_converter
+            slot = get_job_slot("image")
             image_bytes = uploaded_file.getvalue()
-            result = converter.convert(image_bytes, canny_low, canny_high, 
-                                       blur_size, min_contour, epsilon)
+            params = dict(canny_low=canny_low, canny_high=canny_high, blur_size=blur_size,
+                          min_contour_len=min_contour, epsilon_factor=epsilon,
+                          thinning_method=thinning_method, metrics=show_metrics,
+                          max_memory_mb=max_memory or None, max_lines=max_lines or None,
+                          max_error=max_error or None, engine=engine,
+                          hough_threshold=hough_threshold, hough_max_gap=hough_max_gap)
+            slot.submit(job_key(image_bytes, **params),
+                        lambda cancelled: get_disk_cache().convert(
+                            "image", image_bytes, params,
+                            lambda: converter.convert(image_bytes, preview=False,
+                                                      cancelled=cancelled, **params)))
+            watch_job(slot)
+            show_job_result(slot)
+    
+    else:  # Modo Biblioteca
+        st.subheader("📚 Abrir biblioteca .pat")
+        st.caption("Explora bibliotecas con muchos patrones y exporta uno solo")
+        
+        uploaded_file = st.file_uploader(
+            "Arrastra un archivo .pat",
+            type=["pat"],
+            key="pat_uploader"
+        )
+        
+        if uploaded_file:
+            # El índice se arma una vez por archivo; cada patrón se parsea al elegirlo
+            library_key = job_key(uploaded_file.getvalue())
+            if st.session_state.get("library_key") != library_key:
+                st.session_state.library = PatLibrary(uploaded_file.getvalue())
+                st.session_state.library_key = library_key
+            library = st.session_state.library
             
-            if "error" in result:
-                st.error(result["error"])
+            if not len(library):
+                st.error("El archivo no tiene cabeceras *Nombre de patrón")
             else:
-                st.session_state.result = result
-                st.caption(result["stats"])
+                query = st.text_input("🔎 Buscar", key="library_query")
+                names = library.search(query) if query else library.names
+                st.caption(f"{len(names)} de {len(library)} patrones")
+                if names:
+                    name = st.selectbox("Patrón", names, key="library_pattern")
+                    info = library.info(name)
+                    pat_content = library.text(name)
+                    st.session_state.result = {
+                        "pat_content": pat_content,
+                        "revit": True,
+                        "stats": (f"📚 {info['name']} ({info['type']})"
+                                  f" — {len(library.pattern(name))} líneas"),
+                    }
+                    st.caption(st.session_state.result["stats"])
+                    if info["description"]:
+                        st.caption(info["description"])
 
 with col2:
     st.subheader("🔲 Resultado")
@@ -97,12 +252,36 @@ with col2:
                 st.image(result["debug_img"], use_container_width=True)
             else:
                 st.info("Sin imagen de debug")
+            
+            if "source_segments" in result:
+                with st.expander("🎯 Fidelidad PAT vs. origen"):
+                    if st.button("Verificar", key="fidelity_run"):
+                        with st.spinner("🎯 Comparando..."):
+                            report = check_fidelity(
+                                get_pat_cache().pattern(result["pat_content"]),
+                                result["source_segments"],
+                                period=result.get("source_period"), diff_image=True)
+                        c1, c2, c3 = st.columns(3)
+                        c1.metric("Score", f"{report['score']:.3f}")
+                        c2.metric("Cobertura", f"{report['coverage']:.1%}")
+                        c3.metric("Precisión", f"{report['precision']:.1%}")
+                        st.caption(f"Hausdorff {report['hausdorff']:.4g} "
+                                   f"(tolerancia {report['tolerance']:.4g})")
+                        st.image(report["diff_img"], use_container_width=True,
+                                 caption="Rojo: origen sin cubrir · Azul: PAT sin origen")
         
         with tab_preview:
             preview_scale = st.slider("🔍 Escala", 0.1, 10.0, 1.0, 0.1)
-            pat_preview = render_pat_preview(result["pat_content"], tile_count=3, 
-                                             preview_size=600, manual_scale=preview_scale)
-            st.image(pat_preview, caption="Preview tileado (3x3)", use_container_width=True)
+            # Con retícula los deltas solo se ven bien en semántica Revit
+            revit_mode = st.toggle("Semántica Revit (familias de líneas)",
+                                   value="lattice" in result or result.get("revit", False),
+                                   key="revit_mode")
+            tile_count = st.slider("Tiles", 1, 50, 3, key="tile_count") if revit_mode else 3
+            pat_preview = get_pat_cache().render(result["pat_content"], tile_count=tile_count,
+                                                 preview_size=600, manual_scale=preview_scale,
+                                                 revit=revit_mode)
+            st.image(pat_preview, caption=f"Preview tileado ({tile_count}x{tile_count})",
+                     use_container_width=True)
         
         with tab_code:
             st.code(result["pat_content"], language="text")
@@ -116,6 +295,39 @@ with col2:
                 use_container_width=True
             )
             st.info("**En Revit:** Manage → Additional Settings → Fill Patterns → Import")
+            
+            with st.expander("🖨️ Lámina para impresión"):
+                export_format = st.radio("Formato", ["PNG", "SVG"], horizontal=True,
+                                         key="export_format")
+                export_width = st.number_input("Ancho (px)", min_value=500, max_value=20000,
+                                               value=4000, step=500, key="export_width")
+                export_tiles = st.slider("Tiles a lo ancho", 1, 50, 10, key="export_tiles")
+                if st.button("Generar lámina", key="export_build"):
+                    # Se escribe por franjas: la memoria no depende del tamaño
+                    sheet = io.BytesIO()
+                    pattern = get_pat_cache().pattern(result["pat_content"])
+                    with st.spinner("🖨️ Generando lámina..."):
+                        if export_format == "PNG":
+                            export_png(pattern, sheet, width=export_width,
+                                       tile_count=export_tiles, dpi=300)
+                        else:
+                            export_svg(pattern, sheet, width=export_width,
+                                       tile_count=export_tiles)
+                    ext = export_format.lower()
+                    st.download_button(
+                        f"📥 Descargar lámina .{export_format}",
+                        sheet.getvalue(),
+                        f"HatchCraft_lamina.{ext}",
+                        "image/png" if ext == "png" else "image/svg+xml",
+                        use_container_width=True
+                    )
+        
+        if result.get("metrics"):
+            with st.expander("⏱️ Métricas por etapa"):
+                m = result["metrics"]
+                st.dataframe(m["stages"], use_container_width=True, hide_index=True)
+                peak = f", pico {m['peak_mb']:.1f} MB" if m["peak_mb"] is not None else ""
+                st.caption(f"Total: {m['total_s']:.3f} s{peak}")
     else:
         empty_img = np.ones((400, 400, 3), dtype=np.uint8) * 240
         st.image(empty_img, caption="El patrón aparecerá aquí")
@@ -124,6 +336,7 @@ with col2:
 st.divider()
 st.markdown("""
 **Modos disponibles:**
-- **DXF**: Dibuja en AutoCAD con líneas precisas. Ángulos cada 15°.
-- **Imagen**: Detecta bordes automáticamente. Ideal para texturas orgánicas.
+- **DXF**: Dibuja en AutoCAD con líneas, polilíneas, arcos y bloques. Ángulos cada 15°.
+- **Imagen**: Detecta bordes automáticamente. Motor contours para texturas orgánicas, hough para juntas rectas.
+- **Biblioteca**: Abre un .pat con varios patrones, busca por nombre y previsualiza cada uno.
 """)
\ No newline at end of file
@@ -0,0 +1,211 @@
+"""Conversión por lotes sin interfaz.
+
+Convierte directorios de DXF e imágenes en paralelo, escribe un .pat por
+archivo, una biblioteca .pat con todos los patrones y un resumen JSON.
+
+Uso:
+    python batch_cli.py entrada/ [otra/] -o salida/ [--params params.json]
+                        [--workers N] [--library HatchCraft_Library.pat]
+
+El archivo de parámetros es opcional:
+    {
+        "dxf":   {"consolidate": true},
+        "image": {"canny_low": 50, "canny_high": 150, "epsilon_factor": 0.01},
+        "files": {
+            "piedra_*.jpg": {"blur_size": 5},
+            "muros/ladrillo.dxf": {"consolidate": false}
+        }
+    }
+"dxf" e "image" son los valores por defecto de cada tipo; las claves de
+"files" son patrones glob contra la ruta relativa o el nombre del archivo y
+se aplican en orden, así que las más específicas deben ir al final. Para
+escaneos muy grandes conviene {"max_memory_mb": 512, "workers": 1} en las
+imágenes: se procesan por teselas sin superar ese límite por proceso. Con
+{"max_lines": 500} o {"max_error": 1.5} se simplifica cada patrón a ese
+presupuesto de líneas o de desvío en píxeles. Para ladrillo, baldosa o
+tablas conviene {"engine": "hough"}.
+"""
+import argparse
+import fnmatch
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from core_logic import DXFtoPatConverter, ImageToPatConverter
+
+DXF_EXTENSIONS = (".dxf",)
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+def find_inputs(paths):
+    """Archivos DXF e imagen bajo las rutas dadas, como (ruta, relativa, tipo)"""
+    found = []
+    for root in paths:
+        if os.path.isfile(root):
+            candidates = [(root, os.path.basename(root))]
+        else:
+            candidates = []
+            for dirpath, _, filenames in os.walk(root):
+                for filename in sorted(filenames):
+                    full = os.path.join(dirpath, filename)
+                    candidates.append((full, os.path.relpath(full, root)))
+        for full, rel in sorted(candidates, key=lambda c: c[1]):
+            ext = os.path.splitext(full)[1].lower()
+            if ext in DXF_EXTENSIONS:
+                found.append((full, rel, "dxf"))
+            elif ext in IMAGE_EXTENSIONS:
+                found.append((full, rel, "image"))
+    return found
+
+
+def params_for(rel_path, kind, config):
+    """Parámetros de conversión: defaults del tipo + coincidencias en "files" """
+    params = dict(config.get(kind, {}))
+    rel = rel_path.replace(os.sep, "/")
+    for pattern, overrides in config.get("files", {}).items():
+        if fnmatch.fnmatch(rel, pattern) or fnmatch.fnmatch(os.path.basename(rel), pattern):
+            params.update(overrides)
+    return params
+
+
+def pattern_name(rel_path):
+    """Nombre de patrón válido para Revit a partir de la ruta relativa"""
+    stem = os.path.splitext(rel_path.replace(os.sep, "/"))[0]
+    return re.sub(r"[^0-9A-Za-z_\-]+", "_", stem).strip("_") or "Pattern"
+
+
+def rename_pattern(pat_content, name):
+    """Reemplaza el nombre de la cabecera *Nombre, descripción del patrón"""
+    lines = pat_content.split("\r\n")
+    for i, line in enumerate(lines):
+        if line.startswith("*"):
+            description = line.split(",", 1)[1] if "," in line else ""
+            lines[i] = f"*{name},{description}" if description else f"*{name}"
+            break
+    return "\r\n".join(lines)
+
+
+def convert_file(path, kind, params):
+    """Convierte un archivo; se ejecuta en un proceso del pool"""
+    start = time.perf_counter()
+    # Sin imagen de debug ni preview: el lote solo usa el texto PAT
+    params = dict(params, debug_image=False, preview=False)
+    try:
+        if kind == "dxf":
+            result = DXFtoPatConverter().convert(path, **params)
+        else:
+            with open(path, "rb") as f:
+                image_bytes = f.read()
+            result = ImageToPatConverter().convert(image_bytes, **params)
+    except Exception as e:
+        result = {"error": f"Error: {str(e)}"}
+    # Solo datos livianos vuelven al proceso principal, sin imágenes
+    return {
+        "pat_content": result.get("pat_content"),
+        "stats": result.get("stats"),
+        "error": result.get("error"),
+        "seconds": round(time.perf_counter() - start, 4),
+    }
+
+
+def run_batch(inputs, output_dir, config=None, workers=None,
+              library_name="HatchCraft_Library.pat", summary_name="summary.json"):
+    """Convierte `inputs` (de find_inputs) en paralelo y escribe los resultados.
+
+    Devuelve el resumen que también se guarda como JSON.
+    """
+    config = config or {}
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = [(full, rel, kind, params_for(rel, kind, config)) for full, rel, kind in inputs]
+
+    results = [None] * len(jobs)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(convert_file, full, kind, params): i
+                   for i, (full, _, kind, params) in enumerate(jobs)}
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                # p. ej. BrokenProcessPool si un proceso murió: se registra y
+                # el lote sigue con los demás archivos
+                results[futures[future]] = {"pat_content": None, "stats": None,
+                                            "error": f"Error: {str(e)}", "seconds": None}
+
+    entries = []
+    library = []
+    # La biblioteca combinada se escribe en el mismo directorio: su nombre
+    # queda reservado para que ningún patrón la pise (ni ella a él)
+    used_names = {os.path.splitext(library_name)[0].lower()}
+    for (full, rel, kind, params), result in zip(jobs, results):
+        entry = {"file": full, "kind": kind, "params": params,
+                 "seconds": result["seconds"], "stats": result["stats"],
+                 "error": result["error"], "name": None, "output": None, "lines": 0}
+        if result["pat_content"] and not result["error"]:
+            # Nombres únicos dentro de la biblioteca
+            name = base = pattern_name(rel)
+            suffix = 2
+            while name.lower() in used_names:
+                name = f"{base}_{suffix}"
+                suffix += 1
+            used_names.add(name.lower())
+
+            pat_content = rename_pattern(result["pat_content"], name)
+            out_path = os.path.join(output_dir, f"{name}.pat")
+            with open(out_path, "w", newline="") as f:
+                f.write(pat_content)
+            entry.update(name=name, output=out_path,
+                         lines=sum(1 for line in pat_content.split("\r\n")
+                                   if line and not line.startswith(("*", ";"))))
+            library.append(pat_content.rstrip("\r\n"))
+        entries.append(entry)
+
+    library_path = None
+    if library:
+        library_path = os.path.join(output_dir, library_name)
+        with open(library_path, "w", newline="") as f:
+            f.write("\r\n".join(library) + "\r\n")
+
+    summary = {
+        "converted": sum(1 for e in entries if e["output"]),
+        "failed": sum(1 for e in entries if e["error"]),
+        "library": library_path,
+        "files": entries,
+    }
+    with open(os.path.join(output_dir, summary_name), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Conversión por lotes de DXF e imágenes a PAT")
+    parser.add_argument("inputs", nargs="+", help="Directorios o archivos de entrada")
+    parser.add_argument("-o", "--output", required=True, help="Directorio de salida")
+    parser.add_argument("--params", help="JSON con parámetros por tipo y por archivo")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Procesos en paralelo (por defecto, todos los núcleos)")
+    parser.add_argument("--library", default="HatchCraft_Library.pat",
+                        help="Nombre de la biblioteca .pat combinada")
+    parser.add_argument("--summary", default="summary.json", help="Nombre del resumen JSON")
+    args = parser.parse_args(argv)
+
+    config = {}
+    if args.params:
+        with open(args.params, encoding="utf-8") as f:
+            config = json.load(f)
+
+    inputs = find_inputs(args.inputs)
+    if not inputs:
+        print("No se encontraron archivos DXF o imágenes", file=sys.stderr)
+        return 1
+
+    summary = run_batch(inputs, args.output, config, args.workers, args.library, args.summary)
+    print(f"{summary['converted']} convertidos, {summary['failed']} con error"
+          f" → {summary['library'] or 'sin biblioteca'}")
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,370 @@
+"""Benchmarks de HatchCraft.
+
+Uso:
+    python benchmark.py fixtures [--json fixtures.json]
+    python benchmark.py synthetic [--segments 10 1000 100000] [--images 512 8192]
+    python benchmark.py thinning [--sizes 1024 4096 8192]
+    python benchmark.py compare base.json nuevo.json [--threshold 1.2]
+
+fixtures mide render_pat_preview, DXFtoPatConverter.convert e
+ImageToPatConverter.convert (con los dos motores, contours y hough; "fidelity"
+es el score de fidelity.check_fidelity de cada PAT contra los bordes que
+extrae contours, la misma referencia para ambos) sobre los .pat/.dxf/imágenes
+del repositorio;
+synthetic hace lo mismo con entradas generadas de 10 a 100k segmentos y de
+512 a 8k px. Cada caso guarda el mejor tiempo de `--repeat` corridas y el
+pico de memoria (tracemalloc, en una corrida aparte). Con --json los
+resultados se escriben a un archivo que compare contrasta con otro.
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+import ezdxf
+
+from core_logic import DXFtoPatConverter, ImageToPatConverter, render_pat_preview
+from fidelity import check_fidelity
+from pat_emit import segments_to_pat_lines
+from thinning import METHODS, thin
+
+FIXTURE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def synthetic_photo(side, seed=0, cell=40):
+    """Textura tipo muro de piedra: celdas de Voronoi con tonos y ruido"""
+    rng = np.random.default_rng(seed)
+    seeds = np.full((side, side), 255, dtype=np.uint8)
+    n = max(4, (side // cell) ** 2)
+    seeds[rng.integers(0, side, n), rng.integers(0, side, n)] = 0
+    _, labels = cv2.distanceTransformWithLabels(seeds, cv2.DIST_L2, 3,
+                                                labelType=cv2.DIST_LABEL_CCOMP)
+    palette = rng.integers(40, 220, labels.max() + 1).astype(np.uint8)
+    gray = palette[labels]
+    noise = rng.normal(0, 6, gray.shape).astype(np.int16)
+    return np.clip(gray.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def synthetic_edges(side, seed=0):
+    """Bordes como los produce ImageToPatConverter (blur + Canny + dilate)"""
+    gray = synthetic_photo(side, seed)
+    edges = cv2.Canny(cv2.GaussianBlur(gray, (3, 3), 0), 50, 150)
+    return cv2.dilate(edges, np.ones((2, 2), np.uint8), iterations=1)
+
+
+def legacy_skeleton(edges):
+    """Bucle de skeleton original (erode/dilate con una copia por pasada)"""
+    skeleton = np.zeros(edges.shape, np.uint8)
+    element = cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))
+    temp = edges.copy()
+    while True:
+        eroded = cv2.erode(temp, element)
+        dilated = cv2.dilate(eroded, element)
+        diff = cv2.subtract(temp, dilated)
+        skeleton = cv2.bitwise_or(skeleton, diff)
+        temp = eroded.copy()
+        if cv2.countNonZero(temp) == 0:
+            break
+    return skeleton
+
+
+def _timed(fn, repeat):
+    best = float('inf')
+    value = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, value
+
+
+def _measure(fn, repeat=1, memory=True):
+    """Mejor tiempo de `repeat` corridas y pico de memoria en MB (o None).
+
+    La memoria se mide en una corrida extra con tracemalloc, que cuenta
+    los buffers de NumPy (y los de OpenCV que vuelven como arreglos) pero
+    haría más lentas las corridas cronometradas.
+    """
+    seconds, value = _timed(fn, repeat)
+    peak_mb = None
+    if memory:
+        tracemalloc.start()
+        try:
+            fn()
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        finally:
+            tracemalloc.stop()
+    return seconds, peak_mb, value
+
+
+def _row(suite, target, case, size, seconds, peak_mb, **extra):
+    row = {"suite": suite, "target": target, "case": case, "size": size,
+           "seconds": seconds, "peak_mb": peak_mb}
+    row.update(extra)
+    return row
+
+
+def _convert_image(image_bytes, **params):
+    # Instancia nueva en cada corrida: sin etapas memoizadas
+    return ImageToPatConverter().convert(image_bytes, **params)
+
+
+def _pat_lines(result):
+    if "error" in result:
+        return None
+    return sum(1 for line in result["pat_content"].split("\r\n")
+               if line and not line.startswith(("*", ";")))
+
+
+def _fidelity(result, reference):
+    """Score de fidelidad del PAT contra los segmentos de `reference` (tile 0-1)"""
+    if "error" in result or "error" in reference:
+        return None
+    return check_fidelity(result["pat_content"], reference["source_segments"],
+                          window=(0.0, 0.0, 1.0, 1.0), period=reference["source_period"])["score"]
+
+
+def bench_fixtures(repeat=3, memory=True, directory=FIXTURE_DIR):
+    """Preview, DXF e imagen sobre los archivos de ejemplo del repositorio"""
+    rows = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.pat"))):
+        with open(path, encoding="utf-8", errors="replace") as f:
+            pat_content = f.read()
+        seconds, peak, _ = _measure(lambda: render_pat_preview(pat_content), repeat, memory)
+        rows.append(_row("fixtures", "render_pat_preview", os.path.basename(path),
+                         len(pat_content), seconds, peak))
+
+    for path in sorted(glob.glob(os.path.join(directory, "*.dxf"))):
+        seconds, peak, result = _measure(lambda: DXFtoPatConverter().convert(path), repeat, memory)
+        rows.append(_row("fixtures", "dxf_convert", os.path.basename(path),
+                         os.path.getsize(path), seconds, peak, pat_lines=_pat_lines(result)))
+
+    images = glob.glob(os.path.join(directory, "*.jpg")) + glob.glob(os.path.join(directory, "*.png"))
+    for path in sorted(images):
+        with open(path, "rb") as f:
+            image_bytes = f.read()
+        reference = _convert_image(image_bytes)
+        for engine in ImageToPatConverter.ENGINES:
+            # El motor original conserva el nombre de target para compare
+            target = "image_convert" if engine == "contours" else f"image_convert_{engine}"
+            seconds, peak, result = _measure(
+                lambda: _convert_image(image_bytes, engine=engine), repeat, memory)
+            rows.append(_row("fixtures", target, os.path.basename(path), len(image_bytes),
+                             seconds, peak, pat_lines=_pat_lines(result),
+                             fidelity=_fidelity(result, reference)))
+    return rows
+
+
+def synthetic_segments(n, seed=0, size=100.0):
+    """Segmentos tipo aparejo: tramos horizontales, verticales y a 45° en un tile"""
+    rng = np.random.default_rng(seed)
+    start = rng.random((n, 2)) * size
+    angle = np.radians(rng.choice([0, 45, 90, 135], n) + rng.normal(0, 2, n))
+    length = rng.uniform(0.02, 0.2, n) * size
+    end = start + length[:, None] * np.stack([np.cos(angle), np.sin(angle)], axis=1)
+    return np.hstack([start, end])
+
+
+def synthetic_dxf(n, path, seed=0):
+    """DXF con `n` LINE generado con ezdxf"""
+    doc = ezdxf.new()
+    msp = doc.modelspace()
+    for x1, y1, x2, y2 in synthetic_segments(n, seed).tolist():
+        msp.add_line((x1, y1), (x2, y2))
+    doc.saveas(path)
+    return path
+
+
+def synthetic_pat(n, seed=0):
+    """Patrón PAT con `n` líneas, emitido igual que el converter DXF"""
+    lines = segments_to_pat_lines(synthetic_segments(n, seed), 100.0, 100.0, 100.0)
+    header = ["*Synthetic, benchmark", ";%TYPE=MODEL"]
+    return "\r\n".join(header + lines) + "\r\n"
+
+
+def bench_synthetic(segments=(10, 100, 1000, 10000, 100000),
+                    images=(512, 1024, 2048, 4096, 8192), repeat=1, memory=True):
+    """Preview y DXF con 10 a 100k segmentos, imagen de 512 px a 8k"""
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in segments:
+            pat_content = synthetic_pat(n)
+            seconds, peak, _ = _measure(lambda: render_pat_preview(pat_content), repeat, memory)
+            rows.append(_row("synthetic", "render_pat_preview", f"segments_{n}", n, seconds, peak))
+
+            path = synthetic_dxf(n, os.path.join(tmp, f"synthetic_{n}.dxf"))
+            seconds, peak, result = _measure(lambda: DXFtoPatConverter().convert(path), repeat, memory)
+            rows.append(_row("synthetic", "dxf_convert", f"segments_{n}", n, seconds, peak,
+                             pat_lines=_pat_lines(result)))
+
+    for side in images:
+        ok, encoded = cv2.imencode(".png", synthetic_photo(side))
+        image_bytes = encoded.tobytes()
+        seconds, peak, result = _measure(lambda: _convert_image(image_bytes), repeat, memory)
+        rows.append(_row("synthetic", "image_convert", f"image_{side}", side, seconds, peak,
+                         pat_lines=_pat_lines(result)))
+    return rows
+
+
+def _print_results(rows):
+    print(f"{'target':<20} {'case':<28} {'seconds':>9} {'peak_mb':>9} {'lines':>7} {'fidelity':>8}")
+    for r in rows:
+        peak = "-" if r["peak_mb"] is None else f"{r['peak_mb']:.1f}"
+        lines = "-" if r.get("pat_lines") is None else r["pat_lines"]
+        score = "-" if r.get("fidelity") is None else f"{r['fidelity']:.3f}"
+        print(f"{r['target']:<20} {r['case']:<28} {r['seconds']:>8.4f}s {peak:>9} "
+              f"{lines:>7} {score:>8}")
+
+
+def environment():
+    """Versiones y máquina, para saber si dos corridas son comparables"""
+    return {
+        "python": platform.python_version(), "platform": platform.platform(),
+        "cpus": os.cpu_count(), "numpy": np.__version__, "opencv": cv2.__version__,
+        "ezdxf": ezdxf.__version__, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def save_results(rows, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"environment": environment(), "results": rows}, f, indent=2)
+
+
+def compare_results(base_path, new_path, threshold=1.2, min_seconds=0.005):
+    """Contrasta dos archivos de resultados caso por caso.
+
+    Devuelve (filas, regresiones); un caso es regresión si su tiempo (o su
+    pico de memoria) supera `threshold` veces el de la corrida base. Las
+    diferencias de tiempo menores a `min_seconds` se consideran ruido.
+    """
+    with open(base_path, encoding="utf-8") as f:
+        base = {(r["suite"], r["target"], r["case"]): r for r in json.load(f)["results"]}
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)["results"]
+
+    rows = []
+    regressions = []
+    for r in new:
+        old = base.get((r["suite"], r["target"], r["case"]))
+        if old is None:
+            continue
+        time_ratio = r["seconds"] / old["seconds"] if old["seconds"] else None
+        mem_ratio = (r["peak_mb"] / old["peak_mb"]
+                     if r["peak_mb"] is not None and old["peak_mb"] else None)
+        row = {"target": r["target"], "case": r["case"], "time_ratio": time_ratio,
+               "mem_ratio": mem_ratio}
+        rows.append(row)
+        slower = (time_ratio or 0) > threshold and r["seconds"] - old["seconds"] > min_seconds
+        if slower or (mem_ratio or 0) > threshold:
+            regressions.append(row)
+    return rows, regressions
+
+
+def _print_comparison(rows, regressions):
+    print(f"{'target':<20} {'case':<28} {'time':>8} {'memory':>8}")
+    for r in rows:
+        t = "-" if r["time_ratio"] is None else f"{r['time_ratio']:.2f}x"
+        m = "-" if r["mem_ratio"] is None else f"{r['mem_ratio']:.2f}x"
+        flag = "  <-- regresión" if r in regressions else ""
+        print(f"{r['target']:<20} {r['case']:<28} {t:>8} {m:>8}{flag}")
+
+
+def _downstream(skeleton):
+    """Contornos, aproximación y emisión PAT: lo que el converter hace con el skeleton"""
+    conv = ImageToPatConverter
+    contours = conv._contours(skeleton)
+    polylines = conv._simplify(contours, 20, 0.01)
+    pat_lines = conv._emit(polylines, skeleton.shape[0])
+    return len(contours), len(pat_lines)
+
+
+def bench_thinning(sizes=(1024, 4096, 8192), repeat=1):
+    """Compara el skeleton original con cada motor de thinning.
+
+    Mide el tiempo del skeleton y el de skeleton + contornos + aproximación +
+    emisión, porque un skeleton más limpio también abarata las etapas
+    posteriores.
+    """
+    rows = []
+    for side in sizes:
+        edges = synthetic_edges(side)
+        engines = [("legacy", lambda: legacy_skeleton(edges))]
+        engines += [(m, lambda m=m: thin(edges, m)[0]) for m in METHODS]
+        base = None
+        for name, fn in engines:
+            t_skel, skeleton = _timed(fn, repeat)
+            t_down, (contours, pat_lines) = _timed(lambda: _downstream(skeleton), 1)
+            total = t_skel + t_down
+            if base is None:
+                base = total
+            rows.append({
+                "size": side, "engine": name, "skeleton_s": t_skel,
+                "total_s": total, "contours": contours, "pat_lines": pat_lines,
+                "speedup": base / total,
+            })
+    return rows
+
+
+def _print_rows(rows):
+    print(f"{'size':>6} {'engine':<14} {'skeleton':>9} {'total':>9} {'contours':>9} "
+          f"{'pat_lines':>9} {'speedup':>8}")
+    for r in rows:
+        print(f"{r['size']:>6} {r['engine']:<14} {r['skeleton_s']:>8.3f}s {r['total_s']:>8.3f}s "
+              f"{r['contours']:>9} {r['pat_lines']:>9} {r['speedup']:>7.2f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de HatchCraft")
+    sub = parser.add_subparsers(dest="suite", required=True)
+
+    p_fix = sub.add_parser("fixtures", help="Preview, DXF e imagen sobre los archivos de ejemplo")
+    p_fix.add_argument("--repeat", type=int, default=3)
+
+    p_syn = sub.add_parser("synthetic", help="Entradas generadas de 10 a 100k segmentos y 512 px a 8k")
+    p_syn.add_argument("--segments", type=int, nargs="+", default=[10, 100, 1000, 10000, 100000])
+    p_syn.add_argument("--images", type=int, nargs="+", default=[512, 1024, 2048, 4096, 8192])
+    p_syn.add_argument("--repeat", type=int, default=1)
+
+    for p in (p_fix, p_syn):
+        p.add_argument("--json", help="Archivo donde guardar los resultados")
+        p.add_argument("--no-memory", action="store_true", help="No medir el pico de memoria")
+
+    p_thin = sub.add_parser("thinning", help="Motores de skeleton a distintas resoluciones")
+    p_thin.add_argument("--sizes", type=int, nargs="+", default=[1024, 4096, 8192])
+    p_thin.add_argument("--repeat", type=int, default=1)
+
+    p_cmp = sub.add_parser("compare", help="Contrasta dos archivos de resultados")
+    p_cmp.add_argument("base")
+    p_cmp.add_argument("new")
+    p_cmp.add_argument("--threshold", type=float, default=1.2)
+    p_cmp.add_argument("--min-seconds", type=float, default=0.005,
+                       help="Diferencia de tiempo por debajo de la cual se ignora")
+    args = parser.parse_args(argv)
+
+    if args.suite == "thinning":
+        _print_rows(bench_thinning(args.sizes, args.repeat))
+        return 0
+    if args.suite == "compare":
+        rows, regressions = compare_results(args.base, args.new, args.threshold, args.min_seconds)
+        _print_comparison(rows, regressions)
+        return 1 if regressions else 0
+
+    if args.suite == "fixtures":
+        rows = bench_fixtures(args.repeat, not args.no_memory)
+    else:
+        rows = bench_synthetic(args.segments, args.images, args.repeat, not args.no_memory)
+    _print_results(rows)
+    if args.json:
+        save_results(rows, args.json)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,59 @@
 import cv2
 import numpy as np
 import math
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import CancelledError
 import ezdxf
 
-def render_pat_preview(pat_content, tile_count=3, preview_size=600, manual_scale=1.0):
-    """Renderiza el patrón PAT como lo vería Revit"""
-    img = np.ones((preview_size, preview_size, 3), dtype=np.uint8) * 255
+from dxf_ingest import read_segments, segment_extents
+from metrics import resolve_metrics
+from lattice import find_lattice, lattice_classes, lattice_family, spans_lattice
+from pat_emit import quantize_segments, segments_to_pat_lines
+from simplify import merge_colinear, simplify_segments
+from thinning import thin
+from tiled import decode_gray_square, process_tiled
+
+
+class PatPattern:
+    """Patrón PAT parseado, guardado en arreglos NumPy compactos.
+
+    angles (n,), origins (n, 2), deltas (n, 2), dashes (n, max_dash) rellenada
+    con ceros y dash_counts (n,) con la cantidad real de valores por línea.
+    """
+    __slots__ = ('angles', 'origins', 'deltas', 'dashes', 'dash_counts', 'tile_size', 'digest')
+    
+    def __init__(self, angles, origins, deltas, dashes, dash_counts, tile_size, digest=None):
+        self.angles = angles
+        self.origins = origins
+        self.deltas = deltas
+        self.dashes = dashes
+        self.dash_counts = dash_counts
+        self.tile_size = tile_size
+        self.digest = digest
+    
+    def __len__(self):
+        return len(self.angles)
     
+    @property
+    def nbytes(self):
+        return (self.angles.nbytes + self.origins.nbytes + self.deltas.nbytes +
+                self.dashes.nbytes + self.dash_counts.nbytes)
+
+
+def pat_digest(pat_content):
+    """Hash del contenido PAT, usado como clave de cache"""
+    return hashlib.blake2b(pat_content.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def parse_pat(pat_content):
+    """Parsea el texto PAT una sola vez a un PatPattern"""
     lines_data = pat_content.strip().replace('\r\n', '\n').split('\n')
     
-    # Encontrar límites y segmentos
     tile_size = 1.0
-    segments = []
+    rows = []
+    dash_rows = []
     
     for line in lines_data:
         line = line.strip()
@@ -24,7 +66,7 @@ def render_pat_preview(pat_content, tile_count=3, preview_size=600, manual_scale
             parts = [p.strip() for p in line.split(',')]
             if len(parts) < 5:
                 continue
-                
+            
             angle = float(parts[0])
             ox, oy = float(parts[1]), float(parts[2])
             dx, dy = float(parts[3]), float(parts[4])
@@ -35,51 +77,293 @@ def render_pat_preview(pat_content, tile_count=3, preview_size=600, manual_scale
             
             tile_size = max(tile_size, dx, dy)
             
-            segments.append({
-                'ox': ox, 'oy': oy,
-                'dx': dx, 'dy': dy,
-                'angle': angle,
-                'dash_pattern': dash_pattern
-            })
+            rows.append((angle, ox, oy, dx, dy))
+            dash_rows.append(dash_pattern)
         except:
             continue
     
-    if not segments:
+    n = len(rows)
+    table = np.array(rows, dtype=np.float64).reshape(n, 5)
+    dash_counts = np.array([len(d) for d in dash_rows], dtype=np.intp)
+    max_dash = int(dash_counts.max()) if n else 0
+    dashes = np.zeros((n, max(max_dash, 1)), dtype=np.float64)
+    for i, dash_pattern in enumerate(dash_rows):
+        dashes[i, :len(dash_pattern)] = dash_pattern
+    
+    return PatPattern(np.ascontiguousarray(table[:, 0]),
+                      np.ascontiguousarray(table[:, 1:3]),
+                      np.ascontiguousarray(table[:, 3:5]),
+                      dashes, dash_counts, tile_size, pat_digest(pat_content))
+
+
+def _as_pattern(pat_content):
+    if isinstance(pat_content, PatPattern):
+        return pat_content
+    return parse_pat(pat_content)
+
+
+def render_pat_preview(pat_content, tile_count=3, preview_size=600, manual_scale=1.0):
+    """Renderiza el patrón PAT como lo vería Revit.
+
+    `pat_content` puede ser el texto PAT o un PatPattern ya parseado.
+    """
+    img = np.ones((preview_size, preview_size, 3), dtype=np.uint8) * 255
+    
+    pattern = _as_pattern(pat_content)
+    angles, origins, deltas = pattern.angles, pattern.origins, pattern.deltas
+    dashes, dash_counts, tile_size = pattern.dashes, pattern.dash_counts, pattern.tile_size
+    
+    if len(angles) == 0:
         return img
     
     # Escala basada en tile_size y manual_scale
     pattern_size = tile_size * tile_count
     scale = (preview_size / pattern_size) * manual_scale
     
-    # Dibujar cada segmento para cada tile
-    for seg in segments:
-        ang_rad = math.radians(seg['angle'])
-        dir_x = math.cos(ang_rad)
-        dir_y = math.sin(ang_rad)
+    # Dirección de cada segmento (math para conservar el mismo redondeo que antes)
+    dir_x = np.array([math.cos(math.radians(a)) for a in angles])
+    dir_y = np.array([math.sin(math.radians(a)) for a in angles])
+    
+    # Tabla de longitudes en píxeles; sin dash pattern = línea de medio tile
+    lengths = np.abs(dashes) * scale
+    visible = dashes > 0
+    solid = dash_counts == 0
+    lengths[solid, 0] = tile_size * scale * 0.5
+    visible[solid, 0] = True
+    
+    # Posición inicial/final de cada dash (suma acumulada secuencial, igual que el bucle)
+    pos_end = np.cumsum(lengths, axis=1)
+    pos_start = np.zeros_like(pos_end)
+    pos_start[:, 1:] = pos_end[:, :-1]
+    
+    # Bases de todos los tiles: (segmento, tile_x, tile_y)
+    tiles = np.arange(tile_count, dtype=np.float64)
+    base_x = (origins[:, 0, None] + tiles[None, :] * deltas[:, 0, None]) * scale
+    base_y = preview_size - (origins[:, 1, None] + tiles[None, :] * deltas[:, 1, None]) * scale
+    base_x = base_x[:, :, None, None]
+    base_y = base_y[:, None, :, None]
+    
+    # Extremos de cada dash en lote: forma (segmento, tile_x, tile_y, dash)
+    shape = (len(angles), tile_count, tile_count, dashes.shape[1])
+    dx = dir_x[:, None, None, None]
+    dy = dir_y[:, None, None, None]
+    start = pos_start[:, None, None, :]
+    end = pos_end[:, None, None, :]
+    x1 = np.broadcast_to(base_x + dx * start, shape)
+    y1 = np.broadcast_to(base_y - dy * start, shape)
+    x2 = np.broadcast_to(base_x + dx * end, shape)
+    y2 = np.broadcast_to(base_y - dy * end, shape)
+    
+    mask = np.broadcast_to(visible[:, None, None, :], shape)
+    pts = np.stack([x1[mask], y1[mask], x2[mask], y2[mask]], axis=1)
+    
+    # int() trunca hacia cero; se conserva el orden de dibujo original
+    pts = np.clip(np.trunc(pts), -2**31, 2**31 - 1).astype(np.int32).reshape(-1, 2, 2)
+    if len(pts):
+        cv2.polylines(img, pts, False, (0, 0, 0), 1, cv2.LINE_AA)
+    
+    # Grid
+    tile_px = preview_size / tile_count
+    for i in range(1, tile_count):
+        pos = int(i * tile_px)
+        cv2.line(img, (pos, 0), (pos, preview_size), (200, 200, 200), 1)
+        cv2.line(img, (0, pos), (preview_size, pos), (200, 200, 200), 1)
+    
+    return img
+
+
+def pat_visible_dashes(pattern, x_min, y_min, x_max, y_max, min_period=0.0, min_spacing=0.0):
+    """Calcula los dashes visibles de las familias PAT dentro de un rectángulo.
+
+    Usa la semántica de Revit: cada línea PAT es una familia infinita de
+    líneas paralelas. La línea k pasa por origin + k*(dx*u + dy*v), donde u
+    es la dirección de la línea y v su perpendicular; el dash pattern se
+    repite a lo largo de cada línea a partir de ese punto.
+
+    Las familias que cruzan el rectángulo se obtienen analíticamente y cada
+    línea se recorta al rectángulo antes de generar sus dashes, así que el
+    costo depende del área visible y no del número de tiles.
+
+    `min_period` y `min_spacing` (unidades de mundo, típicamente un píxel)
+    limitan el trabajo: un dash pattern con período menor se dibuja continuo
+    y las familias más densas se submuestrean.
+
+    Devuelve un arreglo (n, 4) float64 con x1, y1, x2, y2 en coordenadas de mundo.
+    """
+    empty = np.zeros((0, 4), dtype=np.float64)
+    angles, origins, deltas = pattern.angles, pattern.origins, pattern.deltas
+    dashes, dash_counts = pattern.dashes, pattern.dash_counts
+    if len(angles) == 0:
+        return empty
+    
+    rad = np.radians(angles)
+    ux, uy = np.cos(rad), np.sin(rad)
+    
+    # Proyección de las esquinas del rectángulo sobre la perpendicular v = (-uy, ux)
+    corners_x = np.array([x_min, x_max, x_min, x_max], dtype=np.float64)
+    corners_y = np.array([y_min, y_min, y_max, y_max], dtype=np.float64)
+    proj = -uy[:, None] * corners_x[None, :] + ux[:, None] * corners_y[None, :]
+    base = -uy * origins[:, 0] + ux * origins[:, 1]
+    p_lo = proj.min(axis=1) - base
+    p_hi = proj.max(axis=1) - base
+    
+    # Rango de miembros k de cada familia que cruzan el rectángulo
+    spacing = deltas[:, 1]
+    flat = np.abs(spacing) < 1e-12
+    safe = np.where(flat, 1.0, spacing)
+    k_a = p_lo / safe
+    k_b = p_hi / safe
+    step = np.ones(len(angles), dtype=np.int64)
+    if min_spacing > 0:
+        step = np.maximum(1, np.ceil(min_spacing / np.abs(safe))).astype(np.int64)
+    k_lo = np.ceil(np.minimum(k_a, k_b) / step) * step
+    k_hi = np.floor(np.maximum(k_a, k_b) / step) * step
+    # Familia degenerada (dy = 0): solo la línea k = 0, si cruza
+    k_lo = np.where(flat, 0.0, k_lo)
+    k_hi = np.where(flat, np.where((p_lo <= 0) & (p_hi >= 0), 0.0, -1.0), k_hi)
+    counts = np.maximum(0, (k_hi - k_lo) / step + 1).astype(np.int64)
+    
+    total = int(counts.sum())
+    if total == 0:
+        return empty
+    
+    fam = np.repeat(np.arange(len(angles)), counts)
+    first = np.repeat(np.cumsum(counts) - counts, counts)
+    k = k_lo[fam] + (np.arange(total) - first) * step[fam]
+    
+    # Punto base de cada línea
+    lux, luy = ux[fam], uy[fam]
+    px = origins[fam, 0] + k * (deltas[fam, 0] * lux - deltas[fam, 1] * luy)
+    py = origins[fam, 1] + k * (deltas[fam, 0] * luy + deltas[fam, 1] * lux)
+    
+    # Recorte de la línea infinita al rectángulo (slabs en x e y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tx1 = (x_min - px) / lux
+        tx2 = (x_max - px) / lux
+        ty1 = (y_min - py) / luy
+        ty2 = (y_max - py) / luy
+    inf = np.inf
+    vert = np.abs(lux) < 1e-12
+    horiz = np.abs(luy) < 1e-12
+    inside_x = (px >= x_min) & (px <= x_max)
+    inside_y = (py >= y_min) & (py <= y_max)
+    tx_lo = np.where(vert, np.where(inside_x, -inf, inf), np.minimum(tx1, tx2))
+    tx_hi = np.where(vert, np.where(inside_x, inf, -inf), np.maximum(tx1, tx2))
+    ty_lo = np.where(horiz, np.where(inside_y, -inf, inf), np.minimum(ty1, ty2))
+    ty_hi = np.where(horiz, np.where(inside_y, inf, -inf), np.maximum(ty1, ty2))
+    t_lo = np.maximum(tx_lo, ty_lo)
+    t_hi = np.minimum(tx_hi, ty_hi)
+    
+    keep = t_lo < t_hi
+    fam, px, py, lux, luy = fam[keep], px[keep], py[keep], lux[keep], luy[keep]
+    t_lo, t_hi = t_lo[keep], t_hi[keep]
+    
+    # Tabla de dashes: inicio dentro del período y longitud (gaps fuera)
+    ncols = dashes.shape[1]
+    cols = np.arange(ncols)[None, :]
+    in_pattern = cols < dash_counts[:, None]
+    lengths = np.where(in_pattern, np.abs(dashes), 0.0)
+    period = lengths.sum(axis=1)
+    starts = np.cumsum(lengths, axis=1) - lengths
+    
+    # Líneas continuas: sin dash pattern o con período por debajo de un píxel
+    solid = (dash_counts == 0) | (period <= 0) | (period < min_period)
+    solid_line = solid[fam]
+    
+    parts_t1 = [t_lo[solid_line]]
+    parts_t2 = [t_hi[solid_line]]
+    parts_line = [np.nonzero(solid_line)[0]]
+    parts_dot = [np.zeros(int(solid_line.sum()), dtype=bool)]
+    
+    # Dashes (d > 0) y puntos (d == 0) de las familias con patrón
+    entry_mask = in_pattern & (dashes >= 0) & ~solid[:, None]
+    entry_fam, entry_col = np.nonzero(entry_mask)
+    if len(entry_fam):
+        per_fam = np.bincount(entry_fam, minlength=len(angles))
+        fam_offset = np.cumsum(per_fam) - per_fam
+        
+        dashed_lines = np.nonzero(~solid_line)[0]
+        reps = per_fam[fam[dashed_lines]]
+        line_idx = np.repeat(dashed_lines, reps)
+        first = np.repeat(np.cumsum(reps) - reps, reps)
+        entry = fam_offset[fam[line_idx]] + (np.arange(len(line_idx)) - first)
+        
+        e_fam = entry_fam[entry]
+        e_start = starts[e_fam, entry_col[entry]]
+        e_len = lengths[e_fam, entry_col[entry]]
+        e_period = period[e_fam]
+        lo, hi = t_lo[line_idx], t_hi[line_idx]
+        
+        # Repeticiones m del dash que tocan [lo, hi]
+        m_lo = np.ceil((lo - e_start - e_len) / e_period)
+        m_hi = np.floor((hi - e_start) / e_period)
+        m_count = np.maximum(0, m_hi - m_lo + 1).astype(np.int64)
+        
+        inst = np.repeat(np.arange(len(line_idx)), m_count)
+        first = np.repeat(np.cumsum(m_count) - m_count, m_count)
+        m = m_lo[inst] + (np.arange(len(inst)) - first)
+        d_start = m * e_period[inst] + e_start[inst]
+        d_end = d_start + e_len[inst]
+        
+        parts_t1.append(np.maximum(d_start, lo[inst]))
+        parts_t2.append(np.minimum(d_end, hi[inst]))
+        parts_line.append(line_idx[inst])
+        parts_dot.append(e_len[inst] == 0)
+    
+    t1 = np.concatenate(parts_t1)
+    t2 = np.concatenate(parts_t2)
+    line = np.concatenate(parts_line)
+    dot = np.concatenate(parts_dot)
+    
+    # Descartar recortes vacíos que solo tocan el borde (los puntos se conservan)
+    keep = (t2 > t1) | (dot & (t2 == t1))
+    t1, t2, line = t1[keep], t2[keep], line[keep]
+    
+    return np.stack([px[line] + t1 * lux[line], py[line] + t1 * luy[line],
+                     px[line] + t2 * lux[line], py[line] + t2 * luy[line]], axis=1)
+
+
+def render_pat_revit(pat_content, tile_count=3, preview_size=600, manual_scale=1.0):
+    """Renderiza el patrón PAT con la semántica real de Revit.
+
+    A diferencia de `render_pat_preview`, dx es el desplazamiento a lo largo
+    de la línea y dy la separación perpendicular de una familia infinita de
+    líneas. Solo se generan los dashes que caen dentro de la vista, por lo que
+    previews de 50x50 tiles siguen siendo interactivos.
+
+    `pat_content` puede ser el texto PAT o un PatPattern ya parseado.
+    """
+    img = np.ones((preview_size, preview_size, 3), dtype=np.uint8) * 255
+    
+    pattern = _as_pattern(pat_content)
+    
+    if len(pattern) == 0:
+        return img
+    
+    # Misma escala que render_pat_preview
+    pattern_size = pattern.tile_size * tile_count
+    scale = (preview_size / pattern_size) * manual_scale
+    pixel = 1.0 / scale
+    
+    # Vista en coordenadas de mundo (eje y hacia arriba)
+    segs = pat_visible_dashes(pattern, 0.0, 0.0, preview_size * pixel, preview_size * pixel,
+                              min_period=pixel, min_spacing=pixel)
+    
+    if len(segs):
+        pts = np.empty((len(segs), 2, 2), dtype=np.int32)
+        pts[:, :, 0] = np.rint(segs[:, 0::2] * scale)
+        pts[:, :, 1] = np.rint(preview_size - segs[:, 1::2] * scale)
         
-        for tile_x in range(tile_count):
-            for tile_y in range(tile_count):
-                base_x = (seg['ox'] + tile_x * seg['dx']) * scale
-                base_y = preview_size - (seg['oy'] + tile_y * seg['dy']) * scale
-                
-                if seg['dash_pattern']:
-                    pos = 0
-                    for dash_val in seg['dash_pattern']:
-                        length = abs(dash_val) * scale
-                        if dash_val > 0:
-                            x1 = int(base_x + dir_x * pos)
-                            y1 = int(base_y - dir_y * pos)
-                            x2 = int(base_x + dir_x * (pos + length))
-                            y2 = int(base_y - dir_y * (pos + length))
-                            cv2.line(img, (x1, y1), (x2, y2), (0, 0, 0), 1, cv2.LINE_AA)
-                        pos += length
-                else:
-                    length = tile_size * scale * 0.5
-                    x1 = int(base_x)
-                    y1 = int(base_y)
-                    x2 = int(base_x + dir_x * length)
-                    y2 = int(base_y - dir_y * length)
-                    cv2.line(img, (x1, y1), (x2, y2), (0, 0, 0), 1, cv2.LINE_AA)
+        # Dashes de hasta 2 px se pintan directo (extremos + punto medio),
+        # sin pasar por cv2; al hacer zoom out son la gran mayoría
+        short = np.abs(pts[:, 1] - pts[:, 0]).max(axis=1) <= 2
+        if short.any():
+            ends = pts[short]
+            xy = np.concatenate([ends[:, 0], ends[:, 1], (ends[:, 0] + ends[:, 1]) // 2])
+            ok = (xy >= 0).all(axis=1) & (xy < preview_size).all(axis=1)
+            img[xy[ok, 1], xy[ok, 0]] = 0
+        if not short.all():
+            cv2.polylines(img, pts[~short], False, (0, 0, 0), 1, cv2.LINE_AA)
     
     # Grid
     tile_px = preview_size / tile_count
@@ -91,11 +375,90 @@ def render_pat_preview(pat_content, tile_count=3, preview_size=600, manual_scale
     return img
 
 
+class PatCache:
+    """Cache LRU de patrones parseados y previews rasterizados.
+
+    Los patrones se indexan por el hash del contenido PAT y los previews por
+    (hash, escala, tamaño, tiles, motor), así que mover el slider de escala
+    sobre un patrón sin cambios no vuelve a parsear: solo rasteriza. Ambas
+    entradas comparten un presupuesto de memoria en bytes.
+    """
+    
+    def __init__(self, max_bytes=128 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = {"pattern": 0, "raster": 0}
+        self.misses = {"pattern": 0, "raster": 0}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def _get(self, kind, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses[kind] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits[kind] += 1
+            return entry[0]
+    
+    def _put(self, key, value, size):
+        with self._lock:
+            if size > self.max_bytes:
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted
+    
+    def pattern(self, pat_content, digest=None):
+        """Devuelve el PatPattern del contenido, parseando solo si no está en cache"""
+        digest = digest or pat_digest(pat_content)
+        pattern = self._get("pattern", ("pattern", digest))
+        if pattern is None:
+            pattern = parse_pat(pat_content)
+            self._put(("pattern", digest), pattern, pattern.nbytes)
+        return pattern
+    
+    def render(self, pat_content, tile_count=3, preview_size=600, manual_scale=1.0, revit=False):
+        """Preview cacheado; equivale a render_pat_preview / render_pat_revit"""
+        digest = pat_digest(pat_content)
+        key = ("raster", digest, float(manual_scale), preview_size, tile_count, bool(revit))
+        img = self._get("raster", key)
+        if img is None:
+            pattern = self.pattern(pat_content, digest)
+            renderer = render_pat_revit if revit else render_pat_preview
+            img = renderer(pattern, tile_count=tile_count, preview_size=preview_size,
+                           manual_scale=manual_scale)
+            img.flags.writeable = False
+            self._put(key, img, img.nbytes)
+        return img
+    
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": dict(self.hits),
+                "misses": dict(self.misses),
+            }
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+
 def render_dxf_debug(lines_data, min_x, min_y, tile_size, preview_size=500):
     """Renderiza una vista de debug del DXF mostrando los segmentos detectados"""
     img = np.ones((preview_size, preview_size, 3), dtype=np.uint8) * 255
     
-    if not lines_data or tile_size == 0:
+    if not len(lines_data) or tile_size == 0:
         return img
     
     # Escala para que el tile quepa en el preview
@@ -148,56 +511,169 @@ def render_dxf_debug(lines_data, min_x, min_y, tile_size, preview_size=500):
     return img
 
 
+def render_saved_debug(kind, result):
+    """Imagen de debug de un resultado guardado sin ella (ver disk_cache).
+
+    Se dibujan los mismos segmentos que al convertir: un DXF desde
+    "source_segments" y una imagen desde "reduced_segments" si se
+    simplificó o "source_segments" si no, reducida como en el modo por
+    teselas.
+    """
+    if kind == "dxf":
+        segments = result["source_segments"]
+        _, _, max_x, max_y = segment_extents(segments)
+        return render_dxf_debug(segments, 0.0, 0.0, max(max_x, max_y))
+    side = result["side"]
+    segments = result.get("reduced_segments")
+    if segments is None:
+        segments = result["source_segments"]
+    # Inversa de ImageToPatConverter._normalize
+    segments = np.array(segments, dtype=np.float64).reshape(-1, 4)
+    segments[:, 1::2] = 1 - segments[:, 1::2]
+    return ImageToPatConverter._debug_segments(segments * side, side)
+
+
+class ConversionResult(dict):
+    """Resultado de una conversión cuyas imágenes se calculan al pedirlas.
+
+    Se usa como el dict de siempre: `result["debug_img"]`, `result.get(...)`
+    y `"pat_preview" in result` funcionan igual, pero cada imagen pendiente
+    se genera recién en el primer acceso y queda guardada. keys() e
+    iteración solo muestran lo ya calculado; materialize() calcula todo.
+    """
+    
+    def __init__(self, data=(), lazy=None):
+        super().__init__(data)
+        self._lazy = dict(lazy or {})
+    
+    def __missing__(self, key):
+        factory = self._lazy.pop(key, None)
+        if factory is None:
+            raise KeyError(key)
+        value = self[key] = factory()
+        return value
+    
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self._lazy
+    
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+    
+    def pending(self):
+        """Claves que todavía no se calcularon"""
+        return tuple(self._lazy)
+    
+    def materialize(self):
+        for key in self.pending():
+            self[key]
+        return self
+
+
+def _checkpoint(cancelled):
+    """Corta la conversión entre etapas si `cancelled()` indica que ya no se necesita"""
+    if cancelled is not None and cancelled():
+        raise CancelledError()
+
+
+def _lazy_stage(metrics, stage, fn):
+    """Envuelve `fn` para medirla como etapa cuando finalmente se ejecute"""
+    def build():
+        with metrics.stage(stage) as record:
+            record["lazy"] = True
+            return fn()
+    return build
+
+
 class DXFtoPatConverter:
     """Convierte archivos DXF de AutoCAD a formato PAT"""
     
     def __init__(self):
         pass
     
-    def convert(self, dxf_file_path):
-        """Lee un archivo DXF y genera un archivo PAT"""
+    @staticmethod
+    def _detect_lattice(normalized, min_length):
+        """Celda mínima que repite el dibujo y la familia PAT de cada ángulo.
+
+        Devuelve (celda, familias, (a, b)) o None si el dibujo no es una
+        grilla de copias, si algún segmento no se repite con la retícula
+        (ver lattice.spans_lattice; p. ej. un marco alrededor del campo) o
+        alguna dirección no es racional en la retícula.
+        """
+        basis = find_lattice(normalized)
+        if basis is None:
+            return None
+        cell, classes, shifts = lattice_classes(normalized, *basis)
+        if len(cell) >= len(normalized) or not spans_lattice(classes, shifts):
+            return None
+        ang_q, _, lengths = quantize_segments(cell)
+        families = {}
+        for ang in np.unique(ang_q[lengths >= min_length]).tolist():
+            family = lattice_family(ang, *basis)
+            if family is None:
+                return None
+            families[ang] = family
+        return cell, families, basis
+    
+    def convert(self, dxf_file_path, consolidate=True, stream=True, chord_tolerance=None,
+                metrics=None, debug_image=True, preview=True, lattice=True, cancelled=None):
+        """Lee un archivo DXF y genera un archivo PAT.
+
+        `dxf_file_path` puede ser una ruta o un stream binario. Con `stream`
+        las entidades se leen sin cargar el documento completo (ver
+        dxf_ingest.read_segments). Arcos, círculos, elipses, splines,
+        polilíneas y bloques se aproximan por segmentos con flecha máxima
+        `chord_tolerance` en unidades del dibujo (None: relativa al tamaño
+        de cada curva). Con `consolidate` los segmentos colineales se
+        agrupan por familia y se emiten como una sola línea PAT con varios
+        dash/gap.
+
+        Con `lattice`, si el dibujo es una grilla de copias (p. ej. 3x3
+        ladrillos) se detecta la celda mínima y su retícula (ver lattice.py)
+        y se emiten solo las líneas de una celda, con el período y los
+        deltas de cada ángulo en semántica de Revit; el resultado incluye
+        "lattice" con los vectores a y b. Si no se encuentra una retícula se
+        usa el dibujo completo como tile.
+
+        Devuelve un ConversionResult: "debug_img" y "pat_preview" se generan
+        recién al pedirlos, y con `debug_image` o `preview` en False no se
+        incluyen. "source_segments" son los segmentos del dibujo (n, 4) en
+        las coordenadas del PAT y "source_period" los vectores con que se
+        repite (la retícula o el tile), para verificarlo con
+        fidelity.check_fidelity.
+        Con `metrics` (True, un hook o una instancia de
+        metrics.Metrics) el resultado incluye "metrics" con tiempo, memoria
+        y cantidades de las etapas read, lattice y emit, más debug_render y
+        preview cuando esas imágenes se calculan.
+
+        `cancelled` es una función sin argumentos que se consulta antes de
+        cada etapa (p. ej. la de jobs.JobSlot); si devuelve True la
+        conversión se corta con concurrent.futures.CancelledError.
+        """
+        metrics = resolve_metrics(metrics, "dxf")
+        result = self._convert(dxf_file_path, consolidate, stream, chord_tolerance, metrics,
+                               debug_image, preview, lattice, cancelled)
+        if metrics.enabled:
+            result["metrics"] = metrics.finish()
+        return result
+    
+    def _convert(self, dxf_file_path, consolidate, stream, chord_tolerance, metrics,
+                 debug_image, preview, lattice, cancelled):
         try:
-            doc = ezdxf.readfile(dxf_file_path)
-            msp = doc.modelspace()
-            
-            # Extraer todas las líneas
-            lines_data = []
-            min_x, min_y = float('inf'), float('inf')
-            max_x, max_y = float('-inf'), float('-inf')
-            
-            for entity in msp:
-                if entity.dxftype() == 'LINE':
-                    x1, y1 = entity.dxf.start.x, entity.dxf.start.y
-                    x2, y2 = entity.dxf.end.x, entity.dxf.end.y
-                    
-                    min_x = min(min_x, x1, x2)
-                    min_y = min(min_y, y1, y2)
-                    max_x = max(max_x, x1, x2)
-                    max_y = max(max_y, y1, y2)
-                    
-                    lines_data.append((x1, y1, x2, y2))
-                
-                elif entity.dxftype() == 'LWPOLYLINE':
-                    points = list(entity.get_points())
-                    for i in range(len(points) - 1):
-                        x1, y1 = points[i][0], points[i][1]
-                        x2, y2 = points[i+1][0], points[i+1][1]
-                        
-                        min_x = min(min_x, x1, x2)
-                        min_y = min(min_y, y1, y2)
-                        max_x = max(max_x, x1, x2)
-                        max_y = max(max_y, y1, y2)
-                        
-                        lines_data.append((x1, y1, x2, y2))
-                    
-                    if entity.closed and len(points) > 2:
-                        x1, y1 = points[-1][0], points[-1][1]
-                        x2, y2 = points[0][0], points[0][1]
-                        lines_data.append((x1, y1, x2, y2))
-            
-            if not lines_data:
+            _checkpoint(cancelled)
+            # Extraer todas las líneas a un arreglo (n, 4) y sus límites en una pasada
+            with metrics.stage("read") as record:
+                lines_data = read_segments(dxf_file_path, stream=stream,
+                                           chord_tolerance=chord_tolerance)
+                record["items"] = len(lines_data)
+            
+            if not len(lines_data):
                 return {"error": "No se encontraron líneas en el archivo DXF"}
             
+            min_x, min_y, max_x, max_y = segment_extents(lines_data)
+            
             # Tamaño del tile
             width = max_x - min_x
             height = max_y - min_y
@@ -206,70 +682,36 @@ class DXFtoPatConverter:
             if tile_size == 0:
                 return {"error": "El dibujo tiene tamaño cero"}
             
-            # Generar imagen de debug
-            debug_img = render_dxf_debug(lines_data, min_x, min_y, tile_size)
+            # Generar líneas PAT - NORMALIZANDO AL ORIGEN (0,0)
+            normalized = lines_data - (min_x, min_y, min_x, min_y)
             
-            # Generar líneas PAT - NORMALIZANDO AL ORIGEN
-            pat_lines = []
+            # Grilla de copias: emitir solo una celda con los deltas de la retícula
+            detected = None
+            if lattice:
+                _checkpoint(cancelled)
+                with metrics.stage("lattice") as record:
+                    detected = self._detect_lattice(normalized, 0.001)
+                    record["items"] = len(detected[0]) if detected else 0
             
-            for x1, y1, x2, y2 in lines_data:
-                # NORMALIZAR coordenadas al origen (0,0)
-                nx1 = x1 - min_x
-                ny1 = y1 - min_y
-                nx2 = x2 - min_x
-                ny2 = y2 - min_y
-                
-                dx = nx2 - nx1
-                dy = ny2 - ny1
-                length = math.sqrt(dx**2 + dy**2)
-                
-                if length < 0.001:
-                    continue
-                
-                # Ángulo
-                ang = math.degrees(math.atan2(dy, dx))
-                if ang < 0:
-                    ang += 360
-                
-                # Cuantizar ángulo al más cercano (manejando wrap-around)
-                def angle_diff(a, b):
-                    """Diferencia mínima entre dos ángulos considerando el wrap-around"""
-                    diff = abs(a - b)
-                    return min(diff, 360 - diff)
-                
-                # Ángulos cada 15° para mayor precisión en patrones orgánicos
-                valid_angles = [0, 15, 30, 45, 60, 75, 90, 105, 120, 135, 150, 165,
-                               180, 195, 210, 225, 240, 255, 270, 285, 300, 315, 330, 345]
-                ang_q = min(valid_angles, key=lambda a: angle_diff(a, ang))
-                
-                # Si el ángulo cuantizado está en el rango 180-360, 
-                # intercambiar los puntos para que la línea vaya en la dirección correcta
-                if ang_q >= 180:
-                    ang_q = ang_q - 180
-                    # Intercambiar origen: usar el punto final como origen
-                    nx1, ny1, nx2, ny2 = nx2, ny2, nx1, ny1
-                
-                # Origen normalizado (ahora es el punto correcto)
-                ox = round(nx1, 6)
-                oy = round(ny1, 6)
-                
-                # Delta depende del ángulo
-                # Para líneas H/V: el tile se repite en cuadrícula regular
-                # Para diagonales: ajustar para que el patrón tile correctamente
-                delta_x = round(tile_size, 6)
-                delta_y = round(tile_size, 6)
-                
-                # Dash/gap - la longitud de la línea y el espacio
-                dash = round(length, 6)
-                # Gap debe ser negativo y = tile_size - length (para que no se repita dentro del mismo tile)
-                gap = round(-(tile_size - length), 6)
-                
-                # Si el gap es mayor o igual a 0, hacer continua la línea
-                if gap >= 0:
-                    gap = -0.001
-                
-                pat_line = f"{ang_q}, {ox},{oy}, {delta_x},{delta_y}, {dash},{gap}"
-                pat_lines.append(pat_line)
+            # Ángulos cada 15° para mayor precisión en patrones orgánicos;
+            # cuantización, dash/gap y formato en bloque (ver pat_emit).
+            # Con `consolidate` se unen los segmentos colineales de la misma
+            # familia. Sin retícula el tile se repite en cuadrícula regular:
+            # delta = tile
+            delta = round(tile_size, 6)
+            _checkpoint(cancelled)
+            with metrics.stage("emit") as record:
+                if detected:
+                    cell, families, _ = detected
+                    pat_lines = segments_to_pat_lines(cell, tile_size, delta, delta,
+                                                      decimals=6, min_length=0.001,
+                                                      consolidate=consolidate,
+                                                      families=families)
+                else:
+                    pat_lines = segments_to_pat_lines(normalized, tile_size, delta, delta,
+                                                      decimals=6, min_length=0.001,
+                                                      consolidate=consolidate)
+                record["items"] = len(pat_lines)
             
             # Construir el archivo PAT
             header = [
@@ -279,144 +721,461 @@ class DXFtoPatConverter:
             header.extend(pat_lines)
             
             pat_content = "\r\n".join(header) + "\r\n"
-            pat_preview = render_pat_preview(pat_content)
             
-            return {
-                "pat_content": pat_content,
-                "pat_preview": pat_preview,
-                "debug_img": debug_img,
-                "stats": f"✅ DXF: {len(lines_data)} segmentos → PAT: {len(pat_lines)} líneas (tile={tile_size:.2f})"
-            }
+            # Imagen de debug y preview: solo si se piden
+            lazy = {}
+            if debug_image:
+                lazy["debug_img"] = _lazy_stage(
+                    metrics, "debug_render",
+                    lambda: render_dxf_debug(lines_data, min_x, min_y, tile_size))
+            lazy["source_segments"] = lambda: normalized
+            if preview:
+                # Con retícula los deltas solo tienen sentido en semántica de Revit
+                renderer = render_pat_revit if detected else render_pat_preview
+                lazy["pat_preview"] = _lazy_stage(
+                    metrics, "preview", lambda: renderer(pat_content))
             
+            if detected:
+                a, b = detected[2]
+                stats = (f"✅ DXF: {len(lines_data)} segmentos → PAT: {len(pat_lines)} líneas"
+                         f" (celda {np.hypot(*a):.2f} x {np.hypot(*b):.2f})")
+            else:
+                stats = f"✅ DXF: {len(lines_data)} segmentos → PAT: {len(pat_lines)} líneas (tile={tile_size:.2f})"
+            result = ConversionResult({"pat_content": pat_content, "stats": stats}, lazy)
+            if detected:
+                result["lattice"] = {"a": detected[2][0].tolist(), "b": detected[2][1].tolist()}
+                result["source_period"] = (result["lattice"]["a"], result["lattice"]["b"])
+            else:
+                result["source_period"] = ((tile_size, 0.0), (0.0, tile_size))
+            return result
+            
+        except CancelledError:
+            raise
         except ezdxf.DXFError as e:
             return {"error": f"Error leyendo DXF: {str(e)}"}
         except Exception as e:
             return {"error": f"Error: {str(e)}"}
 
 
+class _StageMemo:
+    """Memo de un valor por etapa: se reutiliza mientras la clave no cambie.
+
+    Cada etapa guarda solo su último resultado, así la memoria queda acotada
+    a una copia por etapa y mover un slider recalcula solo las etapas que
+    dependen de él.
+    """
+    
+    def __init__(self):
+        self._slots = {}
+        self._lock = threading.Lock()
+    
+    def run(self, stage, key, fn, hits):
+        with self._lock:
+            slot = self._slots.get(stage)
+        if slot is not None and slot[0] == key:
+            hits[stage] = True
+            return slot[1]
+        value = fn()
+        with self._lock:
+            self._slots[stage] = (key, value)
+        hits[stage] = False
+        return value
+    
+    def clear(self):
+        with self._lock:
+            self._slots.clear()
+
+
 class ImageToPatConverter:
-    """Convierte imágenes a PAT usando Canny edge detection y skeletonization"""
+    """Convierte imágenes a PAT usando Canny edge detection y skeletonization.
+
+    El proceso está dividido en etapas (decode → gray → blur → edges →
+    skeleton → contours → simplify → reduce → emit, y debug al pedir la
+    imagen; reduce solo con presupuesto de líneas o de error; con el motor
+    "hough" skeleton → simplify se reemplazan por una sola etapa hough),
+    cada una memoizada sobre sus propias entradas. Reutilizar la misma
+    instancia entre llamadas hace que cambiar un parámetro solo recalcule
+    las etapas posteriores.
+    """
+    
+    STAGES = ("decode", "gray", "blur", "edges", "skeleton", "contours", "simplify", "hough",
+              "reduce", "emit", "debug")
+    
+    # Motores de extracción de líneas
+    ENGINES = ("contours", "hough")
+    
+    # Lado máximo de la imagen de debug en el modo por teselas
+    DEBUG_MAX_SIDE = 2048
+    
+    # Distancia en píxeles para unir los tramos colineales de HoughLinesP
+    # (cada junta da varias detecciones paralelas y partidas)
+    HOUGH_MERGE_TOLERANCE = 2.0
     
     def __init__(self):
-        pass
+        self._memo = _StageMemo()
+    
+    @staticmethod
+    def _decode(image_bytes):
+        """Decodifica la imagen y la recorta a un cuadrado centrado"""
+        nparr = np.frombuffer(image_bytes, np.uint8)
+        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        if img is None:
+            return None
+        
+        h_orig, w_orig = img.shape[:2]
+        side = min(h_orig, w_orig)
+        start_x = (w_orig - side) // 2
+        start_y = (h_orig - side) // 2
+        return img[start_y:start_y+side, start_x:start_x+side]
+    
+    @staticmethod
+    def _gray(img):
+        return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    
+    @staticmethod
+    def _blur(gray, blur_size):
+        if blur_size > 1:
+            blur_size = blur_size if blur_size % 2 == 1 else blur_size + 1
+            return cv2.GaussianBlur(gray, (blur_size, blur_size), 0)
+        return gray
+    
+    @staticmethod
+    def _edges(blurred, canny_low, canny_high, dilate=True):
+        """Canny + dilatación para cerrar huecos antes del skeleton.
+
+        Hough usa los bordes sin dilatar: los gruesos duplican detecciones
+        y hacen más lenta la votación.
+        """
+        edges = cv2.Canny(blurred, canny_low, canny_high)
+        if not dilate:
+            return edges
+        kernel = np.ones((2, 2), np.uint8)
+        return cv2.dilate(edges, kernel, iterations=1)
+    
+    @staticmethod
+    def _skeleton(edges, thinning_method, max_thin_iter):
+        """Adelgaza los bordes a un skeleton de un píxel (ver thinning.thin)"""
+        skeleton, _ = thin(edges, thinning_method, max_thin_iter)
+        
+        # Si el skeleton está vacío, usar edges directamente
+        if cv2.countNonZero(skeleton) == 0:
+            skeleton = edges
+        return skeleton
+    
+    @staticmethod
+    def _contours(skeleton):
+        contours, _ = cv2.findContours(skeleton, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+        return contours
+    
+    @staticmethod
+    def _simplify(contours, min_contour_len, epsilon_factor):
+        """Filtra contornos cortos y aproxima cada uno con approxPolyDP"""
+        polylines = []
+        for cnt in contours:
+            arc_len = cv2.arcLength(cnt, False)
+            if arc_len < min_contour_len:
+                continue
+            approx = cv2.approxPolyDP(cnt, epsilon_factor * arc_len, False)
+            polylines.append(approx[:, 0, :])
+        return polylines
+    
+    @staticmethod
+    def _hough(edges, min_line_len, threshold, max_gap):
+        """HoughLinesP sobre los bordes y unión de los tramos colineales.
+
+        Cada junta recta sale entera, y con muchas menos líneas, en vez de
+        en los tramos que deja el skeleton. Devuelve segmentos (n, 4) en
+        píxeles.
+        """
+        lines = cv2.HoughLinesP(edges, 1, np.pi / 180, threshold,
+                                minLineLength=min_line_len, maxLineGap=max_gap)
+        if lines is None:
+            return np.zeros((0, 4), dtype=np.float64)
+        return merge_colinear(lines.reshape(-1, 4), ImageToPatConverter.HOUGH_MERGE_TOLERANCE)
+    
+    @staticmethod
+    def _debug(polylines, side):
+        """Imagen de debug: todas las polilíneas en una sola llamada"""
+        debug_img = np.ones((side, side, 3), dtype=np.uint8) * 255
+        if polylines:
+            cv2.polylines(debug_img, polylines, False, (0, 0, 0), 1, cv2.LINE_AA)
+        return debug_img
+    
+    @staticmethod
+    def _debug_segments(segments, side, max_side=DEBUG_MAX_SIDE):
+        """Imagen de debug de segmentos (n, 4), reducida si `side` supera `max_side`"""
+        size = min(side, max_side)
+        debug_img = np.ones((size, size, 3), dtype=np.uint8) * 255
+        if len(segments):
+            pts = np.round(segments * (size / side)).astype(np.int32).reshape(-1, 2, 2)
+            cv2.polylines(debug_img, list(pts), False, (0, 0, 0), 1, cv2.LINE_AA)
+        return debug_img
+    
+    @staticmethod
+    def _polyline_segments(polylines):
+        """Segmentos consecutivos (n, 4) de todas las polilíneas"""
+        if not polylines:
+            return np.zeros((0, 4), dtype=np.int32)
+        return np.concatenate([np.hstack([pts[:-1], pts[1:]]) for pts in polylines])
+    
+    @staticmethod
+    def _emit(polylines, side):
+        """Líneas PAT normalizadas a 0-1"""
+        if not polylines:
+            return []
+        return ImageToPatConverter._emit_segments(
+            ImageToPatConverter._polyline_segments(polylines), side)
+    
+    @staticmethod
+    def _reduce(segments, side, max_lines, max_error):
+        """Simplificación con presupuesto (ver simplify.simplify_segments).
+
+        Los segmentos que la emisión descartaría por cortos no cuentan.
+        Devuelve (segmentos, info) con el error en píxeles.
+        """
+        return simplify_segments(np.asarray(segments, dtype=np.float64), max_lines=max_lines,
+                                 max_error=max_error, min_length=0.01 * side)
+    
+    @staticmethod
+    def _reduce_stats(info):
+        over = ", sobre el máximo de líneas" if info.get("over_max_lines") else ""
+        return (f", simplificado {info['segments_in']} → {info['segments_out']}"
+                f" (error {info['error']:.2f} px{over})")
+    
+    @staticmethod
+    def _normalize(segments, side):
+        """Segmentos en píxeles a coordenadas del PAT: 0-1 con y hacia arriba"""
+        segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4) / side
+        segments[:, 1::2] = 1 - segments[:, 1::2]
+        return segments
+    
+    @staticmethod
+    def _emit_segments(segments, side):
+        """Líneas PAT de segmentos en píxeles, normalizados a 0-1"""
+        if not len(segments):
+            return []
+        segments = ImageToPatConverter._normalize(segments, side)
+        
+        tile_size = 1.0  # Normalizado
+        pat_lines = segments_to_pat_lines(segments, tile_size, tile_size, tile_size,
+                                          decimals=4, min_length=0.01)
+        return pat_lines
     
     def convert(self, image_bytes, canny_low=50, canny_high=150, blur_size=3, 
-                min_contour_len=20, epsilon_factor=0.01):
-        """Procesa una imagen y genera un archivo PAT"""
+                min_contour_len=20, epsilon_factor=0.01, thinning_method="morphological",
+                max_thin_iter=100, metrics=None, debug_image=True, preview=True,
+                max_memory_mb=None, workers=None, max_lines=None, max_error=None,
+                engine="contours", hough_threshold=40, hough_max_gap=5, cancelled=None):
+        """Procesa una imagen y genera un archivo PAT.
+
+        Cada opción se documenta en su módulo: thinning.thin, _hough
+        (`engine="hough"`), simplify.simplify_segments (`max_lines`,
+        `max_error`) y tiled.process_tiled (`max_memory_mb`, `workers`).
+        """
+        if engine not in self.ENGINES:
+            return {"error": f"Motor de extracción desconocido: {engine}"}
+        metrics = resolve_metrics(metrics, "image")
+        hough = (hough_threshold, hough_max_gap) if engine == "hough" else None
+        if max_memory_mb is not None:
+            result = self._convert_tiled(image_bytes, canny_low, canny_high, blur_size,
+                                         min_contour_len, epsilon_factor, thinning_method,
+                                         max_thin_iter, metrics, debug_image, preview,
+                                         max_lines, max_error, hough, max_memory_mb, workers,
+                                         cancelled)
+        else:
+            result = self._convert(image_bytes, canny_low, canny_high, blur_size,
+                                   min_contour_len, epsilon_factor, thinning_method,
+                                   max_thin_iter, metrics, debug_image, preview,
+                                   max_lines, max_error, hough, cancelled)
+        if metrics.enabled:
+            result["metrics"] = metrics.finish()
+        return result
+    
+    def _tile_segments(self, tile, canny_low, canny_high, blur_size, min_contour_len,
+                       epsilon_factor, thinning_method, max_thin_iter, hough):
+        """Etapas blur → simplify (o hough) sobre una tesela en gris.
+
+        Devuelve (segmentos, origen de la caja de cada contorno o segmento
+        Hough), como espera tiled.process_tiled.
+        """
+        blurred = self._blur(tile, blur_size)
+        edges = self._edges(blurred, canny_low, canny_high, dilate=hough is None)
+        del blurred
+        if hough is not None:
+            segments = self._hough(edges, min_contour_len, *hough)
+            return segments, np.minimum(segments[:, :2], segments[:, 2:])
+        skeleton = self._skeleton(edges, thinning_method, max_thin_iter)
+        del edges
+        contours = self._contours(skeleton)
+        polylines = self._simplify(contours, min_contour_len, epsilon_factor)
+        if contours:
+            points = np.concatenate([c.reshape(-1, 2) for c in contours])
+            first = np.cumsum([0] + [len(c) for c in contours[:-1]])
+            origins = np.minimum.reduceat(points, first, axis=0)
+        else:
+            origins = np.zeros((0, 2))
+        return self._polyline_segments(polylines), origins
+    
+    def _convert_tiled(self, image_bytes, canny_low, canny_high, blur_size, min_contour_len,
+                       epsilon_factor, thinning_method, max_thin_iter, metrics,
+                       debug_image, preview, max_lines, max_error, hough, max_memory_mb,
+                       workers, cancelled):
+        """Conversión por teselas sin memo; los píxeles son los de la imagen reducida"""
+        try:
+            budget = max_memory_mb * 2**20
+            _checkpoint(cancelled)
+            with metrics.stage("decode") as record:
+                gray, level = decode_gray_square(image_bytes, budget)
+                record["items"] = level
+            if gray is None:
+                return {"error": "Error al cargar la imagen"}
+            side = gray.shape[0]
+            
+            # El margen cubre contornos cortos enteros y el alcance del blur
+            # y del thinning en el borde de cada tesela
+            margin = 32 + min_contour_len + blur_size
+            
+            def tile_segments(tile):
+                _checkpoint(cancelled)
+                return self._tile_segments(tile, canny_low, canny_high, blur_size,
+                                           min_contour_len, epsilon_factor, thinning_method,
+                                           max_thin_iter, hough)
+            
+            with metrics.stage("tiles") as record:
+                segments, n_contours, n_tiles = process_tiled(
+                    gray, tile_segments, margin, budget - gray.nbytes, workers)
+                record["items"] = n_tiles
+            del gray
+            
+            source = segments
+            reduced = max_lines is not None or max_error is not None
+            if reduced:
+                _checkpoint(cancelled)
+                with metrics.stage("reduce") as record:
+                    segments, info = self._reduce(segments, side, max_lines, max_error)
+                    record["items"] = len(segments)
+            
+            _checkpoint(cancelled)
+            with metrics.stage("emit") as record:
+                pat_lines = self._emit_segments(segments, side)
+                record["items"] = len(pat_lines)
+            
+            if not pat_lines:
+                return {"error": "No se detectaron líneas en la imagen"}
+            
+            header = [
+                "*Image_Pattern, Generated from Image",
+                ";%TYPE=MODEL"
+            ]
+            header.extend(pat_lines)
+            pat_content = "\r\n".join(header) + "\r\n"
+            
+            lazy = {}
+            if debug_image:
+                lazy["debug_img"] = _lazy_stage(
+                    metrics, "debug", lambda: self._debug_segments(segments, side))
+            lazy["source_segments"] = lambda: self._normalize(source, side)
+            if reduced:
+                lazy["reduced_segments"] = lambda: self._normalize(segments, side)
+            if preview:
+                lazy["pat_preview"] = _lazy_stage(
+                    metrics, "preview", lambda: render_pat_preview(pat_content))
+            
+            scale = f", escala 1/{level}" if level > 1 else ""
+            data = {
+                "pat_content": pat_content,
+                "side": side,
+                "tiles": n_tiles,
+                "source_period": ((1.0, 0.0), (0.0, 1.0)),
+                "stats": (f"✅ Imagen: {n_contours} {'segmentos Hough' if hough else 'contornos'}"
+                          f" → PAT: {len(pat_lines)} líneas ({n_tiles} teselas{scale}"
+                          f"{self._reduce_stats(info) if reduced else ''})")
+            }
+            if reduced:
+                data["simplify"] = info
+            return ConversionResult(data, lazy)
+            
+        except CancelledError:
+            raise
+        except Exception as e:
+            return {"error": f"Error: {str(e)}"}
+    
+    def _convert(self, image_bytes, canny_low, canny_high, blur_size, min_contour_len,
+                 epsilon_factor, thinning_method, max_thin_iter, metrics,
+                 debug_image, preview, max_lines, max_error, hough, cancelled):
         try:
-            # Decodificar imagen
-            nparr = np.frombuffer(image_bytes, np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            hits = {}
+            
+            def run(stage, key, fn, count=None):
+                _checkpoint(cancelled)
+                with metrics.stage(stage) as record:
+                    value = self._memo.run(stage, key, fn, hits)
+                    record["cached"] = hits[stage]
+                    if count is not None:
+                        record["items"] = count(value)
+                return value
+            
+            # Cada clave encadena la de la etapa anterior con sus propios parámetros
+            k_decode = hashlib.blake2b(image_bytes, digest_size=16).hexdigest()
+            img = run("decode", k_decode, lambda: self._decode(image_bytes))
             if img is None:
                 return {"error": "Error al cargar la imagen"}
+            side = img.shape[0]
             
-            # Hacer cuadrada y obtener dimensiones
-            h_orig, w_orig = img.shape[:2]
-            side = min(h_orig, w_orig)
-            start_x = (w_orig - side) // 2
-            start_y = (h_orig - side) // 2
-            img = img[start_y:start_y+side, start_x:start_x+side]
+            gray = run("gray", k_decode, lambda: self._gray(img))
             
-            # Convertir a escala de grises
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            k_blur = (k_decode, blur_size)
+            blurred = run("blur", k_blur, lambda: self._blur(gray, blur_size))
             
-            # Aplicar blur
-            if blur_size > 1:
-                blur_size = blur_size if blur_size % 2 == 1 else blur_size + 1
-                blurred = cv2.GaussianBlur(gray, (blur_size, blur_size), 0)
+            dilate = hough is None
+            k_edges = (k_blur, canny_low, canny_high) + (() if dilate else ("raw",))
+            edges = run("edges", k_edges,
+                        lambda: self._edges(blurred, canny_low, canny_high, dilate),
+                        count=cv2.countNonZero)
+            
+            if hough is not None:
+                # Hough va directo de los bordes a segmentos
+                k_lines = (k_edges, "hough", min_contour_len, *hough)
+                lines = run("hough", k_lines,
+                            lambda: self._hough(edges, min_contour_len, *hough), count=len)
+                found = f"{len(lines)} segmentos Hough"
+                source = lambda: lines
             else:
-                blurred = gray
-            
-            # Detectar bordes con Canny
-            edges = cv2.Canny(blurred, canny_low, canny_high)
-            
-            # Dilatar y adelgazar (skeletonize)
-            kernel = np.ones((2, 2), np.uint8)
-            edges = cv2.dilate(edges, kernel, iterations=1)
-            
-            # Skeletonize usando morphological operations
-            skeleton = np.zeros(edges.shape, np.uint8)
-            element = cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))
-            temp = edges.copy()
-            while True:
-                eroded = cv2.erode(temp, element)
-                dilated = cv2.dilate(eroded, element)
-                diff = cv2.subtract(temp, dilated)
-                skeleton = cv2.bitwise_or(skeleton, diff)
-                temp = eroded.copy()
-                if cv2.countNonZero(temp) == 0:
-                    break
-            
-            # Si el skeleton está vacío, usar edges directamente
-            if cv2.countNonZero(skeleton) == 0:
-                skeleton = edges
-            
-            # Encontrar contornos
-            contours, _ = cv2.findContours(skeleton, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-            
-            # Imagen de debug
-            debug_img = np.ones((side, side, 3), dtype=np.uint8) * 255
-            
-            # Generar líneas PAT
-            pat_lines = []
-            tile_size = 1.0  # Normalizado
-            
-            # Ángulos válidos cada 15°
-            valid_angles = [0, 15, 30, 45, 60, 75, 90, 105, 120, 135, 150, 165]
-            
-            def angle_diff(a, b):
-                diff = abs(a - b)
-                return min(diff, 360 - diff)
-            
-            for cnt in contours:
-                arc_len = cv2.arcLength(cnt, False)
-                if arc_len < min_contour_len:
-                    continue
-                
-                # Aproximar polilínea
-                approx = cv2.approxPolyDP(cnt, epsilon_factor * arc_len, False)
-                pts = approx[:, 0, :]
+                k_skeleton = (k_edges, thinning_method, max_thin_iter)
+                skeleton = run("skeleton", k_skeleton,
+                               lambda: self._skeleton(edges, thinning_method, max_thin_iter),
+                               count=cv2.countNonZero)
                 
-                # Dibujar en debug
-                cv2.polylines(debug_img, [pts], False, (0, 0, 0), 1, cv2.LINE_AA)
+                contours = run("contours", k_skeleton, lambda: self._contours(skeleton),
+                               count=len)
                 
-                # Convertir segmentos a líneas PAT
-                for i in range(len(pts) - 1):
-                    p1, p2 = pts[i], pts[i + 1]
-                    
-                    # Normalizar a 0-1
-                    x1, y1 = p1[0] / side, 1 - (p1[1] / side)
-                    x2, y2 = p2[0] / side, 1 - (p2[1] / side)
-                    
-                    dx = x2 - x1
-                    dy = y2 - y1
-                    length = math.sqrt(dx**2 + dy**2)
-                    
-                    if length < 0.01:
-                        continue
-                    
-                    # Ángulo
-                    ang = math.degrees(math.atan2(dy, dx))
-                    if ang < 0:
-                        ang += 360
-                    
-                    ang_q = min(valid_angles + [a + 180 for a in valid_angles], 
-                               key=lambda a: angle_diff(a, ang))
-                    
-                    # Normalizar a 0-180
-                    if ang_q >= 180:
-                        ang_q -= 180
-                        x1, y1, x2, y2 = x2, y2, x1, y1
-                    
-                    ox = round(x1, 4)
-                    oy = round(y1, 4)
-                    dash = round(length, 4)
-                    gap = round(-(tile_size - length), 4)
-                    if gap >= 0:
-                        gap = -0.001
-                    
-                    pat_line = f"{ang_q}, {ox},{oy}, {tile_size},{tile_size}, {dash},{gap}"
-                    pat_lines.append(pat_line)
+                k_lines = (k_skeleton, min_contour_len, epsilon_factor)
+                polylines = run("simplify", k_lines,
+                                lambda: self._simplify(contours, min_contour_len, epsilon_factor),
+                                count=len)
+                found = f"{len(contours)} contornos"
+                source = lambda: self._polyline_segments(polylines)
+            
+            # Sin presupuesto las líneas pasan directo a la emisión
+            reduced = max_lines is not None or max_error is not None
+            if reduced:
+                k_reduce = (k_lines, max_lines, max_error)
+                segments, info = run("reduce", k_reduce,
+                                     lambda: self._reduce(source(), side, max_lines, max_error),
+                                     count=lambda r: len(r[0]))
+                pat_lines = run("emit", k_reduce, lambda: self._emit_segments(segments, side),
+                                count=len)
+                draw_debug = lambda: self._debug_segments(segments, side)
+            elif hough is not None:
+                k_reduce = k_lines
+                pat_lines = run("emit", k_lines, lambda: self._emit_segments(lines, side),
+                                count=len)
+                draw_debug = lambda: self._debug_segments(lines, side)
+            else:
+                k_reduce = k_lines
+                pat_lines = run("emit", k_lines, lambda: self._emit(polylines, side),
+                                count=len)
+                draw_debug = lambda: self._debug(polylines, side)
             
             if not pat_lines:
                 return {"error": "No se detectaron líneas en la imagen"}
@@ -429,14 +1188,34 @@ class ImageToPatConverter:
             header.extend(pat_lines)
             pat_content = "\r\n".join(header) + "\r\n"
             
-            pat_preview = render_pat_preview(pat_content)
+            # Imagen de debug (memoizada como una etapa más) y preview: solo si se piden
+            lazy = {}
+            if debug_image:
+                lazy["debug_img"] = _lazy_stage(
+                    metrics, "debug",
+                    lambda: self._memo.run("debug", k_reduce, draw_debug, {}))
+            lazy["source_segments"] = lambda: self._normalize(source(), side)
+            if reduced:
+                lazy["reduced_segments"] = lambda: self._normalize(segments, side)
+            if preview:
+                lazy["pat_preview"] = _lazy_stage(
+                    metrics, "preview", lambda: render_pat_preview(pat_content))
             
-            return {
+            cached = sum(hits.values())
+            data = {
                 "pat_content": pat_content,
-                "pat_preview": pat_preview,
-                "debug_img": debug_img,
-                "stats": f"✅ Imagen: {len(contours)} contornos → PAT: {len(pat_lines)} líneas"
+                "side": side,
+                "stage_cache": hits,
+                "source_period": ((1.0, 0.0), (0.0, 1.0)),
+                "stats": (f"✅ Imagen: {found} → PAT: {len(pat_lines)} líneas"
+                          f" (cache: {cached}/{len(hits)} etapas"
+                          f"{self._reduce_stats(info) if reduced else ''})")
             }
+            if reduced:
+                data["simplify"] = info
+            return ConversionResult(data, lazy)
             
+        except CancelledError:
+            raise
         except Exception as e:
-            return {"error": f"Error: {str(e)}"}
\ No newline at end of file
+            return {"error": f"Error: {str(e)}"}
@@ -0,0 +1,333 @@
+"""Cache persistente de conversiones en disco.
+
+Cada entrada se guarda con una clave que combina el contenido de entrada,
+los parámetros del conversor y la versión del código (CODE_VERSION, un hash
+de los módulos de conversión). Así subir de nuevo el mismo DXF o la misma
+foto con los mismos parámetros devuelve el PAT en milisegundos, y cambiar
+el código invalida lo guardado sin borrar nada a mano.
+
+Una entrada es un .zip con el PAT, los datos del resultado en JSON, las
+imágenes en PNG y los arreglos en .npy. Se escribe en un archivo temporal
+del mismo directorio y se publica con os.replace, así varios procesos de
+Streamlit pueden leer y escribir a la vez sin ver entradas a medias. El
+tamaño total se lleva en el archivo .size, que cada escritura actualiza;
+solo cuando pasa del máximo se recorre el directorio y se descartan las
+entradas usadas hace más tiempo (la fecha de modificación se renueva en
+cada acierto), con un lock de archivo para que un solo proceso lo haga a
+la vez.
+"""
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+import zipfile
+
+import cv2
+import numpy as np
+
+from core_logic import ConversionResult, render_saved_debug
+from jobs import job_key
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Módulos cuyo código define el resultado de una conversión
+CODE_MODULES = ("core_logic.py", "dxf_ingest.py", "lattice.py", "pat_emit.py", "simplify.py",
+                "thinning.py", "tiled.py")
+
+# Tamaño máximo por defecto del cache
+MAX_BYTES = 512 * 1024 * 1024
+
+# Claves del resultado que se guardan como imagen y como arreglo
+IMAGE_KEYS = ("debug_img", "pat_preview")
+ARRAY_KEYS = ("source_segments", "reduced_segments")
+
+# Claves que no se guardan (dependen de la corrida, no de la entrada)
+SKIP_KEYS = ("metrics", "stage_cache")
+
+# Parámetros que no cambian el resultado y no forman parte de la clave
+IGNORED_PARAMS = ("metrics", "debug_image", "preview")
+
+_code_version = None
+
+
+def code_version():
+    """Hash de los módulos de conversión (se calcula una vez por proceso)"""
+    global _code_version
+    if _code_version is None:
+        h = hashlib.blake2b(digest_size=8)
+        here = os.path.dirname(os.path.abspath(__file__))
+        for name in CODE_MODULES:
+            h.update(name.encode("utf-8"))
+            with open(os.path.join(here, name), "rb") as f:
+                h.update(f.read())
+        _code_version = h.hexdigest()
+    return _code_version
+
+
+def cache_key(kind, data, **params):
+    """Clave de una conversión: tipo, versión del código, contenido y parámetros"""
+    params = {k: v for k, v in params.items() if k not in IGNORED_PARAMS}
+    return job_key(data, kind=kind, code=code_version(), **params)
+
+
+class _FileLock:
+    """Lock exclusivo entre procesos sobre un archivo (flock o msvcrt.locking)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, "a+b")
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._file.close()
+            self._file = None
+
+
+def _encode_image(img):
+    # Las imágenes del resultado son RGB; cv2 escribe BGR
+    if img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+    ok, buf = cv2.imencode(".png", img)
+    if not ok:
+        raise ValueError("No se pudo codificar la imagen")
+    return buf.tobytes()
+
+
+def _decode_image(raw):
+    img = cv2.imdecode(np.frombuffer(raw, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    if img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    return img
+
+
+def _encode_array(arr):
+    buf = io.BytesIO()
+    np.save(buf, np.asarray(arr), allow_pickle=False)
+    return buf.getvalue()
+
+
+def _decode_array(raw):
+    return np.load(io.BytesIO(raw), allow_pickle=False)
+
+
+class DiskCache:
+    """Resultados de conversión guardados en `directory`, hasta `max_bytes` en total.
+
+    get() devuelve un ConversionResult con las imágenes y arreglos
+    decodificados recién al pedirlos, o None si la clave no está; las
+    imágenes que falten y estén en `render` se dibujan también al pedirlas.
+    put() guarda "pat_content", los datos serializables en JSON y, de las
+    imágenes y arreglos, solo los ya calculados o los de `include` (que se
+    calculan al guardar).
+    """
+
+    def __init__(self, directory, max_bytes=MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock_path = os.path.join(directory, ".lock")
+        self._size_path = os.path.join(directory, ".size")
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".zip")
+
+    def get(self, key, render=None):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                raw = f.read()
+            # Acierto: renueva la fecha para el descarte LRU
+            os.utime(path)
+            archive = zipfile.ZipFile(io.BytesIO(raw))
+            data = json.loads(archive.read("result.json").decode("utf-8"))
+            data["pat_content"] = archive.read("pattern.pat").decode("utf-8")
+        except FileNotFoundError:
+            return None
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            # Entrada dañada (p. ej. disco lleno): se descarta
+            self._remove(path)
+            return None
+
+        lazy = {}
+        for name in archive.namelist():
+            stem, ext = os.path.splitext(name)
+            if ext == ".png":
+                lazy[stem] = lambda name=name: _decode_image(archive.read(name))
+            elif ext == ".npy":
+                lazy[stem] = lambda name=name: _decode_array(archive.read(name))
+        # Las imágenes que faltan se dibujan al pedirlas, desde el resultado armado abajo
+        for name, draw in (render or {}).items():
+            if name not in lazy:
+                lazy[name] = lambda draw=draw: draw(result)
+        data["disk_cache"] = True
+        if "stats" in data:
+            data["stats"] += " (cache en disco)"
+        result = ConversionResult(data, lazy)
+        return result
+
+    def put(self, key, result, include=ARRAY_KEYS):
+        """Guarda `result` si no tiene error; devuelve True si se escribió"""
+        if "error" in result or "pat_content" not in result:
+            return False
+        if result.get("disk_cache"):
+            return False
+        extra = {k: v for k, v in result.items()
+                 if k not in IMAGE_KEYS + ARRAY_KEYS + SKIP_KEYS + ("pat_content",)}
+
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w") as archive:
+            archive.writestr("pattern.pat", result["pat_content"].encode("utf-8"),
+                             zipfile.ZIP_DEFLATED)
+            archive.writestr("result.json", json.dumps(extra, default=_json_default),
+                             zipfile.ZIP_DEFLATED)
+            pending = result.pending() if isinstance(result, ConversionResult) else ()
+            for name in IMAGE_KEYS + ARRAY_KEYS:
+                # Lo pendiente solo se calcula si se pidió incluirlo
+                if name not in result or (name in pending and name not in include):
+                    continue
+                if name in IMAGE_KEYS:
+                    # PNG ya está comprimido
+                    archive.writestr(name + ".png", _encode_image(result[name]))
+                else:
+                    archive.writestr(name + ".npy", _encode_array(result[name]),
+                                     zipfile.ZIP_DEFLATED)
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(buf.getvalue())
+            os.replace(tmp, path)
+        except OSError:
+            self._remove(tmp)
+            return False
+        if self._grow(buf.getbuffer().nbytes - replaced) > self.max_bytes:
+            self.evict()
+        return True
+
+    def _grow(self, delta):
+        """Suma `delta` al tamaño llevado en .size y devuelve el total.
+
+        Si el archivo falta o está dañado el total se vuelve a medir.
+        """
+        with _FileLock(self._lock_path):
+            try:
+                with open(self._size_path) as f:
+                    total = int(f.read()) + delta
+            except (OSError, ValueError):
+                total = self.size()
+            self._write_size(total)
+        return total
+
+    def _write_size(self, total):
+        with open(self._size_path, "w") as f:
+            f.write(str(max(total, 0)))
+
+    def _entries(self):
+        """(mtime, tamaño, ruta) de cada entrada; ignora las que desaparecen al listar"""
+        entries = []
+        for sub in os.scandir(self.directory):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if not entry.name.endswith(".zip"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """Descarta las entradas menos usadas hasta quedar en `max_bytes`"""
+        with _FileLock(self._lock_path):
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+            self._write_size(total)
+            # Temporales abandonados por un proceso que murió a mitad de put()
+            stale = time.time() - 3600
+            for sub in os.scandir(self.directory):
+                if sub.is_dir():
+                    for entry in os.scandir(sub.path):
+                        if entry.name.endswith(".tmp"):
+                            try:
+                                if entry.stat().st_mtime < stale:
+                                    self._remove(entry.path)
+                            except FileNotFoundError:
+                                pass
+
+    def clear(self):
+        with _FileLock(self._lock_path):
+            for _, _, path in self._entries():
+                self._remove(path)
+            self._write_size(0)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def convert(self, kind, data, params, convert, include=ARRAY_KEYS):
+        """Resultado de `convert()` para (kind, data, params), desde el cache si está.
+
+        `params` son los del conversor: los que no cambian el resultado
+        (IGNORED_PARAMS) no forman parte de la clave. Con un acierto el
+        resultado trae "disk_cache": True y no incluye "metrics". La imagen
+        de debug solo se guarda si ya se había calculado; si falta, el
+        acierto la dibuja al pedirla (core_logic.render_saved_debug).
+        """
+        key = cache_key(kind, data, **params)
+        render = None
+        if params.get("debug_image", True):
+            render = {"debug_img": lambda result: render_saved_debug(kind, result)}
+        result = self.get(key, render)
+        if result is None:
+            result = convert()
+            self.put(key, result, include)
+        return result
+
+
+def _json_default(value):
+    # Tuplas de NumPy (p. ej. la retícula) y escalares
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} no es serializable")
@@ -0,0 +1,403 @@
+import mmap
+import re
+
+import numpy as np
+import ezdxf
+from ezdxf import path, recover
+from ezdxf.addons import iterdxf
+
+
+# Entidades que se convierten a segmentos: las rectas se leen directo y las
+# curvas se aproximan por cuerdas
+SEGMENT_TYPES = ("LINE", "LWPOLYLINE")
+CURVE_TYPES = ("ARC", "CIRCLE", "ELLIPSE", "SPLINE", "POLYLINE")
+ENTITY_TYPES = SEGMENT_TYPES + CURVE_TYPES + ("INSERT",)
+
+# Tipo con que la lectura masiva informa las LWPOLYLINE con bulges (arcos),
+# que hay que teselar como curvas
+BULGED_TYPE = "LWPOLYLINE_BULGE"
+
+# Sin tolerancia de cuerda explícita, la flecha máxima de cada curva es esta
+# fracción de su tamaño (radio, semieje mayor o diagonal de su caja)
+RELATIVE_CHORD_TOLERANCE = 0.01
+
+
+class SegmentBuffer:
+    """Arreglo (n, 4) float64 de segmentos x1, y1, x2, y2 que crece por bloques.
+
+    Evita construir listas de tuplas: las filas se escriben directo en un
+    buffer preasignado que duplica su capacidad cuando se llena.
+    """
+
+    def __init__(self, capacity=1024):
+        self._data = np.empty((max(1, capacity), 4), dtype=np.float64)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _reserve(self, extra):
+        needed = self._size + extra
+        if needed > len(self._data):
+            capacity = max(needed, 2 * len(self._data))
+            data = np.empty((capacity, 4), dtype=np.float64)
+            data[:self._size] = self._data[:self._size]
+            self._data = data
+
+    def append(self, x1, y1, x2, y2):
+        self._reserve(1)
+        self._data[self._size] = (x1, y1, x2, y2)
+        self._size += 1
+
+    def extend(self, segments):
+        segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+        self._reserve(len(segments))
+        self._data[self._size:self._size + len(segments)] = segments
+        self._size += len(segments)
+
+    @property
+    def segments(self):
+        return self._data[:self._size]
+
+
+def polyline_segments(points, closed=False):
+    """Segmentos consecutivos de una polilínea (m, 2) en una sola operación"""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(points) < 2:
+        return np.zeros((0, 4), dtype=np.float64)
+    if closed and len(points) > 2:
+        points = np.vstack([points, points[:1]])
+    return np.hstack([points[:-1], points[1:]])
+
+
+def transform_segments(segments, matrix):
+    """Aplica una Matrix44 de ezdxf (convención fila) a un arreglo (n, 4)"""
+    m = np.array(list(matrix.rows()), dtype=np.float64)
+    points = segments.reshape(-1, 2) @ m[:2, :2] + m[3, :2]
+    return points.reshape(-1, 4)
+
+
+def _curve_size(entity):
+    """Tamaño característico de una curva para la tolerancia relativa"""
+    kind = entity.dxftype()
+    if kind in ("ARC", "CIRCLE"):
+        return abs(entity.dxf.radius)
+    if kind == "ELLIPSE":
+        return entity.dxf.major_axis.magnitude
+    if kind == "SPLINE":
+        points = entity.control_points if len(entity.control_points) else entity.fit_points
+    elif kind == "LWPOLYLINE":
+        points = list(entity.get_points("xy"))
+    else:
+        points = [v.dxf.location for v in entity.vertices]
+    points = np.array([(p[0], p[1]) for p in points], dtype=np.float64).reshape(-1, 2)
+    if len(points) < 2:
+        return 0.0
+    return float(np.hypot(*(points.max(axis=0) - points.min(axis=0))))
+
+
+class Tessellator:
+    """Convierte entidades DXF en segmentos (n, 4).
+
+    Las curvas (ARC, CIRCLE, ELLIPSE, SPLINE y POLYLINE o LWPOLYLINE con
+    bulges) se aproximan por cuerdas con flecha máxima `chord_tolerance` en unidades
+    del dibujo; si es None se usa RELATIVE_CHORD_TOLERANCE por el tamaño de
+    cada curva. Cada bloque se tesela una sola vez (incluidos sus INSERT
+    anidados) y todos los INSERT y MINSERT que lo referencian reutilizan
+    esos segmentos con una transformación vectorizada. Para resolver
+    INSERT hace falta `blocks` (doc.blocks); sin él se ignoran.
+    """
+
+    def __init__(self, chord_tolerance=None, blocks=None):
+        self.chord_tolerance = chord_tolerance
+        self.blocks = blocks
+        self._block_cache = {}
+        self._resolving = set()
+
+    def _tolerance(self, entity):
+        if self.chord_tolerance:
+            return self.chord_tolerance
+        size = _curve_size(entity)
+        return size * RELATIVE_CHORD_TOLERANCE if size > 0 else 1e-6
+
+    def segments(self, entity):
+        """Segmentos de una entidad soportada; (0, 4) para las demás"""
+        kind = entity.dxftype()
+        if kind == "LINE":
+            start, end = entity.dxf.start, entity.dxf.end
+            return np.array([[start.x, start.y, end.x, end.y]], dtype=np.float64)
+        if kind == "LWPOLYLINE" and not entity.has_arc:
+            return polyline_segments(list(entity.get_points("xy")), entity.closed)
+        if kind in ("ARC", "CIRCLE", "ELLIPSE", "SPLINE"):
+            points = [(v.x, v.y) for v in entity.flattening(self._tolerance(entity))]
+            return polyline_segments(points)
+        if kind in ("POLYLINE", "LWPOLYLINE"):
+            if kind == "POLYLINE" and (entity.is_poly_face_mesh or entity.is_polygon_mesh):
+                return np.zeros((0, 4), dtype=np.float64)
+            flat = path.make_path(entity).flattening(self._tolerance(entity))
+            return polyline_segments([(v.x, v.y) for v in flat])
+        if kind == "INSERT":
+            return self.insert_segments(entity)
+        return np.zeros((0, 4), dtype=np.float64)
+
+    def block_segments(self, name):
+        """Segmentos de una definición de bloque en sus coordenadas, cacheados"""
+        cached = self._block_cache.get(name)
+        if cached is not None:
+            return cached
+        block = self.blocks.get(name) if self.blocks is not None else None
+        if block is None or name in self._resolving:
+            # Bloque inexistente o referencia circular
+            return np.zeros((0, 4), dtype=np.float64)
+
+        self._resolving.add(name)
+        try:
+            buffer = SegmentBuffer()
+            for entity in block:
+                buffer.extend(self.segments(entity))
+        finally:
+            self._resolving.discard(name)
+        cached = buffer.segments.copy()
+        self._block_cache[name] = cached
+        return cached
+
+    def insert_segments(self, insert):
+        """Segmentos de un INSERT (o de cada copia de un MINSERT) en el WCS"""
+        local = self.block_segments(insert.dxf.name)
+        if not len(local):
+            return local
+        if insert.mcount > 1:
+            return np.concatenate([transform_segments(local, copy.matrix44())
+                                   for copy in insert.multi_insert()])
+        return transform_segments(local, insert.matrix44())
+
+
+def add_entity(buffer, entity, tessellator=None):
+    """Agrega al buffer los segmentos de una entidad soportada"""
+    kind = entity.dxftype()
+    if kind == "LINE":
+        start, end = entity.dxf.start, entity.dxf.end
+        buffer.append(start.x, start.y, end.x, end.y)
+    elif kind == "LWPOLYLINE" and not entity.has_arc:
+        buffer.extend(polyline_segments(list(entity.get_points("xy")), entity.closed))
+    else:
+        buffer.extend((tessellator or Tessellator()).segments(entity))
+
+
+_ENTITIES_START = re.compile(rb"(?:^|\n)[ \t]*0[ \t]*\r?\n[ \t]*SECTION[ \t]*\r?\n"
+                             rb"[ \t]*2[ \t]*\r?\n[ \t]*ENTITIES[ \t]*\r?\n")
+_SECTION_END = re.compile(rb"\n[ \t]*0[ \t]*\r?\n[ \t]*ENDSEC")
+
+
+def _scan_chunk(lines, first_entity):
+    """Segmentos de un bloque de tags (código, valor) con entidades completas.
+
+    Devuelve (segmentos, clave de orden, tipos vistos); la clave ordena por
+    entidad y luego por vértice, igual que el recorrido entidad por entidad.
+    Las entidades del paperspace (código 67 distinto de 0) se descartan,
+    igual que al consultar el modelspace, y las LWPOLYLINE con algún bulge
+    (código 42 distinto de 0) se informan como BULGED_TYPE.
+    """
+    codes = np.char.strip(np.array(lines[0::2]))
+    values = np.array(lines[1::2], dtype=object)
+    is_start = codes == b"0"
+    entity = np.cumsum(is_start) - 1
+    types = np.char.strip(values[is_start].astype(bytes))
+    empty = np.zeros((0, 4)), np.zeros(0)
+
+    space_sel = codes == b"67"
+    model = np.ones(len(types), dtype=bool)
+    model[entity[space_sel]] = values[space_sel].astype(np.float64) == 0
+    seen = set(types[model].tolist())
+    bulge_sel = codes == b"42"
+    if bulge_sel.any():
+        bulged = np.zeros(len(types), dtype=bool)
+        bulged[entity[bulge_sel]] = values[bulge_sel].astype(np.float64) != 0
+        if (bulged & model & (types == b"LWPOLYLINE")).any():
+            seen.add(BULGED_TYPE.encode("ascii"))
+
+    parts = []
+    keys = []
+
+    # LINE: un valor de cada código 10, 20, 11, 21 por entidad
+    line_ent = (types == b"LINE") & model
+    if line_ent.any():
+        in_line = line_ent[entity]
+        cols = []
+        for code in (b"10", b"20", b"11", b"21"):
+            sel = in_line & (codes == code)
+            cols.append(values[sel].astype(np.float64))
+        ids = entity[in_line & (codes == b"10")]
+        parts.append(np.stack(cols, axis=1))
+        keys.append((ids + first_entity) * 2.0 ** 32)
+
+    # LWPOLYLINE: vértices 10/20 en orden y bandera 70 (bit 1 = cerrada)
+    poly_ent = (types == b"LWPOLYLINE") & model
+    if poly_ent.any():
+        in_poly = poly_ent[entity]
+        xs = values[in_poly & (codes == b"10")].astype(np.float64)
+        ys = values[in_poly & (codes == b"20")].astype(np.float64)
+        ids = entity[in_poly & (codes == b"10")]
+        flag_sel = in_poly & (codes == b"70")
+        flags = np.zeros(len(types), dtype=np.int64)
+        flags[entity[flag_sel]] = values[flag_sel].astype(np.float64).astype(np.int64)
+
+        seq = np.arange(len(ids)) - np.searchsorted(ids, ids)
+        same = ids[1:] == ids[:-1]
+        parts.append(np.stack([xs[:-1], ys[:-1], xs[1:], ys[1:]], axis=1)[same])
+        keys.append((ids[:-1][same] + first_entity) * 2.0 ** 32 + seq[:-1][same])
+
+        # Segmento de cierre para polilíneas cerradas con más de 2 vértices
+        first = np.flatnonzero(np.r_[True, ~same])
+        last = np.r_[first[1:], len(ids)] - 1
+        closing = ((flags[ids[first]] & 1) == 1) & (last - first + 1 > 2)
+        first, last = first[closing], last[closing]
+        parts.append(np.stack([xs[last], ys[last], xs[first], ys[first]], axis=1))
+        keys.append((ids[first] + first_entity) * 2.0 ** 32 + seq[last] + 1)
+
+    if not parts:
+        return empty[0], empty[1], seen
+    return np.concatenate(parts), np.concatenate(keys), seen
+
+
+def scan_segments(path, chunk_bytes=1 << 24):
+    """Lectura masiva de LINE y LWPOLYLINE del modelspace de un DXF ASCII sin crear entidades.
+
+    Mapea el archivo en memoria, ubica la sección ENTITIES y la procesa en
+    bloques de `chunk_bytes`: los tags de cada bloque se convierten a
+    arreglos y los segmentos se extraen con operaciones vectorizadas.
+    Devuelve (segmentos, tipos de entidad vistos) o None si el archivo no es
+    un DXF ASCII con sección ENTITIES (p. ej. DXF binario). Las LWPOLYLINE
+    con bulges salen como cuerdas y se informan como BULGED_TYPE.
+    """
+    with open(path, "rb") as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return None
+    try:
+        if data[:22] == b"AutoCAD Binary DXF\r\n\x1a":
+            return None
+        start = _ENTITIES_START.search(data)
+        if start is None:
+            return None
+        end = _SECTION_END.search(data, start.end() - 1)
+        if end is None:
+            return None
+        section_end = end.start() + 1
+
+        buffer = SegmentBuffer()
+        seen = set()
+        carry = b""
+        first_entity = 0
+        pos = start.end()
+        while pos < section_end:
+            stop = min(pos + chunk_bytes, section_end)
+            lines = (carry + data[pos:stop]).split(b"\n")
+            # La última línea queda incompleta (o vacía, al final de la sección)
+            partial = lines.pop()
+            pending = []
+            if stop < section_end:
+                # Solo entidades completas: desde el último código 0 se espera
+                # al siguiente bloque, respetando la paridad código/valor
+                if len(lines) % 2:
+                    pending.append(lines.pop())
+                codes = lines[0::2]
+                last = next((i for i in range(len(codes) - 1, -1, -1)
+                             if codes[i].strip() == b"0"), 0)
+                pending = lines[2 * last:] + pending
+                lines = lines[:2 * last]
+            carry = b"\n".join(pending + [partial])
+            if len(lines) >= 2:
+                segs, keys, types = _scan_chunk(lines[:len(lines) // 2 * 2], first_entity)
+                first_entity += int(np.count_nonzero(np.char.strip(np.array(lines[0::2])) == b"0"))
+                seen |= types
+                buffer.extend(segs[np.argsort(keys, kind="stable")])
+            pos = stop
+        return buffer.segments, seen
+    finally:
+        data.close()
+
+
+def _is_path(source):
+    return isinstance(source, (str, bytes)) or hasattr(source, "__fspath__")
+
+
+def _open_document(source):
+    if _is_path(source):
+        return ezdxf.readfile(source)
+    doc, _ = recover.read(source)
+    return doc
+
+
+def iter_entities(source, stream=True, types=ENTITY_TYPES):
+    """Entidades soportadas del modelspace de un DXF (ruta o stream binario).
+
+    Con `stream` y una ruta se usa ezdxf.addons.iterdxf, que recorre la
+    sección ENTITIES sin cargar el documento completo en memoria. En otro
+    caso se carga el documento con ezdxf y se consulta el modelspace
+    (iterdxf.single_pass_modelspace pierde la última entidad del stream,
+    por eso los streams siempre van por el documento).
+    """
+    if stream and _is_path(source):
+        doc = iterdxf.opendxf(source)
+        try:
+            yield from doc.modelspace(types=types)
+        finally:
+            doc.close()
+        return
+
+    yield from _open_document(source).modelspace().query(" ".join(types))
+
+
+def read_segments(source, stream=True, chord_tolerance=None):
+    """Lee todos los segmentos de un DXF a un arreglo (n, 4) float64.
+
+    Con `stream` y una ruta se intenta primero la lectura masiva
+    (scan_segments), que solo entiende LINE y LWPOLYLINE sin bulges; si el
+    archivo tiene curvas se sigue con iterdxf. Los INSERT necesitan las
+    definiciones de bloque, que están fuera de la sección ENTITIES, así que
+    con bloques (o sin `stream`, o si iterdxf no puede leer el archivo, p.
+    ej. un DXF binario) se carga el documento completo, que es el camino
+    clásico. Las curvas se aproximan con `chord_tolerance` (ver Tessellator).
+    """
+    use_document = not stream or not _is_path(source)
+    if not use_document:
+        try:
+            scanned = scan_segments(source)
+        except ValueError:
+            scanned = None
+        if scanned is not None:
+            segments, seen = scanned
+            seen = {t.decode("ascii", "replace") for t in seen}
+            if not seen.intersection(CURVE_TYPES + (BULGED_TYPE, "INSERT")):
+                return segments
+            use_document = "INSERT" in seen
+
+    buffer = SegmentBuffer()
+    try:
+        if use_document:
+            doc = _open_document(source)
+            tessellator = Tessellator(chord_tolerance, doc.blocks)
+            entities = doc.modelspace().query(" ".join(ENTITY_TYPES))
+        else:
+            tessellator = Tessellator(chord_tolerance)
+            entities = iter_entities(source, stream, SEGMENT_TYPES + CURVE_TYPES)
+        for entity in entities:
+            add_entity(buffer, entity, tessellator)
+    except (ezdxf.DXFError, ValueError, EOFError):
+        if use_document or not stream or not _is_path(source):
+            raise
+        return read_segments(source, stream=False, chord_tolerance=chord_tolerance)
+    return buffer.segments
+
+
+def segment_extents(segments):
+    """(min_x, min_y, max_x, max_y) de todos los extremos en una pasada"""
+    xs = segments[:, 0::2]
+    ys = segments[:, 1::2]
+    return float(xs.min()), float(ys.min()), float(xs.max()), float(ys.max())
+
+
+def segment_lengths(segments):
+    return np.hypot(segments[:, 2] - segments[:, 0], segments[:, 3] - segments[:, 1])
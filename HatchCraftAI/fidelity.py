@@ -0,0 +1,357 @@
+"""Verificación de fidelidad entre la geometría de origen y el PAT generado.
+
+Uso:
+    python fidelity.py dibujo.dxf [--tolerance 0.01] [--diff diff.png]
+    python fidelity.py textura.jpg [--tolerance 0.005]
+
+Expande el PAT con la semántica de Revit (pat_visible_dashes) dentro de una
+ventana, muestrea ambos conjuntos de segmentos y mide en las dos
+direcciones la distancia de cada muestra al segmento más cercano del otro
+conjunto con un índice de grilla uniforme. Así se ve cuánto movieron la
+geometría la cuantización a 15°, los gaps forzados a -0.001 o la
+simplificación, y si el PAT dibuja líneas que no están en el origen.
+"""
+import argparse
+import sys
+
+import cv2
+import numpy as np
+
+from core_logic import (DXFtoPatConverter, ImageToPatConverter, PatPattern, parse_pat,
+                        pat_visible_dashes, render_dxf_debug)
+
+# Tolerancia por defecto, relativa al lado mayor de la ventana
+TOLERANCE = 0.005
+
+# Muestras por tolerancia a lo largo de cada segmento
+SAMPLES_PER_TOLERANCE = 2
+
+# Tope de muestras por conjunto: si se supera se alarga el paso
+MAX_POINTS = 2_000_000
+
+# Pares punto-segmento evaluados por lote en la consulta a la grilla
+BATCH_PAIRS = 4_000_000
+
+# Celdas máximas de la grilla (el índice CSR ocupa 8 bytes por celda)
+MAX_CELLS = 1 << 22
+
+
+def _lengths(segments):
+    return np.hypot(segments[:, 2] - segments[:, 0], segments[:, 3] - segments[:, 1])
+
+
+def pattern_segments(pat_content, window):
+    """Dashes visibles del PAT dentro de `window` = (x_min, y_min, x_max, y_max)"""
+    pattern = pat_content if isinstance(pat_content, PatPattern) else parse_pat(pat_content)
+    return pat_visible_dashes(pattern, *window)
+
+
+def sample_segments(segments, step):
+    """Puntos cada `step` (como máximo) a lo largo de cada segmento, extremos incluidos.
+
+    Devuelve (puntos (m, 2), dueño (m,)).
+    """
+    lengths = _lengths(segments)
+    steps = np.ceil(lengths / step).astype(np.int64) + 1
+    owner = np.repeat(np.arange(len(segments)), steps)
+    first = np.repeat(np.cumsum(steps) - steps, steps)
+    t = (np.arange(len(owner)) - first) / np.maximum(steps[owner] - 1, 1)
+    p, d = segments[owner, :2], segments[owner, 2:] - segments[owner, :2]
+    return p + t[:, None] * d, owner
+
+
+def point_segment_distance(points, segments):
+    """Distancia de cada punto (m, 2) a su segmento (m, 4), par a par"""
+    p = segments[:, :2]
+    d = segments[:, 2:] - p
+    w = points - p
+    dd = np.einsum("ij,ij->i", d, d)
+    t = np.clip(np.einsum("ij,ij->i", w, d) / np.where(dd > 0, dd, 1.0), 0.0, 1.0)
+    return np.hypot(*(w - t[:, None] * d).T)
+
+
+class SegmentGrid:
+    """Índice de grilla uniforme sobre un arreglo (n, 4) de segmentos.
+
+    Cada segmento se registra en las celdas que atraviesa (muestreado cada
+    media celda) y las celdas quedan en formato CSR: `start[c]:start[c+1]`
+    son las posiciones de los segmentos de la celda c en `owner`. Una
+    consulta es indexar celdas vecinas y calcular las distancias en bloque.
+    Si la grilla superaría MAX_CELLS celdas, la celda se agranda.
+    """
+
+    def __init__(self, segments, cell):
+        self.segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+        corners = self.segments.reshape(-1, 2)
+        self.origin = corners.min(axis=0)
+        extent = corners.max(axis=0) - self.origin
+        cells = np.prod(extent / cell + 1)
+        self.cell = float(cell) * max(1.0, np.sqrt(cells / MAX_CELLS))
+        self.shape = (extent // self.cell).astype(np.int64) + 1
+
+        points, owner = sample_segments(self.segments, self.cell / 2)
+        ids = self._cell_id(np.minimum(self._cells(points), self.shape - 1))
+        n = max(1, len(self.segments))
+        pairs = np.sort(ids * n + owner)
+        pairs = pairs[np.concatenate([[True], pairs[1:] != pairs[:-1]])]
+        ids, self.owner = np.divmod(pairs, n)
+        self.start = np.searchsorted(ids, np.arange(self.shape[0] * self.shape[1] + 1))
+
+        # Columnas para el kernel de distancia: origen, dirección y 1/|d|²
+        s = self.segments
+        self._px, self._py = s[:, 0].copy(), s[:, 1].copy()
+        self._dx, self._dy = s[:, 2] - s[:, 0], s[:, 3] - s[:, 1]
+        dd = self._dx ** 2 + self._dy ** 2
+        self._inv = np.divide(1.0, dd, out=np.zeros_like(dd), where=dd > 0)
+
+    def _cells(self, points):
+        return np.floor((points - self.origin) / self.cell).astype(np.int64)
+
+    def _cell_id(self, cells):
+        return cells[..., 0] * self.shape[1] + cells[..., 1]
+
+    def _candidates(self, points, ring):
+        """Pares (punto, segmento) de las celdas a `ring` celdas o menos de cada punto"""
+        offsets = np.arange(-ring, ring + 1)
+        dx, dy = np.meshgrid(offsets, offsets, indexing="ij")
+        cells = self._cells(points)[:, None, :] + np.stack([dx.ravel(), dy.ravel()], axis=1)
+        inside = ((cells >= 0) & (cells < self.shape)).all(axis=2).ravel()
+        ids = np.where(inside, self._cell_id(cells).ravel(), 0)
+        lo = self.start[ids]
+        counts = np.where(inside, self.start[ids + 1] - lo, 0)
+        first = np.repeat(np.cumsum(counts) - counts, counts)
+        seg = self.owner[np.repeat(lo, counts) + np.arange(counts.sum()) - first]
+        pt = np.repeat(np.repeat(np.arange(len(points)), dx.size), counts)
+        return pt, seg
+
+    def _distance(self, x, y, seg):
+        """point_segment_distance con las columnas precalculadas del segmento `seg`"""
+        wx = x - self._px[seg]
+        wy = y - self._py[seg]
+        dx, dy = self._dx[seg], self._dy[seg]
+        t = np.clip((wx * dx + wy * dy) * self._inv[seg], 0.0, 1.0)
+        wx -= t * dx
+        wy -= t * dy
+        return np.sqrt(wx * wx + wy * wy)
+
+    def _nearest(self, points, ring):
+        """Distancia al segmento más cercano entre los candidatos a `ring` celdas"""
+        found = np.full(len(points), np.inf)
+        # Lotes para acotar la memoria de los pares
+        density = max(1.0, len(self.owner) / max(1, len(self.start) - 1))
+        batch = max(1, int(BATCH_PAIRS / ((2 * ring + 1) ** 2 * density)))
+        for start in range(0, len(points), batch):
+            chunk = points[start:start + batch]
+            pt, seg = self._candidates(chunk, ring)
+            if len(pt):
+                # pt viene ordenado: mínimo por tramos con reduceat
+                dist = self._distance(chunk[pt, 0], chunk[pt, 1], seg)
+                heads = np.flatnonzero(np.concatenate([[True], pt[1:] != pt[:-1]]))
+                found[start + pt[heads]] = np.minimum.reduceat(dist, heads)
+        return found
+
+    def distance(self, points):
+        """Distancia exacta de cada punto al segmento más cercano (inf si no hay segmentos).
+
+        Un segmento a distancia r de un punto tiene una muestra a menos de
+        r + celda/4, así que aparece entre los candidatos a `ring` celdas si
+        r <= (ring - 1/4) * celda. Las distancias mayores se confirman con el
+        anillo que las cubre y los puntos sin candidatos duplican el anillo.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        best = np.full(len(points), np.inf)
+        if not len(self.segments) or not len(points):
+            return best
+        reach = np.abs(points - self.origin).max() + self.shape.max() * self.cell
+        max_ring = int(np.ceil(reach / self.cell)) + 1
+        rings = np.ones(len(points), dtype=np.int64)
+        pending = np.arange(len(points))
+        while len(pending):
+            ring = int(rings[pending].min())
+            group = pending[rings[pending] == ring]
+            found = self._nearest(points[group], ring)
+            done = (found <= (ring - 0.25) * self.cell) | (ring >= max_ring)
+            best[group[done]] = found[done]
+            # Anillo siguiente: el que cubre lo hallado, redondeado a potencia de 2
+            need = np.where(np.isfinite(found), np.ceil(found / self.cell + 0.25), 2 * ring)
+            need = 2 ** np.ceil(np.log2(np.maximum(need, ring + 1))).astype(np.int64)
+            rings[group] = np.minimum(need, max_ring)
+            finished = np.zeros(len(points), dtype=bool)
+            finished[group[done]] = True
+            pending = pending[~finished[pending]]
+        return best
+
+
+def _grid_cell(tolerance):
+    """Celda de dos tolerancias: un anillo de vecinas confirma todo lo tolerable"""
+    return 2 * tolerance
+
+
+def _periodic(segments, period):
+    """`segments` más sus 8 copias vecinas por los vectores de `period` = (a, b)"""
+    a, b = np.asarray(period, dtype=np.float64).reshape(2, 2)
+    shifts = np.array([i * a + j * b for i in (-1, 0, 1) for j in (-1, 0, 1)])
+    return (segments[None, :, :] + np.tile(shifts, 2)[:, None, :]).reshape(-1, 4)
+
+
+def _directed(points, segments, tolerance):
+    if not len(points):
+        return np.zeros(0)
+    if not len(segments):
+        return np.full(len(points), np.inf)
+    return SegmentGrid(segments, _grid_cell(tolerance)).distance(points)
+
+
+def _to_preview(segments, window, preview_size):
+    """Misma transformación que render_dxf_debug: 5% de margen e y hacia abajo"""
+    tile_size = max(window[2] - window[0], window[3] - window[1])
+    scale = preview_size / tile_size * 0.9
+    offset = preview_size * 0.05
+    pts = segments.reshape(-1, 2) - window[:2]
+    pts = pts * scale + offset
+    pts[:, 1] = preview_size - pts[:, 1]
+    return np.round(pts * 16).astype(np.int32).reshape(-1, 2, 2)
+
+
+def _diff_image(source, pat_segs, src_pts, src_owner, src_bad, pat_pts, pat_owner, pat_bad,
+                window, step, preview_size):
+    """Origen con render_dxf_debug atenuado, PAT en gris y los desvíos resaltados.
+
+    Rojo: tramos del origen que el PAT no cubre. Azul: tramos del PAT que no
+    están en el origen.
+    """
+    window = np.asarray(window, dtype=np.float64)
+    img = render_dxf_debug(source, window[0], window[1],
+                           max(window[2] - window[0], window[3] - window[1]), preview_size)
+    img = (255 - (255 - img.astype(np.float64)) * 0.3).astype(np.uint8)
+    if len(pat_segs):
+        cv2.polylines(img, _to_preview(pat_segs, window, preview_size), False, (90, 90, 90), 1,
+                      cv2.LINE_AA, shift=4)
+
+    for segments, points, owner, bad, color in ((source, src_pts, src_owner, src_bad, (230, 0, 0)),
+                                                (pat_segs, pat_pts, pat_owner, pat_bad, (0, 0, 230))):
+        if not bad.any():
+            continue
+        d = segments[owner[bad], 2:] - segments[owner[bad], :2]
+        u = d / np.maximum(np.hypot(*d.T), 1e-12)[:, None] * (step / 2)
+        pieces = np.hstack([points[bad] - u, points[bad] + u])
+        cv2.polylines(img, _to_preview(pieces, window, preview_size), False, color, 2,
+                      cv2.LINE_AA, shift=4)
+    return img
+
+
+def check_fidelity(pat_content, source_segments, window=None, tolerance=None, period=None,
+                   diff_image=False, preview_size=500):
+    """Compara los segmentos de origen (n, 4) con el PAT expandido en `window`.
+
+    Las coordenadas de origen deben estar en las unidades del PAT (las que
+    entrega cada conversor en "source_segments"). `window` = (x_min, y_min,
+    x_max, y_max) es por defecto la extensión del origen y `tolerance`, si
+    no se da, TOLERANCE veces su lado mayor. `period` = (a, b) son los
+    vectores con que se repite el origen ("source_period" de los
+    conversores): la referencia incluye las copias vecinas, así las líneas
+    del PAT en el borde de la ventana que pertenecen al tile siguiente no
+    cuentan como sobrantes.
+
+    Ambos conjuntos se muestrean cada tolerancia / SAMPLES_PER_TOLERANCE y
+    se mide la distancia de cada muestra al otro conjunto:
+    - "coverage": fracción del largo de origen a menos de `tolerance` del PAT
+    - "precision": fracción del largo del PAT a menos de `tolerance` del origen
+    - "score": media armónica de ambas (0 a 1)
+    - "hausdorff": máximo de las dos distancias dirigidas, más "source_to_pat"
+      y "pat_to_source" por separado (inf si un conjunto está vacío)
+    - "mean_distance": distancia media de las muestras de origen al PAT
+    - "segments": (segmentos de origen, dashes del PAT en la ventana)
+    - "diff_img" con `diff_image` (ver _diff_image)
+    """
+    source = np.asarray(source_segments, dtype=np.float64).reshape(-1, 4)
+    if window is None:
+        if not len(source):
+            raise ValueError("Sin segmentos de origen ni ventana")
+        pts = source.reshape(-1, 2)
+        window = (*pts.min(axis=0), *pts.max(axis=0))
+    window = tuple(float(v) for v in window)
+    size = max(window[2] - window[0], window[3] - window[1])
+    if size <= 0:
+        raise ValueError("La ventana tiene tamaño cero")
+    tolerance = TOLERANCE * size if tolerance is None else float(tolerance)
+
+    pat_segs = pattern_segments(pat_content, window)
+
+    # Paso de muestreo: el pedido o el que respeta MAX_POINTS
+    total = max(_lengths(source).sum(), _lengths(pat_segs).sum())
+    step = max(tolerance / SAMPLES_PER_TOLERANCE, float(total) / MAX_POINTS)
+
+    src_pts, src_owner = sample_segments(source, step)
+    pat_pts, pat_owner = sample_segments(pat_segs, step)
+    reference = source if period is None else _periodic(source, period)
+    src_dist = _directed(src_pts, pat_segs, tolerance)
+    pat_dist = _directed(pat_pts, reference, tolerance)
+
+    # Cada muestra pesa el largo que representa de su segmento
+    def weighted_fraction(segments, owner, ok):
+        if not len(owner):
+            return 1.0
+        weight = (_lengths(segments) / np.bincount(owner, minlength=len(segments)))[owner]
+        total = weight.sum()
+        return float(weight[ok].sum() / total) if total > 0 else float(ok.mean())
+
+    src_ok = src_dist <= tolerance
+    pat_ok = pat_dist <= tolerance
+    coverage = weighted_fraction(source, src_owner, src_ok)
+    precision = weighted_fraction(pat_segs, pat_owner, pat_ok)
+    score = 2 * coverage * precision / (coverage + precision) if coverage + precision else 0.0
+    to_pat = float(src_dist.max()) if len(src_dist) else 0.0
+    to_source = float(pat_dist.max()) if len(pat_dist) else 0.0
+
+    result = {
+        "score": score,
+        "coverage": coverage,
+        "precision": precision,
+        "hausdorff": max(to_pat, to_source),
+        "source_to_pat": to_pat,
+        "pat_to_source": to_source,
+        "mean_distance": float(src_dist.mean()) if len(src_dist) else 0.0,
+        "tolerance": tolerance,
+        "step": step,
+        "window": window,
+        "segments": (len(source), len(pat_segs)),
+    }
+    if diff_image:
+        result["diff_img"] = _diff_image(source, pat_segs, src_pts, src_owner, ~src_ok,
+                                         pat_pts, pat_owner, ~pat_ok, window, step, preview_size)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verifica un PAT generado contra su origen")
+    parser.add_argument("input", help="Archivo .dxf o imagen")
+    parser.add_argument("--tolerance", type=float, default=None,
+                        help=f"Tolerancia en unidades del PAT (por defecto {TOLERANCE} del tamaño)")
+    parser.add_argument("--diff", default=None, help="Guarda la imagen de diferencias (.png)")
+    args = parser.parse_args(argv)
+
+    if args.input.lower().endswith(".dxf"):
+        result = DXFtoPatConverter().convert(args.input, debug_image=False, preview=False)
+    else:
+        with open(args.input, "rb") as f:
+            result = ImageToPatConverter().convert(f.read(), debug_image=False, preview=False)
+    if "error" in result:
+        print(f"{args.input}: {result['error']}", file=sys.stderr)
+        return 1
+
+    report = check_fidelity(result["pat_content"], result["source_segments"],
+                            tolerance=args.tolerance, period=result["source_period"], diff_image=bool(args.diff))
+    print(f"{args.input}: score {report['score']:.3f} "
+          f"(cobertura {report['coverage']:.1%}, precisión {report['precision']:.1%}), "
+          f"Hausdorff {report['hausdorff']:.4g} "
+          f"(origen→PAT {report['source_to_pat']:.4g}, PAT→origen {report['pat_to_source']:.4g}), "
+          f"tolerancia {report['tolerance']:.4g}, "
+          f"{report['segments'][0]} segmentos / {report['segments'][1]} dashes")
+    if args.diff:
+        cv2.imwrite(args.diff, cv2.cvtColor(report["diff_img"], cv2.COLOR_RGB2BGR))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import CancelledError
+
+
+# Espera antes de empezar un trabajo: si mientras tanto llega otro pedido
+# para la misma entrada (p. ej. se sigue moviendo un slider) este se descarta
+DEBOUNCE_S = 0.3
+
+
+def job_key(data, **params):
+    """Clave de un pedido: hash del contenido de entrada más sus parámetros"""
+    h = hashlib.blake2b(data, digest_size=16)
+    h.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+    return h.hexdigest()
+
+
+class JobSlot:
+    """Conversión en segundo plano de una entrada, con debounce y descarte.
+
+    Cada sesión tiene un slot por entrada (p. ej. uno por modo de la app).
+    submit() pide convertir con una clave; si ya hay un trabajo en curso,
+    el pedido queda pendiente y reemplaza a cualquier pendiente anterior,
+    así por slot hay a lo sumo un trabajo ejecutándose y uno esperando.
+    Antes de ejecutar, cada trabajo espera `debounce` segundos y se descarta
+    si en ese tiempo llegó un pedido más nuevo. Los trabajos corren en el
+    `executor` compartido (hilos: OpenCV libera el GIL y el conversor con
+    su memo vive en la sesión).
+
+    `fn(cancelled)` recibe una función sin argumentos que devuelve True
+    cuando llegó un pedido más nuevo; los conversores la consultan entre
+    etapas (su argumento `cancelled`) y cortan con CancelledError, así un
+    trabajo viejo libera el slot sin terminar. El último resultado
+    terminado queda en `result` (con `result_key` y `seconds`) mientras se
+    calcula el siguiente; el de un trabajo que quedó viejo se descarta.
+    """
+
+    def __init__(self, executor, debounce=DEBOUNCE_S):
+        self.executor = executor
+        self.debounce = debounce
+        self.result = None
+        self.result_key = None
+        self.seconds = None
+        self._requested = None
+        self._running = None
+        self._pending = None
+        self._lock = threading.Lock()
+
+    @property
+    def busy(self):
+        """True mientras haya un trabajo en curso o esperando"""
+        with self._lock:
+            return self._running is not None or self._pending is not None
+
+    @property
+    def current(self):
+        """True si `result` corresponde al último pedido"""
+        with self._lock:
+            return self._requested is not None and self.result_key == self._requested
+
+    def submit(self, key, fn):
+        """Pide `fn(cancelled)` para `key`; no hace nada si es el mismo pedido que el último.
+
+        Devuelve True si el pedido es nuevo.
+        """
+        with self._lock:
+            if key == self._requested:
+                return False
+            self._requested = key
+            if self._running is not None:
+                self._pending = (key, fn)
+            else:
+                self._start(key, fn)
+            return True
+
+    def _start(self, key, fn):
+        # Llamado con el lock tomado
+        self._running = key
+        self.executor.submit(self._run, key, fn)
+
+    def _is_stale(self, key):
+        with self._lock:
+            return key != self._requested
+
+    def _run(self, key, fn):
+        try:
+            time.sleep(self.debounce)
+            if not self._is_stale(key):
+                start = time.perf_counter()
+                try:
+                    result = fn(lambda: self._is_stale(key))
+                except CancelledError:
+                    return
+                except Exception as e:
+                    result = {"error": f"Error: {str(e)}"}
+                with self._lock:
+                    if key != self._requested:
+                        return
+                    self.result = result
+                    self.result_key = key
+                    self.seconds = time.perf_counter() - start
+        finally:
+            with self._lock:
+                self._running = None
+                pending, self._pending = self._pending, None
+                if pending is not None:
+                    self._start(*pending)
@@ -0,0 +1,227 @@
+from fractions import Fraction
+
+import numpy as np
+
+
+# Fracción mínima de segmentos que una traslación debe llevar sobre otro
+# segmento del dibujo para considerarla un período (una grilla de 2 copias
+# en una dirección cubre exactamente la mitad)
+MIN_COVERAGE = 0.5
+
+# Traslaciones candidatas que se prueban, de la más corta a la más larga
+MAX_CANDIDATES = 64
+
+# Denominador máximo al buscar el vector de la retícula paralelo a una línea
+MAX_DENOMINATOR = 64
+
+
+def _canonical(segments, tol):
+    """Segmentos con los extremos ordenados (x, y) para que no importe el sentido.
+
+    La comparación es sobre coordenadas cuantizadas a `tol`, así el ruido de
+    punto flotante no invierte distinto dos copias de un segmento vertical.
+    """
+    q = np.round(segments / tol)
+    swap = (q[:, 0] > q[:, 2]) | ((q[:, 0] == q[:, 2]) & (q[:, 1] > q[:, 3]))
+    out = segments.copy()
+    out[swap] = segments[swap][:, [2, 3, 0, 1]]
+    return out
+
+
+def _keys(starts, shapes, tol):
+    """Clave exacta de (inicio, forma) cuantizados a `tol`: cada fila como un bloque de bytes.
+
+    Dos claves son iguales solo si las cuatro coordenadas cuantizadas lo
+    son (un hash podría confundir segmentos distintos); se pueden ordenar y
+    buscar con np.sort/np.searchsorted.
+    """
+    q = np.ascontiguousarray(np.round(np.hstack([starts, shapes]) / tol).astype(np.int64))
+    return q.view(np.dtype((np.void, q.itemsize * q.shape[1]))).ravel()
+
+
+def gauss_reduce(a, b):
+    """Base reducida de Lagrange-Gauss: a es el vector más corto de la retícula"""
+    a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+    if a @ a > b @ b:
+        a, b = b, a
+    while True:
+        b = b - round((a @ b) / (a @ a)) * a
+        if b @ b >= a @ a - 1e-12 * (a @ a):
+            break
+        a, b = b, a
+    if np.cross(a, b) < 0:
+        b = -b
+    return a, b
+
+
+def find_lattice(segments, tol=None, min_coverage=MIN_COVERAGE, max_candidates=MAX_CANDIDATES):
+    """Busca la retícula de traslaciones que repite el dibujo.
+
+    Cada segmento se codifica por su inicio y su forma (vector inicio→fin)
+    cuantizados a `tol`. Las traslaciones candidatas son las diferencias
+    entre un segmento de la forma más repetida y los demás de esa forma;
+    una candidata se acepta si lleva al menos `min_coverage` de los
+    segmentos sobre otro segmento del dibujo. La más corta aceptada y la
+    más corta no paralela a ella forman la base.
+
+    Devuelve (a, b) reducidos (ver gauss_reduce) o None si no hay dos
+    traslaciones independientes.
+    """
+    segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+    if len(segments) < 2:
+        return None
+    extent = np.ptp(segments.reshape(-1, 2), axis=0).max()
+    if extent == 0:
+        return None
+    tol = extent * 1e-6 if tol is None else tol
+    segments = _canonical(segments, tol)
+
+    starts = segments[:, :2]
+    shapes = segments[:, 2:] - segments[:, :2]
+    keys = _keys(starts, shapes, tol)
+    sorted_keys = np.sort(keys)
+
+    # Forma más repetida: sus copias dan las traslaciones candidatas
+    shape_q = np.round(shapes / tol).astype(np.int64)
+    _, inverse, counts = np.unique(shape_q, axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    best = np.argmax(counts)
+    if counts[best] < 2:
+        return None
+    members = np.flatnonzero(inverse == best)
+    ref = members[0]
+    candidates = starts[members[1:]] - starts[ref]
+    norms = np.hypot(candidates[:, 0], candidates[:, 1])
+    candidates = candidates[np.argsort(norms, kind="stable")][:max_candidates]
+
+    needed = min_coverage * len(segments)
+    accepted = []
+    for t in candidates:
+        if np.hypot(*t) <= tol:
+            continue
+        if accepted and abs(np.cross(accepted[0], t)) <= tol * np.hypot(*accepted[0]):
+            # Paralela a la primera: no aporta una segunda dirección
+            continue
+        moved = _keys(starts + t, shapes, tol)
+        pos = np.minimum(np.searchsorted(sorted_keys, moved), len(sorted_keys) - 1)
+        if np.count_nonzero(sorted_keys[pos] == moved) >= needed:
+            accepted.append(t)
+            if len(accepted) == 2:
+                return gauss_reduce(*accepted)
+    return None
+
+
+def lattice_classes(segments, a, b, tol=None):
+    """Clase de traslación de cada segmento y el vector entero que lo lleva a la celda.
+
+    Cada segmento se traslada por un vector entero de la retícula para que
+    su inicio caiga en el paralelogramo [0, 1)·a + [0, 1)·b; los que
+    coinciden ahí son la misma clase. Devuelve (celda, clases, shifts): la
+    celda tiene un representante por clase en orden de primera aparición
+    (los segmentos conservan su largo y pueden salir de la celda), clases
+    es el índice en la celda de cada segmento y shifts (n, 2) int los
+    coeficientes (i, j) del vector i·a + j·b que se restó.
+    """
+    if tol is None:
+        tol = max(np.hypot(*a), np.hypot(*b)) * 1e-6
+    segments = _canonical(np.asarray(segments, dtype=np.float64).reshape(-1, 4), tol)
+    basis = np.array([a, b], dtype=np.float64).T
+    coords = np.linalg.solve(basis, segments[:, :2].T).T
+    # Un margen evita que el ruido de punto flotante parta una clase en dos
+    shifts = np.floor(coords + 1e-6)
+    shift = shifts @ basis.T
+    cell = segments - np.hstack([shift, shift])
+    q = np.round(cell / tol).astype(np.int64)
+    cell[q == 0] = 0.0
+    _, first, inverse = np.unique(q, axis=0, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return cell[first[order]], rank[inverse.reshape(-1)], shifts.astype(np.int64)
+
+
+def reduce_to_cell(segments, a, b, tol=None):
+    """Un representante por clase de traslación: los segmentos de una celda.
+
+    Ver lattice_classes; se mantiene el orden de primera aparición.
+    """
+    return lattice_classes(segments, a, b, tol)[0]
+
+
+def spans_lattice(classes, shifts):
+    """True si cada clase tiene copias en dos direcciones independientes.
+
+    En un campo de copias de la celda cada clase aparece en toda la grilla.
+    Una clase sin copias, o con copias solo a lo largo de una recta (p. ej.
+    el marco que rodea el campo, o un borde recortado), no se repite con la
+    retícula y emitir la celda la replicaría en todo el patrón.
+    """
+    order = np.argsort(classes, kind="stable")
+    classes, shifts = classes[order], shifts[order]
+    first = np.flatnonzero(np.r_[True, classes[1:] != classes[:-1]])
+    size = np.diff(np.r_[first, len(classes)])
+    d = shifts - np.repeat(shifts[first], size, axis=0)
+    # Referencia por clase: la copia más lejana a la primera (la última al
+    # ordenar por distancia dentro de cada clase)
+    far = np.lexsort([np.abs(d).sum(axis=1), classes])
+    r = np.repeat(d[far[first + size - 1]], size, axis=0)
+    cross = d[:, 0] * r[:, 1] - d[:, 1] * r[:, 0]
+    return bool(np.logical_or.reduceat(cross != 0, first).all())
+
+
+def lattice_family(angle, a, b, max_denominator=MAX_DENOMINATOR):
+    """Período y deltas PAT de una familia de líneas a `angle` grados.
+
+    Las copias de una línea forman una familia si la retícula tiene un
+    vector paralelo a ella: el más corto, i·a + j·b con i, j coprimos, es el
+    período del dash pattern. Con el algoritmo extendido de Euclides se
+    completa la base con k·a + l·b (i·l - j·k = 1), cuyas componentes a lo
+    largo y perpendicular a la línea son delta_x y delta_y (semántica de
+    Revit: delta_y es el espaciado entre líneas y delta_x el corrimiento).
+
+    Devuelve (period, delta_x, delta_y) o None si la dirección no es
+    racional en la retícula (con denominador hasta `max_denominator`).
+    """
+    rad = np.radians(angle)
+    u = np.array([np.cos(rad), np.sin(rad)])
+    n = np.array([-u[1], u[0]])
+    a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+    alpha, beta = np.linalg.solve(np.array([a, b]).T, u)
+
+    scale = max(abs(alpha), abs(beta))
+    if abs(alpha) <= 1e-9 * scale:
+        i, j = 0, 1
+    elif abs(beta) <= 1e-9 * scale:
+        i, j = 1, 0
+    else:
+        ratio = Fraction(beta / alpha).limit_denominator(max_denominator)
+        if abs(float(ratio) - beta / alpha) > 1e-6 * max(1.0, abs(beta / alpha)):
+            return None
+        i, j = ratio.denominator, ratio.numerator
+    vec = i * a + j * b
+    if vec @ u < 0:
+        i, j, vec = -i, -j, -vec
+    period = float(np.hypot(*vec))
+
+    g, x, y = _extended_gcd(i, j)
+    # i·x + j·y = ±1  →  (k, l) = (-y, x) cumple i·l - j·k = ±1
+    k, l = -y * g, x * g
+    other = k * a + l * b
+    if other @ n < 0:
+        other = -other
+    delta_y = float(other @ n)
+    delta_x = float((other @ u) % period)
+    return period, delta_x, delta_y
+
+
+def _extended_gcd(i, j):
+    """(signo, x, y) con i·x + j·y = signo (±1) para i, j coprimos"""
+    old_r, r = i, j
+    old_x, x = 1, 0
+    old_y, y = 0, 1
+    while r:
+        q = old_r // r
+        old_r, r = r, old_r - q * r
+        old_x, x = x, old_x - q * x
+        old_y, y = y, old_y - q * y
+    return (1 if old_r > 0 else -1), old_x, old_y
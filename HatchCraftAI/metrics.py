@@ -0,0 +1,146 @@
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+# Hooks globales: se llaman con cada registro de etapa de cualquier conversión
+_hooks = []
+
+
+def add_hook(hook):
+    """Registra `hook(record)` para recibir cada etapa medida (p. ej. a logging)"""
+    if hook not in _hooks:
+        _hooks.append(hook)
+
+
+def remove_hook(hook):
+    if hook in _hooks:
+        _hooks.remove(hook)
+
+
+# tracemalloc es global al proceso: las mediciones de memoria activas (de
+# cualquier hilo) se cuentan bajo un lock; lo enciende la primera si nadie
+# lo usaba y lo apaga la última. `_overlaps` cambia cada vez que empieza una
+# medición con otra activa, y las que vieron el cambio no informan memoria
+_memory_lock = threading.Lock()
+_active = 0
+_own_tracing = False
+_overlaps = 0
+
+
+def _begin_memory():
+    """Empieza una medición; devuelve (memoria base, marca) o None si se solapa"""
+    global _active, _own_tracing, _overlaps
+    with _memory_lock:
+        if _active == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _own_tracing = True
+        _active += 1
+        if _active > 1:
+            _overlaps += 1
+            return None
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        return base, _overlaps
+
+
+def _end_memory(token):
+    """Termina una medición; devuelve el pico en MB o None si se solapó con otra"""
+    global _active, _own_tracing
+    with _memory_lock:
+        peak = None
+        if token is not None and token[1] == _overlaps:
+            peak = max(0, tracemalloc.get_traced_memory()[1] - token[0]) / 2**20
+        _active -= 1
+        if _active == 0 and _own_tracing:
+            tracemalloc.stop()
+            _own_tracing = False
+        return peak
+
+
+class Metrics:
+    """Tiempo, pico de memoria y cantidades por etapa de una conversión.
+
+    Cada `with metrics.stage(nombre) as record:` agrega un registro con
+    "stage", "seconds" y "peak_mb" (memoria máxima asignada durante la etapa
+    por encima de la que había al empezar, medida con tracemalloc); dentro
+    del bloque se pueden agregar cantidades al registro (p. ej. "items").
+    Al cerrar cada etapa el registro se pasa a `hook` y a los hooks
+    globales. Con `memory=False` no se usa tracemalloc, que hace más lentas
+    las etapas con muchas asignaciones pequeñas. tracemalloc mide todo el
+    proceso: si la etapa se solapa con otra medición (otra conversión en
+    otro hilo o una etapa anidada), "peak_mb" queda en None. Se pueden medir etapas
+    después de finish() (p. ej. imágenes calculadas al pedirlas): se
+    agregan a la misma lista "stages" ya entregada.
+    """
+
+    enabled = True
+
+    def __init__(self, memory=True, hook=None, converter=None):
+        self.memory = memory
+        self.hook = hook
+        self.converter = converter
+        self.stages = []
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        record = {"stage": name, "seconds": 0.0, "peak_mb": None}
+        if self.converter:
+            record["converter"] = self.converter
+        token = _begin_memory() if self.memory else None
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            if self.memory:
+                record["peak_mb"] = _end_memory(token)
+            self.stages.append(record)
+            for hook in ([self.hook] if self.hook else []) + _hooks:
+                hook(record)
+
+    def finish(self):
+        """Resumen {"stages", "total_s", "peak_mb"} de lo medido hasta ahora"""
+        peaks = [s["peak_mb"] for s in self.stages if s["peak_mb"] is not None]
+        return {
+            "stages": self.stages,
+            "total_s": time.perf_counter() - self._start,
+            "peak_mb": max(peaks) if peaks else None,
+        }
+
+
+class _NoMetrics:
+    """Sustituto sin costo cuando la instrumentación está apagada"""
+
+    enabled = False
+
+    @contextmanager
+    def stage(self, name):
+        yield {}
+
+    def finish(self):
+        return None
+
+
+NO_METRICS = _NoMetrics()
+
+
+def resolve_metrics(metrics, converter=None):
+    """Normaliza el argumento `metrics` de los conversores.
+
+    None/False: sin instrumentación; True: Metrics(); un callable: Metrics
+    con ese hook; una instancia de Metrics se usa tal cual.
+    """
+    if metrics is None or metrics is False:
+        return NO_METRICS
+    if metrics is True:
+        return Metrics(converter=converter)
+    if isinstance(metrics, Metrics):
+        if metrics.converter is None:
+            metrics.converter = converter
+        return metrics
+    if callable(metrics):
+        return Metrics(hook=metrics, converter=converter)
+    raise TypeError(f"metrics debe ser bool, callable o Metrics, no {type(metrics).__name__}")
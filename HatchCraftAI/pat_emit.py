@@ -0,0 +1,233 @@
+import numpy as np
+
+
+# Direcciones válidas cada 15° (módulo 180); cada una también se prueba
+# girada 180° para decidir si hay que invertir el segmento
+ANGLES_15 = tuple(range(0, 180, 15))
+
+
+def quantize_segments(segments, angles=ANGLES_15):
+    """Cuantiza la dirección de un arreglo (n, 4) de segmentos x1, y1, x2, y2.
+
+    Cada segmento toma el ángulo de `angles` (o el mismo girado 180°) más
+    cercano considerando el wrap-around; los que caen en 180-360 se invierten
+    para que su ángulo quede en [0, 180) y su origen sea el otro extremo.
+
+    Devuelve (ang_q, origins, lengths) con ang_q entero.
+    """
+    segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+    dx = segments[:, 2] - segments[:, 0]
+    dy = segments[:, 3] - segments[:, 1]
+    lengths = np.sqrt(dx**2 + dy**2)
+
+    ang = np.degrees(np.arctan2(dy, dx))
+    ang = np.where(ang < 0, ang + 360, ang)
+
+    candidates = np.concatenate([np.asarray(angles), np.asarray(angles) + 180])
+    diff = np.abs(ang[:, None] - candidates[None, :])
+    diff = np.minimum(diff, 360 - diff)
+    ang_q = candidates[np.argmin(diff, axis=1)]
+
+    flip = ang_q >= 180
+    ang_q = np.where(flip, ang_q - 180, ang_q).astype(np.int64)
+    origins = np.where(flip[:, None], segments[:, 2:4], segments[:, 0:2])
+    return ang_q, origins, lengths
+
+
+def single_dashes(lengths, period):
+    """Tabla dash/gap de un tramo por línea: dash = largo, gap = -(período - largo)"""
+    return np.stack([lengths, -(period - lengths)], axis=1)
+
+
+def _merge_cyclic(intervals, period, tol):
+    """Une intervalos [inicio, fin, ox, oy] sobre un ciclo de largo `period`.
+
+    Los inicios vienen reducidos a [0, period) y ox, oy es el punto real del
+    segmento que define cada inicio. Devuelve la lista unida y ordenada; el
+    último intervalo puede pasar de `period` si envuelve al primero.
+    """
+    intervals = sorted(intervals)
+    merged = [list(intervals[0])]
+    for interval in intervals[1:]:
+        if interval[0] <= merged[-1][1] + tol:
+            merged[-1][1] = max(merged[-1][1], interval[1])
+        else:
+            merged.append(list(interval))
+
+    # El último intervalo puede envolver y alcanzar al primero
+    while len(merged) > 1 and merged[-1][1] - period >= merged[0][0] - tol:
+        first = merged.pop(0)
+        merged[-1][1] = max(merged[-1][1], first[1] + period)
+    return merged
+
+
+def consolidate_pat_lines(ang_q, origins, lengths, period, tol=None, spacing=None, shift=None):
+    """Agrupa líneas PAT colineales en familias con un dash pattern combinado.
+
+    Recibe la salida de quantize_segments (ángulo en [0, 180) y origen en el
+    extremo inicial). Con deltas (period, period) cada familia se repite cada
+    `period` a lo largo de la línea y también en la perpendicular, así que
+    dos segmentos son de la misma familia si comparten ángulo y su offset
+    perpendicular coincide módulo `period`. Dentro de una familia los tramos
+    se reducen módulo `period`, se unen los que se solapan o se tocan y se
+    emite una sola línea con la secuencia dash/gap resultante.
+
+    `period`, `spacing` (delta perpendicular, por defecto `period`) y
+    `shift` (delta a lo largo, por defecto múltiplo de `period`) pueden ser
+    escalares o un valor por entrada; con `shift` el inicio de cada tramo se
+    corrige por las líneas de la familia que hay entre él y la de referencia.
+
+    Devuelve (ang_q, origins, dashes, counts) en el orden de la primera
+    aparición de cada familia; `dashes` es una tabla rellenada con ceros y
+    `counts` la cantidad de valores de cada fila.
+    """
+    n = len(ang_q)
+    if n == 0:
+        return ang_q, origins, np.zeros((0, 2)), np.zeros(0, dtype=np.intp)
+    period = np.broadcast_to(np.asarray(period, dtype=np.float64), (n,))
+    tol = period * 1e-6 if tol is None else np.broadcast_to(tol, (n,))
+
+    rad = np.radians(ang_q)
+    ux, uy = np.cos(rad), np.sin(rad)
+    along = origins[:, 0] * ux + origins[:, 1] * uy
+    offset = -origins[:, 0] * uy + origins[:, 1] * ux
+    if spacing is None and shift is None:
+        cycle = np.maximum(1, np.round(period / tol)).astype(np.int64)
+        key_offset = np.round(offset / tol).astype(np.int64) % cycle
+        starts = along % period
+    else:
+        spacing = period if spacing is None else np.broadcast_to(spacing, (n,))
+        shift = 0.0 if shift is None else np.broadcast_to(shift, (n,))
+        cycle = np.maximum(1, np.round(spacing / tol)).astype(np.int64)
+        steps = np.floor(offset / spacing)
+        key_offset = np.round((offset - steps * spacing) / tol).astype(np.int64)
+        wrap = key_offset >= cycle
+        steps += wrap
+        key_offset[wrap] -= cycle[wrap]
+        starts = (along - steps * shift) % period
+
+    keys = np.stack([ang_q.astype(np.int64), key_offset], axis=1)
+    _, first, inverse, sizes = np.unique(keys, axis=0, return_index=True,
+                                         return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    order = np.argsort(first, kind="stable")
+
+    out_ang = ang_q[first[order]]
+    out_origins = origins[first[order]].copy()
+    rows = [None] * len(order)
+
+    # Familias de un solo tramo: sin cambios respecto a una línea por segmento
+    single = sizes[order] == 1
+    single_idx = first[order][single]
+    single_rows = single_dashes(lengths[single_idx], period[single_idx])
+
+    # Familias de varios tramos: unión cíclica de intervalos
+    multi = np.flatnonzero(~single)
+    members = np.argsort(inverse, kind="stable")
+    bounds = np.concatenate([[0], np.cumsum(sizes)])
+    max_count = 2
+    for pos in multi:
+        group = order[pos]
+        idx = members[bounds[group]:bounds[group + 1]]
+        p, t = float(period[idx[0]]), float(tol[idx[0]])
+        intervals = [[s, s + length, ox, oy] for s, length, (ox, oy)
+                     in zip(starts[idx].tolist(), lengths[idx].tolist(), origins[idx].tolist())]
+        merged = _merge_cyclic(intervals, p, t)
+        out_origins[pos] = merged[0][2:4]
+        if len(merged) == 1 and merged[0][1] - merged[0][0] >= p - t:
+            # La familia cubre toda la línea: queda continua
+            rows[pos] = [p, 0.0]
+            continue
+        dashes = []
+        for i, (start, end, _, _) in enumerate(merged):
+            next_start = merged[i + 1][0] if i + 1 < len(merged) else merged[0][0] + p
+            dashes.extend([end - start, -(next_start - end)])
+        rows[pos] = dashes
+        max_count = max(max_count, len(dashes))
+
+    table = np.zeros((len(order), max_count), dtype=np.float64)
+    counts = np.full(len(order), 2, dtype=np.intp)
+    table[np.flatnonzero(single), :2] = single_rows
+    for pos in multi:
+        table[pos, :len(rows[pos])] = rows[pos]
+        counts[pos] = len(rows[pos])
+    return out_ang, out_origins, table, counts
+
+
+def format_pat_lines(ang_q, origins, delta_x, delta_y, dashes, counts=None, decimals=6):
+    """Formatea todas las líneas PAT en una pasada.
+
+    Redondea orígenes y dash/gap a `decimals`; los gaps (columnas impares)
+    mayores o iguales a 0 pasan a -0.001 para que la línea quede continua.
+    Las filas se agrupan por cantidad de valores y cada grupo se formatea
+    con un solo str.format sobre columnas ya convertidas a listas.
+    `delta_x` y `delta_y` son un valor común (se escriben tal cual) o uno
+    por línea (se redondean a `decimals`).
+    """
+    n = len(ang_q)
+    dashes = np.round(np.asarray(dashes, dtype=np.float64).reshape(n, -1), decimals)
+    if counts is None:
+        counts = np.full(n, dashes.shape[1], dtype=np.intp)
+    gaps = dashes[:, 1::2]
+    gaps[gaps >= 0] = -0.001
+
+    ang = ang_q.tolist()
+    ox = np.round(origins[:, 0], decimals).tolist()
+    oy = np.round(origins[:, 1], decimals).tolist()
+
+    per_line = np.ndim(delta_x) > 0 or np.ndim(delta_y) > 0
+    if per_line:
+        dx = np.round(np.broadcast_to(delta_x, (n,)), decimals).tolist()
+        dy = np.round(np.broadcast_to(delta_y, (n,)), decimals).tolist()
+        prefix = "{}, {},{}, {},{}, "
+    else:
+        prefix = "{}, {},{}, " + f"{delta_x},{delta_y}, "
+
+    lines = [None] * n
+    for count in np.unique(counts).tolist():
+        rows = np.flatnonzero(counts == count)
+        fmt = prefix + ",".join(["{}"] * count)
+        columns = [dashes[rows, j].tolist() for j in range(count)]
+        for row, values in zip(rows.tolist(), zip(*columns)):
+            if per_line:
+                lines[row] = fmt.format(ang[row], ox[row], oy[row], dx[row], dy[row], *values)
+            else:
+                lines[row] = fmt.format(ang[row], ox[row], oy[row], *values)
+    return lines
+
+
+def segments_to_pat_lines(segments, period, delta_x, delta_y, angles=ANGLES_15,
+                          decimals=6, min_length=0.001, consolidate=False, families=None):
+    """Convierte un arreglo (n, 4) de segmentos ya normalizados en líneas PAT.
+
+    Descarta segmentos más cortos que `min_length`, cuantiza su ángulo,
+    calcula dash/gap con período `period` y formatea todo en bloque. Con
+    `consolidate` une antes los tramos colineales (consolidate_pat_lines).
+
+    `families` reemplaza el período y los deltas comunes por valores de
+    cada ángulo: {ang_q: (period, delta_x, delta_y)}, con la semántica de
+    Revit (delta_x a lo largo de la línea, delta_y perpendicular), como los
+    que da lattice.lattice_family. En ese caso ningún dash supera su período.
+    """
+    segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+    ang_q, origins, lengths = quantize_segments(segments, angles)
+    valid = lengths >= min_length
+    ang_q, origins, lengths = ang_q[valid], origins[valid], lengths[valid]
+
+    spacing = shift = None
+    if families is not None:
+        table = np.zeros((180, 3))
+        for ang, values in families.items():
+            table[ang] = values
+        period, delta_x, delta_y = table[ang_q].T
+        spacing, shift = delta_y, delta_x
+        lengths = np.minimum(lengths, period)
+
+    if consolidate:
+        ang_q, origins, dashes, counts = consolidate_pat_lines(ang_q, origins, lengths, period,
+                                                               spacing=spacing, shift=shift)
+        if families is not None:
+            period, delta_x, delta_y = table[ang_q].T
+    else:
+        dashes, counts = single_dashes(lengths, period), None
+    return format_pat_lines(ang_q, origins, delta_x, delta_y, dashes, counts, decimals)
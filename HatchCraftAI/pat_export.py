@@ -0,0 +1,207 @@
+"""Exportación de patrones PAT en gran formato (láminas de materiales).
+
+Uso:
+    python pat_export.py patron.pat lamina.png [--width 20000] [--height N]
+                         [--tiles 10] [--line-width 2] [--dpi 300]
+    python pat_export.py patron.pat lamina.svg [--width 2000] [--tiles 10] [--decimate]
+
+Ambos formatos usan la semántica de Revit (ver pat_visible_dashes) y
+recorren la vista por franjas horizontales: el PNG se rasteriza franja por
+franja y se comprime a medida que avanza, el SVG escribe los dashes
+recortados de cada franja sin rasterizar. La memoria queda acotada por una
+franja y no por el tamaño de la lámina.
+"""
+import argparse
+import struct
+import sys
+import zlib
+
+import cv2
+import numpy as np
+
+from core_logic import _as_pattern, parse_pat, pat_visible_dashes
+
+# Filas por franja al rasterizar el PNG
+STRIP_HEIGHT = 256
+
+# Tamaño mínimo de cada chunk IDAT escrito
+IDAT_CHUNK = 1 << 16
+
+
+def _open_output(target, mode):
+    """(archivo, cerrar) para una ruta o un objeto con write()"""
+    if hasattr(target, "write"):
+        return target, False
+    return open(target, mode), True
+
+
+def _view_scale(pattern, width, tile_count, scale):
+    """Píxeles por unidad: `scale` o los que hacen caber `tile_count` tiles en `width`"""
+    if scale is not None:
+        return float(scale)
+    return width / (pattern.tile_size * tile_count)
+
+
+def _band_segments(pattern, scale, width, row0, row1, height, margin, decimate=True):
+    """Dashes de las filas [row0, row1) en píxeles de la lámina (y hacia abajo).
+
+    La banda se amplía `margin` píxeles para que las líneas que cruzan el
+    borde de la franja se dibujen igual a ambos lados. Con `decimate` se
+    omiten los dashes y familias de menos de un píxel (ver
+    pat_visible_dashes), que al rasterizar no se distinguen.
+    """
+    pixel = 1.0 / scale
+    limit = pixel if decimate else 0.0
+    segs = pat_visible_dashes(pattern,
+                              -margin * pixel, (height - row1 - margin) * pixel,
+                              (width + margin) * pixel, (height - row0 + margin) * pixel,
+                              min_period=limit, min_spacing=limit)
+    segs = segs * scale
+    segs[:, 1::2] = height - segs[:, 1::2]
+    return segs
+
+
+def _png_chunk(kind, data):
+    return (struct.pack(">I", len(data)) + kind + data +
+            struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+
+def export_png(pat_content, target, width=4000, height=None, tile_count=10, scale=None,
+               line_width=1, dpi=None, strip_height=STRIP_HEIGHT, compress_level=6):
+    """Rasteriza el patrón a un PNG en escala de grises, franja por franja.
+
+    Cada franja de `strip_height` filas se dibuja en su propio lienzo (más
+    un margen para el grosor y el antialiasing), se le agrega el byte de
+    filtro a cada fila y pasa al compresor zlib; los chunks IDAT se escriben
+    a medida que se llenan. El pico de memoria es una franja, no la lámina.
+
+    `target` es una ruta o un archivo binario abierto. La escala sale de
+    `tile_count` tiles a lo ancho, salvo que se pase `scale` (píxeles por
+    unidad del patrón). Con `dpi` se agrega un chunk pHYs para impresión.
+
+    Devuelve (ancho, alto).
+    """
+    pattern = _as_pattern(pat_content)
+    height = width if height is None else height
+    scale = _view_scale(pattern, width, tile_count, scale)
+    margin = line_width + 2
+
+    out, close = _open_output(target, "wb")
+    try:
+        out.write(b"\x89PNG\r\n\x1a\n")
+        # 8 bits, color tipo 0 (gris), sin entrelazado
+        out.write(_png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)))
+        if dpi:
+            ppm = int(round(dpi / 0.0254))
+            out.write(_png_chunk(b"pHYs", struct.pack(">IIB", ppm, ppm, 1)))
+
+        compressor = zlib.compressobj(compress_level)
+        pending = []
+        pending_size = 0
+        for row0 in range(0, height, strip_height):
+            row1 = min(row0 + strip_height, height)
+            canvas = np.full((row1 - row0 + 2 * margin, width), 255, dtype=np.uint8)
+            if len(pattern):
+                segs = _band_segments(pattern, scale, width, row0, row1, height, margin)
+                if len(segs):
+                    # Coordenadas con 4 bits de fracción: los recortes de una
+                    # misma línea en franjas vecinas empalman sin escalones
+                    segs[:, 1::2] -= row0 - margin
+                    pts = np.clip(np.rint(segs * 16), -2**30, 2**30).astype(np.int32)
+                    cv2.polylines(canvas, pts.reshape(-1, 2, 2), False, 0, line_width,
+                                  cv2.LINE_AA, shift=4)
+            # Cada fila empieza con su byte de filtro (0 = ninguno)
+            rows = np.zeros((row1 - row0, width + 1), dtype=np.uint8)
+            rows[:, 1:] = canvas[margin:margin + row1 - row0]
+            data = compressor.compress(rows.tobytes())
+            if data:
+                pending.append(data)
+                pending_size += len(data)
+            if pending_size >= IDAT_CHUNK:
+                out.write(_png_chunk(b"IDAT", b"".join(pending)))
+                pending, pending_size = [], 0
+        pending.append(compressor.flush())
+        out.write(_png_chunk(b"IDAT", b"".join(pending)))
+        out.write(_png_chunk(b"IEND", b""))
+    finally:
+        if close:
+            out.close()
+    return width, height
+
+
+def export_svg(pat_content, target, width=2000, height=None, tile_count=10, scale=None,
+               line_width=1, strip_height=STRIP_HEIGHT, decimals=2, decimate=False):
+    """Escribe el patrón como SVG vectorial sin rasterizar.
+
+    Los dashes visibles se calculan por franjas de `strip_height` píxeles
+    (cada una recortada por pat_visible_dashes) y cada franja se escribe
+    como un <path> con un M/L por dash, así nunca están todos en memoria.
+    Las coordenadas van en píxeles de la lámina con `decimals` decimales;
+    los puntos (dashes de largo 0) se ven por el remate redondo. Se
+    escriben todos los dashes y familias, aunque midan menos de un píxel;
+    con `decimate` se omiten como en el PNG (archivo más chico).
+
+    Devuelve (ancho, alto).
+    """
+    pattern = _as_pattern(pat_content)
+    height = width if height is None else height
+    scale = _view_scale(pattern, width, tile_count, scale)
+
+    out, close = _open_output(target, "wb")
+    try:
+        out.write((
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+            f'viewBox="0 0 {width} {height}">\n'
+            f'<rect width="{width}" height="{height}" fill="white"/>\n'
+            f'<g fill="none" stroke="black" stroke-width="{line_width}" '
+            'stroke-linecap="round">\n'
+        ).encode("utf-8"))
+        for row0 in range(0, height, strip_height) if len(pattern) else ():
+            row1 = min(row0 + strip_height, height)
+            segs = _band_segments(pattern, scale, width, row0, row1, height, 0, decimate)
+            if not len(segs):
+                continue
+            fmt = f"M%.{decimals}f %.{decimals}fL%.{decimals}f %.{decimals}f"
+            path = " ".join([fmt] * len(segs)) % tuple(segs.ravel().tolist())
+            out.write(f'<path d="{path}"/>\n'.encode("utf-8"))
+        out.write(b"</g>\n</svg>\n")
+    finally:
+        if close:
+            out.close()
+    return width, height
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exporta un patrón PAT a PNG o SVG de gran formato")
+    parser.add_argument("pat", help="Archivo .pat")
+    parser.add_argument("output", help="Archivo de salida .png o .svg")
+    parser.add_argument("--width", type=int, default=4000, help="Ancho en píxeles")
+    parser.add_argument("--height", type=int, default=None, help="Alto en píxeles (por defecto, el ancho)")
+    parser.add_argument("--tiles", type=float, default=10, help="Tiles a lo ancho")
+    parser.add_argument("--scale", type=float, default=None,
+                        help="Píxeles por unidad del patrón (reemplaza --tiles)")
+    parser.add_argument("--line-width", type=int, default=1)
+    parser.add_argument("--dpi", type=float, default=None, help="Resolución de impresión (solo PNG)")
+    parser.add_argument("--decimate", action="store_true",
+                        help="Omite dashes y familias de menos de un píxel (solo SVG; el PNG siempre)")
+    args = parser.parse_args(argv)
+
+    with open(args.pat, encoding="utf-8", errors="replace") as f:
+        pattern = parse_pat(f.read())
+    if not len(pattern):
+        print(f"{args.pat}: sin líneas de patrón", file=sys.stderr)
+        return 1
+
+    common = dict(width=args.width, height=args.height, tile_count=args.tiles,
+                  scale=args.scale, line_width=args.line_width)
+    if args.output.lower().endswith(".svg"):
+        size = export_svg(pattern, args.output, decimate=args.decimate, **common)
+    else:
+        size = export_png(pattern, args.output, dpi=args.dpi, **common)
+    print(f"{args.output}: {size[0]}x{size[1]} px")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
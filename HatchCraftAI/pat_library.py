@@ -0,0 +1,165 @@
+import mmap
+import re
+from collections import OrderedDict
+
+import numpy as np
+
+from core_logic import parse_pat, render_pat_preview, render_pat_revit
+
+
+# Línea ;%TYPE=MODEL|DRAFTING entre los comentarios que siguen a la cabecera
+_TYPE_RE = re.compile(rb";[ \t]*%TYPE[ \t]*=[ \t]*(\w+)")
+
+
+def _decode(raw):
+    """Texto de un .pat: UTF-8 si se puede, si no ANSI (latin-1) como escribe AutoCAD"""
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        return raw.decode("latin-1")
+
+
+class PatLibrary:
+    """Biblioteca .pat con varios patrones, indexada sin parsearlos.
+
+    Al abrir se mapea el archivo en memoria (mmap) y una sola pasada por
+    las cabeceras *Nombre arma el índice: nombre, descripción, tipo (el
+    ;%TYPE de los comentarios que la siguen) y el rango de bytes de cada
+    patrón. Las líneas de un patrón se parsean recién al pedirlo y los
+    últimos `max_parsed` quedan en un LRU, así una biblioteca de miles de
+    patrones abre al instante.
+
+    `source` es una ruta o un contenido en bytes (p. ej. un archivo subido).
+    Los nombres se buscan sin distinguir mayúsculas, como en AutoCAD y
+    Revit; si un nombre se repite gana el primero.
+    """
+
+    def __init__(self, source, max_parsed=64):
+        self._file = None
+        self._map = None
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            self._data = source
+        else:
+            self._file = open(source, "rb")
+            try:
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # mmap no admite archivos vacíos
+                self._map = b""
+            self._data = self._map
+        self.max_parsed = max_parsed
+        self._parsed = OrderedDict()
+        self._build_index()
+
+    def _build_index(self):
+        """Una pasada buscando '*' al inicio de línea (memchr vía find)"""
+        data = self._data
+        size = len(data)
+        names, descriptions, types, starts = [], [], [], []
+        pos = data.find(b"*")
+        while pos != -1:
+            line_start = data.rfind(b"\n", 0, pos) + 1
+            line_end = data.find(b"\n", pos)
+            line_end = size if line_end == -1 else line_end
+            if not data[line_start:pos].strip():
+                name, _, desc = bytes(data[pos + 1:line_end]).rstrip(b"\r").partition(b",")
+                names.append(_decode(name).strip())
+                descriptions.append(_decode(desc).strip())
+                starts.append(line_start)
+                types.append(self._type_after(line_end + 1))
+            pos = data.find(b"*", line_end)
+
+        self.names = names
+        self.descriptions = descriptions
+        self.types = types
+        self._starts = np.array(starts + [size], dtype=np.int64)
+        self._lookup = {}
+        for i, name in enumerate(names):
+            self._lookup.setdefault(name.casefold(), i)
+
+    def _type_after(self, pos):
+        """;%TYPE entre los comentarios que siguen a la cabecera; DRAFTING si no hay"""
+        data = self._data
+        while pos < len(data):
+            end = data.find(b"\n", pos)
+            end = len(data) if end == -1 else end
+            line = bytes(data[pos:end]).strip()
+            if line and not line.startswith(b";"):
+                break
+            match = _TYPE_RE.match(line)
+            if match:
+                return match.group(1).decode("ascii").upper()
+            pos = end + 1
+        return "DRAFTING"
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name.casefold() in self._lookup
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._parsed.clear()
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        if self._file is not None:
+            self._file.close()
+        self._map = self._file = None
+        self._data = b""
+
+    def index(self, name):
+        """Posición del patrón `name` (o el mismo entero); KeyError si no existe"""
+        if isinstance(name, (int, np.integer)):
+            if not -len(self) <= name < len(self):
+                raise KeyError(name)
+            return int(name) % len(self)
+        try:
+            return self._lookup[name.casefold()]
+        except KeyError:
+            raise KeyError(name) from None
+
+    def search(self, text):
+        """Nombres que contienen `text` (sin distinguir mayúsculas), en orden del archivo"""
+        text = text.casefold()
+        return [name for name in self.names if text in name.casefold()]
+
+    def text(self, name):
+        """Texto PAT de un solo patrón: cabecera, ;%TYPE y sus líneas"""
+        i = self.index(name)
+        return _decode(bytes(self._data[self._starts[i]:self._starts[i + 1]]))
+
+    def pattern(self, name):
+        """PatPattern del patrón, parseado al pedirlo y guardado en el LRU"""
+        i = self.index(name)
+        pattern = self._parsed.get(i)
+        if pattern is None:
+            pattern = parse_pat(self.text(i))
+            self._parsed[i] = pattern
+            while len(self._parsed) > self.max_parsed:
+                self._parsed.popitem(last=False)
+        else:
+            self._parsed.move_to_end(i)
+        return pattern
+
+    def info(self, name):
+        """{"name", "description", "type", "offset", "size"} sin parsear el patrón"""
+        i = self.index(name)
+        return {
+            "name": self.names[i],
+            "description": self.descriptions[i],
+            "type": self.types[i],
+            "offset": int(self._starts[i]),
+            "size": int(self._starts[i + 1] - self._starts[i]),
+        }
+
+    def preview(self, name, tile_count=3, preview_size=600, manual_scale=1.0, revit=True):
+        """Preview de un patrón (semántica Revit por defecto)"""
+        render = render_pat_revit if revit else render_pat_preview
+        return render(self.pattern(name), tile_count=tile_count, preview_size=preview_size,
+                      manual_scale=manual_scale)
@@ -0,0 +1,361 @@
+import numpy as np
+
+
+# Ángulo máximo entre dos segmentos para unirlos en uno
+MAX_ANGLE = 10.0
+
+# Tolerancia inicial y límite de la búsqueda con max_lines (en las unidades
+# de los segmentos, típicamente píxeles); la tolerancia se duplica en cada paso
+START_TOLERANCE = 0.5
+MAX_TOLERANCE = 64.0
+
+
+def _lengths(segments):
+    return np.hypot(segments[:, 2] - segments[:, 0], segments[:, 3] - segments[:, 1])
+
+
+def _chain(values, tol):
+    """Grupo de cada valor ya ordenado: uno nuevo donde el salto supera `tol`"""
+    return np.concatenate([[0], np.cumsum(np.diff(values) > tol)])
+
+
+def _group_order(group, values):
+    """Orden por `group` y dentro de cada grupo por `values`.
+
+    Igual que np.lexsort([values, group]) salvo en los empates de `values`,
+    pero con dos argsort no estables sobre claves enteras, varias veces más
+    rápido en arreglos grandes.
+    """
+    n = len(values)
+    rank = np.empty(n, dtype=np.int64)
+    rank[np.argsort(values)] = np.arange(n)
+    return np.argsort(group * n + rank)
+
+
+def _angle_groups(theta, max_angle):
+    """Grupo de ángulo (en grados, 0-180) de cada segmento.
+
+    Encadena saltos de hasta la mitad de `max_angle` y parte las cadenas
+    para que ningún grupo abarque más de `max_angle` (si no, un abanico de
+    direcciones quedaría en un solo grupo); el último se une al primero si
+    se tocan a través de 180°.
+    """
+    n = len(theta)
+    order = np.argsort(theta, kind="stable")
+    sorted_theta = theta[order]
+    chain = _chain(sorted_theta, max_angle / 2)
+    chain_start = sorted_theta[np.searchsorted(chain, chain)]
+    split = np.floor((sorted_theta - chain_start) / max_angle).astype(np.int64)
+    group = np.empty(n, dtype=np.int64)
+    group[order] = _chain(chain * (n + 1) + split, 0)
+    last = group[order[-1]]
+    if last > 0 and sorted_theta[0] + 180.0 - sorted_theta[-1] <= max_angle / 2:
+        group[group == last] = 0
+    return group
+
+
+def _line_groups(angle_group, offset, tol):
+    """Recta de cada segmento: agrupa por offset dentro de cada ángulo.
+
+    Como con los ángulos, las cadenas se parten para que ninguna abarque
+    más de `tol` (si no, muchas paralelas cercanas se unirían en una).
+    """
+    n = len(offset)
+    order = _group_order(angle_group, offset)
+    sorted_offset = offset[order]
+    breaks = (np.diff(angle_group[order]) != 0) | (np.diff(sorted_offset) > tol)
+    chain = np.concatenate([[0], np.cumsum(breaks)])
+    chain_start = sorted_offset[np.searchsorted(chain, chain)]
+    split = np.floor((sorted_offset - chain_start) / max(tol, 1e-12)).astype(np.int64)
+    line = np.empty(n, dtype=np.int64)
+    line[order] = _chain(chain * (n + 1) + split, 0)
+    return line
+
+
+def _interval_groups(line, a, b, tol):
+    """Une por intervalos [a, b] dentro de cada recta los que tienen un hueco de hasta `tol`.
+
+    Devuelve (grupo de cada segmento, hueco que salvó cada uno: 0 si
+    empieza un grupo o se superpone con lo anterior).
+    """
+    n = len(line)
+    order = _group_order(line, a)
+    # El máximo acumulado se separa por recta sumando un escalón mayor que
+    # cualquier extremo
+    step = float(np.abs(np.concatenate([a, b])).max()) * 2 + tol + 1
+    lifted = b[order] + line[order] * step
+    reach = np.maximum.accumulate(lifted)
+    starts = a[order] + line[order] * step
+    gap = starts[1:] - reach[:-1]
+    breaks = (np.diff(line[order]) != 0) | (gap > tol)
+    group = np.empty(n, dtype=np.int64)
+    group[order] = np.concatenate([[0], np.cumsum(breaks)])
+    bridged = np.zeros(n)
+    bridged[order[1:]] = np.where(breaks, 0.0, np.maximum(gap, 0.0))
+    return group, bridged
+
+
+class SegmentMerger:
+    """Une segmentos casi paralelos y colineales con un desvío acotado.
+
+    Cada segmento guarda los extremos originales que absorbió (en `support`,
+    con su dueño en `owner`); una unión se acepta solo si todos quedan a
+    menos de la tolerancia de la recta que resulta, así el desvío medido es
+    exacto aunque se hagan varias pasadas con tolerancias crecientes (cada
+    una trabaja sobre el resultado de la anterior, con menos segmentos).
+    """
+
+    def __init__(self, segments, max_angle=MAX_ANGLE):
+        self.segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4).copy()
+        self.support = self.segments.reshape(-1, 2).copy()
+        self.owner = np.repeat(np.arange(len(self.segments)), 2)
+        self.max_angle = max_angle
+        self.min_cos = np.cos(np.radians(max_angle))
+        self.error = 0.0
+
+    def merge(self, tol):
+        """Pasadas con tolerancia `tol` hasta que no se une nada más.
+
+        En cada pasada los segmentos se agrupan en bloque como en
+        merge_colinear (ángulo, recta y tramos con huecos de hasta `tol`) y
+        cada grupo queda sobre la recta de su segmento más largo, entre las
+        proyecciones extremas. Los que forman con ella un ángulo mayor que
+        `max_angle` o tienen algún extremo original a más de `tol` salen
+        del grupo, y los grupos se vuelven a partir por huecos sobre esa
+        recta hasta que todos cumplen. Así se quitan los duplicados (el
+        skeleton recorre cada línea ida y vuelta), los tramos paralelos
+        casi superpuestos y las cadenas de tramos colineales.
+        """
+        while self._merge_pass(tol):
+            pass
+
+    def _merge_pass(self, tol):
+        """Una pasada en bloque; devuelve True si unió algún segmento"""
+        segments = self.segments
+        n = len(segments)
+        if n < 2:
+            return False
+        # Todo por coordenadas sueltas: las sumas sobre ejes de largo 2 son
+        # lo más lento de numpy a este tamaño
+        px, py = segments[:, 0], segments[:, 1]
+        dx, dy = segments[:, 2] - px, segments[:, 3] - py
+        lengths = np.hypot(dx, dy)
+        theta = np.degrees(np.arctan2(dy, dx)) % 180.0
+
+        # Agrupación inicial sobre la dirección media de cada grupo de ángulo
+        angle_group = _angle_groups(theta, self.max_angle)
+        rad = np.radians(2 * theta)
+        cs = np.bincount(angle_group, lengths * np.cos(rad))
+        sn = np.bincount(angle_group, lengths * np.sin(rad))
+        mean = np.arctan2(sn, cs)[angle_group] / 2
+        ux, uy = np.cos(mean), np.sin(mean)
+        offset = (py + dy / 2) * ux - (px + dx / 2) * uy
+        a = px * ux + py * uy
+        b = a + dx * ux + dy * uy
+        line = _line_groups(angle_group, offset, tol)
+        group, _ = _interval_groups(line, np.minimum(a, b), np.maximum(a, b), tol)
+
+        # Los de largo 0 no tienen dirección: quedan solos
+        solo = lengths == 0
+        ex = dx / np.where(solo, 1.0, lengths)
+        ey = dy / np.where(solo, 1.0, lengths)
+        by_length = np.empty(n, dtype=np.int64)
+        by_length[np.argsort(-lengths, kind="stable")] = np.arange(n)
+        owner = self.owner
+        sx, sy = self.support[:, 0], self.support[:, 1]
+        index = np.arange(n)
+        while True:
+            group = np.where(solo, -1 - index, group)
+            _, group = np.unique(group, return_inverse=True)
+            group = group.reshape(-1)
+            count = group.max() + 1
+            # Referencia: el más largo de cada grupo
+            order = np.argsort(group * n + by_length)
+            first = np.flatnonzero(np.r_[True, np.diff(group[order]) != 0])
+            ref = order[first][group]
+            rx, ry, rux, ruy = px[ref], py[ref], ex[ref], ey[ref]
+
+            # Desvío de los extremos originales respecto de la recta de referencia
+            dist = np.zeros(n)
+            np.maximum.at(dist, owner, np.abs((sy - ry[owner]) * rux[owner]
+                                              - (sx - rx[owner]) * ruy[owner]))
+            aligned = np.abs(ex * rux + ey * ruy) >= self.min_cos
+            bad = ((dist > tol) | ~aligned) & (ref != index)
+            solo |= bad
+
+            start = (px - rx) * rux + (py - ry) * ruy
+            stop = start + dx * rux + dy * ruy
+            lo, hi = np.minimum(start, stop), np.maximum(start, stop)
+            regroup, bridged = _interval_groups(np.where(solo, -1 - index, group), lo, hi, tol)
+            if not bad.any() and regroup.max() + 1 == count:
+                break
+            group = regroup
+
+        if count == n:
+            return False
+        joined = ~solo & (np.bincount(group, minlength=count)[group] > 1)
+        self.error = max(self.error, float(dist[joined].max(initial=0.0)),
+                         float(bridged[joined].max(initial=0.0)))
+
+        # Cada grupo queda en la posición de su primer segmento
+        g_lo = np.full(count, np.inf)
+        g_hi = np.full(count, -np.inf)
+        np.minimum.at(g_lo, group, lo)
+        np.maximum.at(g_hi, group, hi)
+        head = np.full(count, n)
+        np.minimum.at(head, group, index)
+        rank = np.empty(count, dtype=np.int64)
+        rank[np.argsort(head, kind="stable")] = np.arange(count)
+
+        gref = np.empty(count, dtype=np.int64)
+        gref[group] = ref
+        gx, gy, gux, guy = px[gref], py[gref], ex[gref], ey[gref]
+        merged = np.empty((count, 4))
+        merged[rank] = np.column_stack([gx + g_lo * gux, gy + g_lo * guy,
+                                        gx + g_hi * gux, gy + g_hi * guy])
+        # Un segmento que quedó solo conserva sus extremos exactos
+        alone = np.bincount(group, minlength=count) == 1
+        merged[rank[group[alone[group]]]] = segments[alone[group]]
+
+        owner = rank[group][owner]
+        keep = np.argsort(owner, kind="stable")
+        self.segments = merged
+        self.support = self.support[keep]
+        self.owner = owner[keep]
+        return True
+
+
+def _keep_longest(segments, max_lines):
+    """Los `max_lines` segmentos más largos en su orden, y el largo del mayor descartado"""
+    if len(segments) <= max_lines:
+        return segments, 0.0
+    lengths = _lengths(segments)
+    order = np.argsort(-lengths, kind="stable")
+    return segments[np.sort(order[:max_lines])], float(lengths[order[max_lines]])
+
+
+def simplify_segments(segments, max_lines=None, max_error=None, min_length=0.0,
+                      max_angle=MAX_ANGLE):
+    """Reduce un arreglo (n, 4) de segmentos con un presupuesto de error o de líneas.
+
+    El error es la distancia máxima que se movió la geometría: el desvío de
+    las uniones de SegmentMerger o el largo del segmento descartado más
+    largo.
+
+    Con `max_error` se une con esa tolerancia y se descartan los fragmentos
+    más cortos que ella. Con `max_lines` la tolerancia se duplica desde
+    START_TOLERANCE (hasta MAX_TOLERANCE o `max_error` si se dio) y en cada
+    paso se conservan los `max_lines` segmentos más largos; se queda el
+    paso de menor error, que deja de bajar cuando el descarte ya es más
+    corto que la tolerancia. Con los dos presupuestos manda `max_error`: si
+    ningún paso lo cumple con `max_lines` segmentos se devuelve el
+    resultado de `max_error` solo, con más líneas, e info["over_max_lines"]
+    queda en True. Los segmentos más cortos que `min_length` se quitan
+    antes (la emisión PAT los descartaría igual) y no cuentan.
+
+    Devuelve (segmentos, info) con info = {"segments_in", "segments_out",
+    "tolerance", "error", "over_max_lines"} en las unidades de los
+    segmentos.
+    """
+    segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+    segments = segments[_lengths(segments) >= min_length]
+    info = {"segments_in": len(segments), "tolerance": 0.0, "error": 0.0,
+            "over_max_lines": False}
+
+    if max_lines is None:
+        if max_error:
+            merger = SegmentMerger(segments, max_angle)
+            segments, error = _within_error(merger, max_error)
+            info.update(tolerance=float(max_error), error=error)
+    elif len(segments) > max_lines:
+        limit = min(MAX_TOLERANCE, max_error) if max_error else MAX_TOLERANCE
+        merger = SegmentMerger(segments, max_angle)
+        best = None
+        tol = min(START_TOLERANCE, limit)
+        while True:
+            merger.merge(tol)
+            kept, dropped = _keep_longest(merger.segments, max_lines)
+            error = max(merger.error, dropped)
+            if best is None or error < best[1]:
+                best = (kept, error, tol)
+            if dropped <= tol or tol >= limit:
+                break
+            tol = min(tol * 2, limit)
+        segments, error, tol = best
+        if max_error and error > max_error:
+            # El presupuesto de líneas no se cumple sin pasarse del error
+            segments, error = _within_error(merger, max_error)
+            tol = max_error
+            info["over_max_lines"] = len(segments) > max_lines
+        info.update(tolerance=float(tol), error=float(error))
+    info["segments_out"] = len(segments)
+    return segments, info
+
+
+def _within_error(merger, max_error):
+    """Une con tolerancia `max_error` y descarta lo más corto: (segmentos, error)"""
+    merger.merge(max_error)
+    segments = merger.segments
+    lengths = _lengths(segments)
+    short = lengths < max_error
+    dropped = float(lengths[short].max()) if short.any() else 0.0
+    return segments[~short], max(merger.error, dropped)
+
+
+def merge_colinear(segments, tolerance, max_angle=3.0):
+    """Une segmentos colineales en bloque, sin error acotado (ver SegmentMerger).
+
+    Pensado para las detecciones de HoughLinesP, donde una misma recta
+    aparece repetida y partida. Ordena por ángulo y agrupa los que difieren
+    en menos de `max_angle`; dentro de cada grupo ordena por la distancia
+    al origen perpendicular a la dirección media y agrupa los que están a
+    menos de `tolerance`, sin que una recta abarque más de `tolerance`;
+    dentro de cada recta une los tramos cuyo hueco no supera `tolerance`.
+    Cada unión queda sobre la recta media ponderada por largo, entre las
+    proyecciones extremas.
+    """
+    segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+    n = len(segments)
+    if n < 2:
+        return segments
+    p, d = segments[:, :2], segments[:, 2:] - segments[:, :2]
+    lengths = np.maximum(_lengths(segments), 1e-12)
+    theta = np.degrees(np.arctan2(d[:, 1], d[:, 0])) % 180.0
+
+    angle_group = _angle_groups(theta, max_angle)
+
+    # Dirección media de cada grupo (ángulo doble: 0° y 180° son la misma recta)
+    rad = np.radians(2 * theta)
+    cs = np.bincount(angle_group, lengths * np.cos(rad))
+    sn = np.bincount(angle_group, lengths * np.sin(rad))
+    mean = np.arctan2(sn, cs)[angle_group] / 2
+    u = np.column_stack([np.cos(mean), np.sin(mean)])
+    normal = np.column_stack([-u[:, 1], u[:, 0]])
+    offset = (p * normal).sum(axis=1) + (d * normal).sum(axis=1) / 2
+    a = (p * u).sum(axis=1)
+    b = a + (d * u).sum(axis=1)
+    a, b = np.minimum(a, b), np.maximum(a, b)
+
+    line = _line_groups(angle_group, offset, tolerance)
+
+    # Tramos: une por intervalos dentro de cada recta. El máximo acumulado
+    # se separa por recta sumando un escalón mayor que cualquier extremo
+    order = np.lexsort([a, line])
+    span = float(np.abs(np.concatenate([a, b])).max()) * 2 + tolerance + 1
+    lifted = b[order] + line[order] * span
+    reach = np.maximum.accumulate(lifted)
+    starts = a[order] + line[order] * span
+    breaks = (np.diff(line[order]) != 0) | (starts[1:] > reach[:-1] + tolerance)
+    group = np.concatenate([[0], np.cumsum(breaks)])
+
+    weight = lengths[order]
+    count = group[-1] + 1
+    lo = np.full(count, np.inf)
+    hi = np.full(count, -np.inf)
+    np.minimum.at(lo, group, a[order])
+    np.maximum.at(hi, group, b[order])
+    level = np.bincount(group, weight * offset[order]) / np.bincount(group, weight)
+    first = np.concatenate([[0], np.flatnonzero(breaks) + 1])
+    gu, gn = u[order][first], normal[order][first]
+    return np.hstack([gu * lo[:, None] + gn * level[:, None],
+                      gu * hi[:, None] + gn * level[:, None]])
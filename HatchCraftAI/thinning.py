@@ -0,0 +1,185 @@
+import cv2
+import numpy as np
+
+
+# Desplazamiento (fila, columna) de cada vecino; su posición es el bit que
+# ocupa en el código de 8 bits que indexa las tablas: P2 (norte) = bit 0 y
+# luego en sentido horario hasta P9 (noroeste) = bit 7
+_NEIGHBOR_OFFSETS = ((-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1))
+
+# Los mismos pesos como kernel de correlación para calcular el código denso
+_CODE_KERNEL = np.zeros((3, 3), dtype=np.float32)
+for _bit, (_dr, _dc) in enumerate(_NEIGHBOR_OFFSETS):
+    _CODE_KERNEL[1 + _dr, 1 + _dc] = 1 << _bit
+
+METHODS = ("morphological", "zhang_suen", "guo_hall")
+
+
+def _bits(code):
+    return [(code >> k) & 1 for k in range(8)]
+
+
+def _zhang_suen_lut(step):
+    lut = np.zeros(256, dtype=np.uint8)
+    for code in range(256):
+        p2, p3, p4, p5, p6, p7, p8, p9 = _bits(code)
+        seq = [p2, p3, p4, p5, p6, p7, p8, p9, p2]
+        b = sum(seq[:8])
+        a = sum(1 for i in range(8) if seq[i] == 0 and seq[i + 1] == 1)
+        if step == 0:
+            m = p2 * p4 * p6 == 0 and p4 * p6 * p8 == 0
+        else:
+            m = p2 * p4 * p8 == 0 and p2 * p6 * p8 == 0
+        lut[code] = 2 <= b <= 6 and a == 1 and m
+    return lut
+
+
+def _guo_hall_lut(step):
+    lut = np.zeros(256, dtype=np.uint8)
+    for code in range(256):
+        p2, p3, p4, p5, p6, p7, p8, p9 = _bits(code)
+        c = ((not p2) and (p3 or p4)) + ((not p4) and (p5 or p6)) + \
+            ((not p6) and (p7 or p8)) + ((not p8) and (p9 or p2))
+        n1 = (p9 or p2) + (p3 or p4) + (p5 or p6) + (p7 or p8)
+        n2 = (p2 or p3) + (p4 or p5) + (p6 or p7) + (p8 or p9)
+        n = min(n1, n2)
+        if step == 0:
+            m = (p6 or p7 or not p9) and p8
+        else:
+            m = (p2 or p3 or not p5) and p4
+        lut[code] = c == 1 and 2 <= n <= 3 and not m
+    return lut
+
+
+# Tablas de borrado por sub-iteración, calculadas una sola vez
+_LUTS = {
+    "zhang_suen": (_zhang_suen_lut(0), _zhang_suen_lut(1)),
+    "guo_hall": (_guo_hall_lut(0), _guo_hall_lut(1)),
+}
+
+
+def _neighbors(flat, offsets, removed):
+    """Píxeles de primer plano vecinos de los recién borrados"""
+    touched = (removed[:, None] + offsets[None, :]).ravel()
+    return np.unique(touched[flat[touched] == 1])
+
+
+def _thin_lut(binary, luts, max_iter, sparse_ratio=32):
+    """Adelgazamiento por tablas sobre un único buffer preasignado.
+
+    La imagen se copia una vez con un borde de un píxel y se adelgaza
+    in-place. Mientras se borra mucho, cada sub-iteración es densa: el
+    código de 8 vecinos sale de un solo filter2D (pesos potencia de 2) y la
+    decisión de borrado de cv2.LUT. Cuando lo borrado en una pasada cae por
+    debajo de 1/`sparse_ratio` del primer plano, se sigue solo sobre los
+    vecinos de lo último borrado, que son los únicos que pueden cambiar.
+    """
+    h, w = binary.shape
+    stride = w + 2
+    padded = np.zeros((h + 2, stride), dtype=np.uint8)
+    np.greater(binary, 0, out=padded[1:-1, 1:-1])
+    flat = padded.reshape(-1)
+    code = np.empty_like(padded)
+    deletes = (np.empty_like(padded), np.empty_like(padded))
+
+    offsets = np.array(_NEIGHBOR_OFFSETS, dtype=np.intp)
+    offsets = offsets[:, 0] * stride + offsets[:, 1]
+
+    iterations = 0
+    threshold = max(1, cv2.countNonZero(padded) // sparse_ratio)
+
+    # Fase densa: todo el cuadro por pasada, con operaciones de OpenCV
+    pending = None
+    while iterations < max_iter:
+        iterations += 1
+        total = 0
+        for lut, delete in zip(luts, deletes):
+            cv2.filter2D(padded, cv2.CV_8U, _CODE_KERNEL, dst=code,
+                         borderType=cv2.BORDER_CONSTANT)
+            cv2.LUT(code, lut, dst=delete)
+            cv2.bitwise_and(delete, padded, dst=delete)
+            count = cv2.countNonZero(delete)
+            if count:
+                cv2.subtract(padded, delete, dst=padded)
+            total += count
+        if total == 0:
+            return _finish(padded, iterations)
+        if total < threshold:
+            # Cada tabla debe reevaluar los vecinos de lo borrado después
+            # de su última pasada
+            gone_0 = np.flatnonzero(deletes[0])
+            gone_1 = np.flatnonzero(deletes[1])
+            pending = [_neighbors(flat, offsets, np.concatenate([gone_0, gone_1])),
+                       _neighbors(flat, offsets, gone_1)]
+            break
+
+    # Fase dispersa: solo los candidatos cuyo vecindario cambió
+    while pending is not None and iterations < max_iter:
+        iterations += 1
+        changed = False
+        for step, lut in enumerate(luts):
+            cand = pending[step]
+            cand = cand[flat[cand] == 1]
+            pending[step] = cand[:0]
+            if len(cand) == 0:
+                continue
+
+            code_s = flat[cand + offsets[0]]
+            for bit in range(1, 8):
+                code_s |= flat[cand + offsets[bit]] << bit
+            gone = cand[lut[code_s] == 1]
+            if len(gone) == 0:
+                continue
+
+            changed = True
+            flat[gone] = 0
+            touched = _neighbors(flat, offsets, gone)
+            pending[step] = touched
+            pending[1 - step] = np.concatenate([pending[1 - step], touched])
+        if not changed:
+            break
+
+    return _finish(padded, iterations)
+
+
+def _finish(padded, iterations):
+    padded *= 255
+    return np.ascontiguousarray(padded[1:-1, 1:-1]), iterations
+
+
+def _thin_morphological(binary, max_iter):
+    """Skeleton clásico por erosión/apertura (motor original)"""
+    skeleton = np.zeros(binary.shape, np.uint8)
+    element = cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))
+    temp = binary.copy()
+    eroded = np.empty_like(temp)
+    opened = np.empty_like(temp)
+    iterations = 0
+    while iterations < max_iter:
+        iterations += 1
+        cv2.erode(temp, element, dst=eroded)
+        cv2.dilate(eroded, element, dst=opened)
+        cv2.subtract(temp, opened, dst=opened)
+        cv2.bitwise_or(skeleton, opened, dst=skeleton)
+        temp, eroded = eroded, temp
+        if cv2.countNonZero(temp) == 0:
+            break
+    return skeleton, iterations
+
+
+def thin(binary, method="morphological", max_iter=100):
+    """Reduce una imagen binaria (uint8, 0/255) a un skeleton de un píxel.
+
+    `method` puede ser "morphological" (el bucle de erosión/dilatación
+    original con buffers reutilizados, el más rápido y el de siempre) o
+    "zhang_suen" y "guo_hall" (tablas de 256 entradas aplicadas de forma
+    vectorizada: más lentos, pero dan un skeleton de un píxel sin ramas
+    sueltas). `max_iter` acota el número de pasadas.
+
+    Devuelve (skeleton, iteraciones).
+    """
+    if method not in METHODS:
+        raise ValueError(f"Método de adelgazamiento desconocido: {method}")
+    if method == "morphological":
+        return _thin_morphological(binary, max_iter)
+    return _thin_lut(binary, _LUTS[method], max_iter)
@@ -0,0 +1,228 @@
+import io
+import os
+import re
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+# Bytes por píxel de una tesela en proceso: blur, Canny, dilatación, los
+# buffers del thinning (imagen con borde, código y dos de borrado),
+# skeleton y las copias internas de findContours
+TILE_BYTES_PER_PIXEL = 12
+
+# Lado mínimo del núcleo de una tesela y múltiplo al que se redondea
+MIN_TILE = 256
+TILE_STEP = 64
+
+# Reducciones que el decodificador puede aplicar al leer (pirámide)
+_REDUCED_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+
+def image_pixels(image_bytes):
+    """Cantidad de píxeles leyendo solo la cabecera; None si Pillow no la reconoce.
+
+    Las imágenes que este modo quiere procesar superan a menudo el límite
+    de "decompression bomb" de Pillow: se ignora el aviso y, si Pillow se
+    niega a abrirla, la cantidad se toma del mensaje del error.
+    """
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+            with Image.open(io.BytesIO(image_bytes)) as img:
+                w, h = img.size
+                return w * h
+    except Image.DecompressionBombError as e:
+        match = re.search(r"\((\d+) pixels\)", str(e))
+        return int(match.group(1)) if match else None
+    except Exception:
+        return None
+
+
+def decode_gray_square(image_bytes, max_bytes):
+    """Decodifica en gris el cuadrado centrado usando a lo sumo ~`max_bytes`.
+
+    Si la imagen completa en gris no entra en la mitad del presupuesto se
+    decodifica reducida 2, 4 u 8 veces. Solo JPEG reduce durante la
+    lectura, sin pasar por la resolución completa; los demás formatos (PNG,
+    TIFF, ...) se decodifican completos y se reducen después, así que el
+    pico de memoria del decode es el de la imagen entera. Si ni reducida 8
+    veces entra se lanza ValueError. Devuelve (gris, reducción) o (None, 1)
+    si no se pudo decodificar.
+    """
+    pixels = image_pixels(image_bytes)
+    level = 1
+    if pixels is not None:
+        while pixels / level**2 > max_bytes / 2 and level < 8:
+            level *= 2
+        if pixels / level**2 > max_bytes / 2:
+            raise ValueError(f"La imagen ({pixels / 1e6:.0f} MP) no entra en "
+                             f"{max_bytes / 2**20:.1f} MB ni reducida {level} veces")
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    gray = cv2.imdecode(nparr, _REDUCED_FLAGS[level])
+    if gray is None:
+        return None, 1
+
+    h, w = gray.shape
+    side = min(h, w)
+    start_x = (w - side) // 2
+    start_y = (h - side) // 2
+    return gray[start_y:start_y + side, start_x:start_x + side], level
+
+
+def plan_tiles(side, margin, budget_bytes, workers):
+    """Núcleos (x0, y0, x1, y1) que cubren el cuadrado sin solaparse.
+
+    El lado del núcleo es el mayor múltiplo de TILE_STEP tal que `workers`
+    teselas con su margen entran en `budget_bytes`.
+    """
+    per_tile = max(budget_bytes, 0) / max(workers, 1) / TILE_BYTES_PER_PIXEL
+    core = int(np.sqrt(per_tile)) - 2 * margin
+    core = max(MIN_TILE, core // TILE_STEP * TILE_STEP)
+    core = min(core, side)
+    edges = list(range(0, side, core)) + [side]
+    return [(x0, y0, x1, y1)
+            for y0, y1 in zip(edges[:-1], edges[1:])
+            for x0, x1 in zip(edges[:-1], edges[1:])]
+
+
+def clip_segments(segments, x0, y0, x1, y1):
+    """Recorta segmentos (n, 4) al rectángulo [x0, x1] x [y0, y1] (Liang-Barsky)"""
+    p1 = segments[:, :2]
+    d = segments[:, 2:] - p1
+    t0 = np.zeros(len(segments))
+    t1 = np.ones(len(segments))
+    keep = np.ones(len(segments), dtype=bool)
+    for axis, lo, hi in ((0, x0, x1), (1, y0, y1)):
+        for p, q in ((-d[:, axis], p1[:, axis] - lo), (d[:, axis], hi - p1[:, axis])):
+            parallel = p == 0
+            keep &= ~(parallel & (q < 0))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                r = q / p
+            t0 = np.where(~parallel & (p < 0), np.maximum(t0, r), t0)
+            t1 = np.where(~parallel & (p > 0), np.minimum(t1, r), t1)
+    keep &= t0 < t1
+    t0, t1 = t0[keep, None], t1[keep, None]
+    return np.hstack([p1[keep] + t0 * d[keep], p1[keep] + t1 * d[keep]])
+
+
+def _nearest_seam(values, seams, tol=1e-6):
+    """Índice de la costura sobre la que cae cada valor, o -1"""
+    idx = np.clip(np.searchsorted(seams, values), 1, len(seams) - 1) if len(seams) > 1 \
+        else np.zeros(len(values), dtype=np.intp)
+    below = np.maximum(idx - 1, 0)
+    idx = np.where(np.abs(values - seams[below]) < np.abs(values - seams[idx]), below, idx)
+    return np.where(np.abs(values - seams[idx]) <= tol, idx, -1)
+
+
+def _stitch_axis(segments, seams, axis, tol, min_cos):
+    """Une los tramos cortados en las costuras perpendiculares a `axis`.
+
+    Un tramo que llega a la costura se une con otro que sale de ella en la
+    misma dirección y cuyo inicio queda a menos de `tol` de la recta del
+    primero (sobre la costura ese punto puede correrse más cuanto más
+    rasante es la línea); el resultado va del inicio del primero al final
+    del segundo. Los contornos del skeleton recorren cada línea ida y
+    vuelta, así cada sentido se une por separado.
+    """
+    if not len(segments) or not len(seams):
+        return segments
+    seams = np.asarray(seams, dtype=np.float64)
+    starts, ends = segments[:, :2], segments[:, 2:]
+    d = ends - starts
+    unit = d / np.maximum(np.hypot(d[:, 0], d[:, 1]), 1e-12)[:, None]
+    arrive = _nearest_seam(ends[:, axis], seams)
+    leave = _nearest_seam(starts[:, axis], seams)
+
+    other = 1 - axis
+    following = {}
+    used = np.zeros(len(segments), dtype=bool)
+    for seam in np.unique(leave[leave >= 0]).tolist():
+        cand = np.flatnonzero(leave == seam)
+        cand = cand[np.argsort(starts[cand, other], kind="stable")]
+        pos = starts[cand, other]
+        for i in np.flatnonzero(arrive == seam).tolist():
+            window = tol / max(abs(unit[i, axis]), 0.1)
+            lo = np.searchsorted(pos, ends[i, other] - window)
+            hi = np.searchsorted(pos, ends[i, other] + window, side="right")
+            best, best_dist = None, tol
+            for j in cand[lo:hi].tolist():
+                if j == i or used[j] or unit[i] @ unit[j] < min_cos:
+                    continue
+                gap = starts[j] - ends[i]
+                dist = abs(unit[i, 0] * gap[1] - unit[i, 1] * gap[0])
+                if dist <= best_dist:
+                    best, best_dist = j, dist
+            if best is not None:
+                used[best] = True
+                following[i] = best
+
+    # Cada cadena i → j → k ... se reemplaza por un segmento desde el
+    # inicio de su primer tramo hasta el final del último
+    heads = [i for i in following if not used[i]]
+    keep = ~used
+    keep[heads] = False
+    joined = []
+    for i in heads:
+        j = i
+        while j in following:
+            j = following[j]
+        joined.append([*starts[i], *ends[j]])
+    return np.vstack([segments[keep], np.array(joined, dtype=np.float64).reshape(-1, 4)])
+
+
+def stitch_segments(segments, seams_x, seams_y, tol=2.0, max_angle=10.0):
+    """Une los segmentos que las costuras de las teselas partieron en dos"""
+    min_cos = np.cos(np.radians(max_angle))
+    segments = _stitch_axis(segments, seams_x, 0, tol, min_cos)
+    return _stitch_axis(segments, seams_y, 1, tol, min_cos)
+
+
+def process_tiled(gray, tile_fn, margin, budget_bytes, workers=None):
+    """Aplica `tile_fn` por teselas con margen y junta los segmentos.
+
+    `tile_fn(tesela)` recibe la región del núcleo ampliada en `margin`
+    píxeles (recortada al borde de la imagen) y devuelve (segmentos (n, 4)
+    y origen (m, 2) de la caja de cada contorno, ambos en coordenadas de la
+    tesela). Cada segmento se traslada a coordenadas globales y se recorta
+    al núcleo, así cada parte del dibujo pertenece a una sola tesela; luego
+    se unen los tramos cortados en las costuras. Por lo mismo solo se
+    cuentan los contornos cuya caja empieza dentro del núcleo (los del
+    margen los cuenta la tesela vecina). Las teselas se procesan en `workers` hilos
+    (OpenCV libera el GIL).
+
+    Devuelve (segmentos globales en píxeles, contornos, teselas).
+    """
+    side = gray.shape[0]
+    workers = workers or os.cpu_count() or 1
+    tiles = plan_tiles(side, margin, budget_bytes, workers)
+
+    def run(core):
+        x0, y0, x1, y1 = core
+        wx0, wy0 = max(0, x0 - margin), max(0, y0 - margin)
+        wx1, wy1 = min(side, x1 + margin), min(side, y1 + margin)
+        segments, origins = tile_fn(gray[wy0:wy1, wx0:wx1])
+        segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4) + (wx0, wy0, wx0, wy0)
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 2) + (wx0, wy0)
+        inside = ((origins >= (x0, y0)) & (origins < (x1, y1))).all(axis=1)
+        return clip_segments(segments, x0, y0, x1, y1), int(np.count_nonzero(inside))
+
+    if workers > 1 and len(tiles) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(run, tiles))
+    else:
+        results = [run(core) for core in tiles]
+
+    segments = np.concatenate([r[0] for r in results]) if results else np.zeros((0, 4))
+    contours = sum(r[1] for r in results)
+    seams = sorted({x0 for x0, _, _, _ in tiles if x0 > 0})
+    segments = stitch_segments(segments, seams, seams)
+    return segments, contours, len(tiles)